@@ -0,0 +1,304 @@
+"""
+Benchmark FirstUseAuthenticator throughput and latency.
+
+Measures authenticate (repeat and first-use logins), reset_password,
+delete_user and the startup _check_passwords scan,
+for each combination of store size, password store backend (and dbm flavor),
+bcrypt cost and concurrency level.
+
+Examples:
+
+    # quick run
+    python benchmarks/bench_authenticator.py
+
+    # larger stores, every backend, save results as the baseline
+    python benchmarks/bench_authenticator.py --users 1000 100000 1000000 \\
+        --stores dbm.dumb dbm.gnu dbm.ndbm sqlite --save-baseline baseline.json
+
+    # compare against a baseline, failing if anything got >20% slower
+    python benchmarks/bench_authenticator.py --baseline baseline.json --tolerance 0.2
+
+Baselines are machine-specific,
+so they should be recorded on the same kind of machine they are compared on.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from itertools import islice
+from unittest import mock
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.hashers import BcryptHasher
+from firstuseauthenticator.stores import DBMPasswordStore, SQLitePasswordStore
+
+OPERATIONS = ("login", "first_use", "reset_password", "delete_user", "check_passwords")
+PASSWORD = "benchmark-password"
+
+
+def _available_stores():
+    stores = ["sqlite"]
+    for flavor in ("dbm.dumb", "dbm.gnu", "dbm.ndbm"):
+        try:
+            importlib.import_module(flavor)
+        except ImportError:
+            continue
+        stores.append(flavor)
+    return stores
+
+
+def _populate(store_name, path, n_users, rounds):
+    """Create a store with n_users, all with the same password"""
+    hashed = BcryptHasher(rounds=rounds).hash(PASSWORD.encode("utf8"))
+    if store_name == "sqlite":
+        store = SQLitePasswordStore(path=path, import_dbm_path="")
+    else:
+        # create the file with the requested flavor,
+        # DBMPasswordStore opens existing files with whichever flavor created them
+        module = importlib.import_module(store_name)
+        module.open(path, "n", 0o600).close()
+        store = DBMPasswordStore(path=path)
+    users = (f"user{i}" for i in range(n_users))
+    while True:
+        chunk = list(islice(users, 10000))
+        if not chunk:
+            break
+        store.set_many((username, hashed) for username in chunk)
+    store.close()
+
+
+def _make_authenticator(store_name, path, rounds):
+    kwargs = dict(
+        bcrypt_rounds=rounds,
+        check_passwords_on_startup=False,
+        rehash_on_login=False,
+    )
+    if store_name == "sqlite":
+        kwargs["password_store_class"] = SQLitePasswordStore
+        auth = FirstUseAuthenticator(**kwargs)
+        auth.password_store.path = path
+        auth.password_store.import_dbm_path = ""
+    else:
+        auth = FirstUseAuthenticator(dbm_path=path, **kwargs)
+    return auth
+
+
+async def _run_concurrently(func, n_calls, concurrency):
+    """Call func(i) n_calls times, with up to concurrency calls at once
+
+    Returns (latencies, wall time).
+    """
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(i):
+        async with semaphore:
+            tic = time.perf_counter()
+            await func(i)
+            latencies.append(time.perf_counter() - tic)
+
+    tic = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(n_calls)))
+    return latencies, time.perf_counter() - tic
+
+
+def _summarize(latencies, wall_time):
+    latencies = sorted(latencies)
+
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    return {
+        "calls": len(latencies),
+        "p50": percentile(50),
+        "p99": percentile(99),
+        "mean": statistics.mean(latencies),
+        "ops_per_second": len(latencies) / wall_time if wall_time else 0,
+    }
+
+
+async def _bench_operation(operation, auth, n_users, n_calls, concurrency):
+    handler = mock.Mock()
+    n_calls = min(n_calls, n_users)
+
+    if operation == "login":
+
+        async def func(i):
+            username = await auth.authenticate(
+                handler, {"username": f"user{i % n_users}", "password": PASSWORD}
+            )
+            assert username, "login failed"
+
+    elif operation == "first_use":
+
+        async def func(i):
+            username = await auth.authenticate(
+                handler, {"username": f"newuser{i}", "password": PASSWORD}
+            )
+            assert username, "first use failed"
+
+    elif operation == "reset_password":
+
+        async def func(i):
+            await auth.reset_password(f"user{i % n_users}", PASSWORD)
+
+    elif operation == "delete_user":
+
+        async def func(i):
+            user = mock.Mock()
+            user.name = f"user{n_users - 1 - i}"
+            await auth.delete_user(user)
+
+    elif operation == "check_passwords":
+        # a full scan, so always serial and once
+        marker = auth.password_store.path + "-checked"
+        if os.path.exists(marker):
+            os.remove(marker)
+        tic = time.perf_counter()
+        auth._check_passwords()
+        duration = time.perf_counter() - tic
+        return _summarize([duration], duration)
+
+    else:
+        raise ValueError(f"Unknown operation {operation}")
+
+    latencies, wall_time = await _run_concurrently(func, n_calls, concurrency)
+    return _summarize(latencies, wall_time)
+
+
+async def run_benchmarks(args):
+    results = []
+    for store_name in args.stores:
+        for n_users in args.users:
+            for rounds in args.rounds:
+                for concurrency in args.concurrency:
+                    for operation in args.operations:
+                        if operation == "check_passwords" and (
+                            store_name == "sqlite" or concurrency != args.concurrency[0]
+                        ):
+                            # only run for dbm, and not affected by concurrency
+                            continue
+                        with tempfile.TemporaryDirectory() as td:
+                            ext = ".sqlite" if store_name == "sqlite" else ".dbm"
+                            path = os.path.join(td, "passwords" + ext)
+                            _populate(store_name, path, n_users, rounds)
+                            auth = _make_authenticator(store_name, path, rounds)
+                            auth.hash_executor_workers = max(
+                                auth.hash_executor_workers, concurrency
+                            )
+                            try:
+                                summary = await _bench_operation(
+                                    operation, auth, n_users, args.calls, concurrency
+                                )
+                            finally:
+                                auth.password_store.close()
+                                auth.hash_executor.shutdown()
+                                auth.io_executor.shutdown()
+                        result = dict(
+                            store=store_name,
+                            users=n_users,
+                            rounds=rounds,
+                            concurrency=concurrency,
+                            operation=operation,
+                            **summary,
+                        )
+                        results.append(result)
+                        print(_format_result(result), flush=True)
+    return results
+
+
+def _key(result):
+    return (
+        result["store"],
+        result["users"],
+        result["rounds"],
+        result["concurrency"],
+        result["operation"],
+    )
+
+
+def _format_result(result):
+    return (
+        f"{result['store']:>9} users={result['users']:<8} rounds={result['rounds']:<2}"
+        f" concurrency={result['concurrency']:<3} {result['operation']:<16}"
+        f" p50={result['p50'] * 1e3:8.2f}ms p99={result['p99'] * 1e3:8.2f}ms"
+        f" {result['ops_per_second']:9.1f}/s"
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of regressions compared to baseline
+
+    A regression is a p99 latency more than tolerance higher than the baseline's.
+    """
+    baseline = {_key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = baseline.get(_key(result))
+        if base is None:
+            continue
+        if result["p99"] > base["p99"] * (1 + tolerance):
+            regressions.append(
+                f"{_format_result(result)}"
+                f" (baseline p99={base['p99'] * 1e3:.2f}ms)"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000])
+    parser.add_argument(
+        "--stores",
+        nargs="+",
+        default=None,
+        help="Backends: sqlite and/or dbm flavors (dbm.dumb, dbm.gnu, dbm.ndbm)."
+        " Defaults to all available.",
+    )
+    parser.add_argument("--rounds", type=int, nargs="+", default=[4])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument(
+        "--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS)
+    )
+    parser.add_argument(
+        "--calls", type=int, default=100, help="Number of calls per measurement"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--save-baseline", help="Write results as a baseline")
+    parser.add_argument("--baseline", help="Compare results to this baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Fraction by which p99 latency may exceed the baseline",
+    )
+    args = parser.parse_args(argv)
+    if not args.stores:
+        args.stores = _available_stores()
+
+    results = asyncio.run(run_benchmarks(args))
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("Regressions:", file=sys.stderr)
+            for regression in regressions:
+                print("  " + regression, file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
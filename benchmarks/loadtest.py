@@ -0,0 +1,337 @@
+"""
+Load-test FirstUseAuthenticator through a real JupyterHub.
+
+Starts a local JupyterHub with FirstUseAuthenticator
+(and no proxy, and a spawner that is never started),
+then drives concurrent first logins, repeat logins and password changes over HTTP,
+through the login and change-password pages, with XSRF tokens and cookies
+like a browser.
+Reports throughput and latency per phase,
+and the Hub's event-loop lag from its event_loop_interval_seconds metric.
+
+Examples:
+
+    # quick run
+    python benchmarks/loadtest.py --users 100 --concurrency 10
+
+    # try the configuration planned for the semester
+    python benchmarks/loadtest.py --users 2000 --concurrency 200 --config jupyterhub_config.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PHASES = ("first_login", "repeat_login", "change_password")
+
+HUB_CONFIG = """
+from jupyterhub.proxy import Proxy
+
+
+class NoProxy(Proxy):
+    # requests go straight to the Hub, so routes are only kept in memory
+    should_start = False
+    routes = {{}}
+
+    async def add_route(self, routespec, target, data):
+        self.routes[routespec] = {{"routespec": routespec, "target": target, "data": data}}
+
+    async def delete_route(self, routespec):
+        self.routes.pop(routespec, None)
+
+    async def get_all_routes(self):
+        return dict(self.routes)
+
+
+c.JupyterHub.proxy_class = NoProxy
+c.JupyterHub.hub_ip = "127.0.0.1"
+c.JupyterHub.hub_port = {port}
+c.JupyterHub.authenticate_prometheus = False
+c.JupyterHub.authenticator_class = "firstuseauthenticator.FirstUseAuthenticator"
+c.JupyterHub.spawner_class = "simple"
+c.Authenticator.allow_all = True
+c.FirstUseAuthenticator.bcrypt_rounds = {rounds}
+
+if {config!r}:
+    load_subconfig({config!r})
+"""
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Browser:
+    """Just enough of a browser to log in to JupyterHub: cookies and XSRF tokens"""
+
+    def __init__(self, client, hub_url):
+        self.client = client
+        self.hub_url = hub_url
+        self.cookies = {}
+
+    async def fetch(self, path, body=None):
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        request = HTTPRequest(
+            self.hub_url + path,
+            method="GET" if body is None else "POST",
+            body=None if body is None else urlencode(body),
+            headers=headers,
+            follow_redirects=False,
+        )
+        try:
+            response = await self.client.fetch(request, raise_error=False)
+        except HTTPClientError as e:
+            response = e.response
+        for header in response.headers.get_list("Set-Cookie"):
+            for name, morsel in SimpleCookie(header).items():
+                self.cookies[name] = morsel.value
+        return response
+
+    async def form(self, path):
+        """GET a page, and return the XSRF token from its form"""
+        response = await self.fetch(path)
+        match = re.search(rb'name="_xsrf" value="([^"]+)"', response.body)
+        if not match:
+            raise RuntimeError(f"No XSRF token in {path} ({response.code})")
+        return match.group(1).decode()
+
+    async def login(self, username, password):
+        xsrf = await self.form("/hub/login")
+        response = await self.fetch(
+            "/hub/login", {"username": username, "password": password, "_xsrf": xsrf}
+        )
+        if response.code != 302:
+            raise RuntimeError(f"Login failed for {username} ({response.code})")
+
+    async def change_password(self, password):
+        xsrf = await self.form("/hub/auth/change-password")
+        response = await self.fetch(
+            "/hub/auth/change-password", {"password": password, "_xsrf": xsrf}
+        )
+        if response.code != 200 or b"success" not in response.body:
+            raise RuntimeError(f"Password change failed ({response.code})")
+
+
+def _event_loop_metrics(text):
+    """Return (sum, count, {bucket: cumulative count}) of the Hub's event-loop interval"""
+    total = count = 0
+    buckets = {}
+    for line in text.splitlines():
+        if line.startswith("jupyterhub_event_loop_interval_seconds_sum"):
+            total = float(line.split()[-1])
+        elif line.startswith("jupyterhub_event_loop_interval_seconds_count"):
+            count = float(line.split()[-1])
+        elif line.startswith("jupyterhub_event_loop_interval_seconds_bucket"):
+            le = re.search(r'le="([^"]+)"', line).group(1)
+            buckets[float(le)] = float(line.split()[-1])
+    return total, count, buckets
+
+
+async def _scrape(client, hub_url):
+    response = await client.fetch(hub_url + "/hub/metrics")
+    return _event_loop_metrics(response.body.decode("utf8"))
+
+
+def _loop_lag(before, after):
+    """Mean, p99 and max event-loop interval between two scrapes
+
+    p99 and max are the upper bounds of their histogram buckets.
+    """
+    total = after[0] - before[0]
+    count = after[1] - before[1]
+    if not count:
+        return None, None, None
+    p99 = longest = None
+    below = 0
+    for le in sorted(after[2]):
+        in_bucket = after[2][le] - before[2].get(le, 0)
+        if p99 is None and in_bucket >= 0.99 * count:
+            p99 = le
+        if in_bucket > below:
+            longest = le
+        below = in_bucket
+    return total / count, p99, longest
+
+
+async def _run_phase(phase, args, client, hub_url):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+    errors = []
+
+    async def one(i):
+        username = f"loadtest-{args.run_id}-{i}"
+        browser = Browser(client, hub_url)
+        async with semaphore:
+            tic = time.perf_counter()
+            try:
+                await browser.login(username, "password")
+                if phase == "change_password":
+                    await browser.change_password("password")
+            except Exception as e:
+                errors.append(str(e))
+                return
+            latencies.append(time.perf_counter() - tic)
+
+    before = await _scrape(client, hub_url)
+    tic = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.users)))
+    wall_time = time.perf_counter() - tic
+    lag_mean, lag_p99, lag_max = _loop_lag(before, await _scrape(client, hub_url))
+
+    latencies.sort()
+
+    def percentile(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+    return {
+        "phase": phase,
+        "requests": args.users,
+        "errors": len(errors),
+        "first_error": errors[0] if errors else None,
+        "seconds": wall_time,
+        "per_second": len(latencies) / wall_time,
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": latencies[-1] if latencies else None,
+        "mean": statistics.mean(latencies) if latencies else None,
+        "loop_lag_mean": lag_mean,
+        "loop_lag_p99": lag_p99,
+        "loop_lag_max": lag_max,
+    }
+
+
+def _format_result(result):
+    def ms(seconds):
+        return "     n/a" if seconds is None else f"{seconds * 1e3:7.1f}ms"
+
+    return (
+        f"{result['phase']:<16} {result['per_second']:7.1f}/s"
+        f" p50={ms(result['p50'])} p95={ms(result['p95'])} p99={ms(result['p99'])}"
+        f" errors={result['errors']}"
+        f" loop lag mean={ms(result['loop_lag_mean'])}"
+        f" p99<={ms(result['loop_lag_p99'])} max<={ms(result['loop_lag_max'])}"
+    )
+
+
+async def _wait_for_hub(client, hub_url, process, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"JupyterHub exited with status {process.returncode}")
+        try:
+            await client.fetch(hub_url + "/hub/api", raise_error=True)
+            return
+        except Exception:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"JupyterHub did not start within {timeout}s")
+
+
+async def run_loadtest(args):
+    hub_url = f"http://127.0.0.1:{args.port}"
+    AsyncHTTPClient.configure(None, max_clients=args.concurrency)
+    client = AsyncHTTPClient()
+    with tempfile.TemporaryDirectory() as td:
+        with open(os.path.join(td, "jupyterhub_config.py"), "w") as f:
+            f.write(
+                HUB_CONFIG.format(
+                    port=args.port,
+                    rounds=args.rounds,
+                    config=os.path.abspath(args.config) if args.config else "",
+                )
+            )
+        # the Hub runs in the temporary directory, and tests the authenticator in this checkout
+        env = dict(os.environ)
+        python_path = [repo_root]
+        if env.get("PYTHONPATH"):
+            python_path.extend(
+                os.path.abspath(path) for path in env["PYTHONPATH"].split(os.pathsep)
+            )
+        env["PYTHONPATH"] = os.pathsep.join(python_path)
+        log = open(os.path.join(td, "jupyterhub.log"), "w")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "jupyterhub", "-f", "jupyterhub_config.py"],
+            cwd=td,
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+        try:
+            await _wait_for_hub(client, hub_url, process, args.startup_timeout)
+            results = []
+            for phase in args.phases:
+                result = await _run_phase(phase, args, client, hub_url)
+                print(_format_result(result), flush=True)
+                results.append(result)
+        finally:
+            process.terminate()
+            process.wait()
+            log.close()
+            if args.hub_log:
+                with open(os.path.join(td, "jupyterhub.log")) as f:
+                    sys.stderr.write(f.read())
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=100, help="Number of users per phase")
+    parser.add_argument(
+        "--concurrency", type=int, default=10, help="Number of concurrent browsers"
+    )
+    parser.add_argument(
+        "--phases",
+        nargs="+",
+        choices=PHASES,
+        default=list(PHASES),
+        help="Phases to run, in order. Each one logs in every user once.",
+    )
+    parser.add_argument(
+        "--rounds",
+        type=int,
+        default=12,
+        help="bcrypt rounds (overridden by --config)",
+    )
+    parser.add_argument(
+        "--config", help="jupyterhub_config.py with the configuration to test"
+    )
+    parser.add_argument("--port", type=int, default=0, help="Hub port (default: any free port)")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument(
+        "--hub-log", action="store_true", help="Print the Hub's log at the end"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    args = parser.parse_args(argv)
+    if not args.port:
+        args.port = _free_port()
+    # unique usernames, so that first logins are first logins
+    args.run_id = int(time.time())
+
+    results = asyncio.run(run_loadtest(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+    return 1 if any(result["errors"] for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
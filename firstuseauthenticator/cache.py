@@ -0,0 +1,71 @@
+"""
+In-memory cache of recently verified credentials.
+"""
+import hashlib
+import hmac
+import os
+import time
+from collections import OrderedDict
+
+from .metrics import CREDENTIAL_CACHE_REQUESTS
+
+
+class CredentialCache:
+    """LRU cache of successful password verifications, with a TTL
+
+    Entries map a username to a keyed digest of the password
+    (HMAC-SHA256 with a secret that only lives in this process),
+    so plaintext passwords are never kept in memory.
+    Each entry also records the stored hash it was verified against,
+    so a password changed in the store (e.g. by another Hub) is never
+    accepted from the cache.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._secret = os.urandom(32)
+        # username: (password digest, stored hash, expiry time)
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _digest(self, username, password):
+        msg = username.encode("utf8") + b"\0" + password.encode("utf8")
+        return hmac.new(self._secret, msg, hashlib.sha256).digest()
+
+    def check(self, username, password, stored_hash):
+        """Return True if this password was recently verified for this user"""
+        entry = self._entries.get(username)
+        if entry is not None:
+            digest, entry_hash, expires = entry
+            if time.monotonic() > expires:
+                del self._entries[username]
+            elif entry_hash == stored_hash and hmac.compare_digest(
+                digest, self._digest(username, password)
+            ):
+                self._entries.move_to_end(username)
+                self.hits += 1
+                CREDENTIAL_CACHE_REQUESTS.labels(result="hit").inc()
+                return True
+        self.misses += 1
+        CREDENTIAL_CACHE_REQUESTS.labels(result="miss").inc()
+        return False
+
+    def add(self, username, password, stored_hash):
+        """Record a successful verification"""
+        self._entries[username] = (
+            self._digest(username, password),
+            stored_hash,
+            time.monotonic() + self.ttl,
+        )
+        self._entries.move_to_end(username)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, username):
+        """Forget any verification for username"""
+        self._entries.pop(username, None)
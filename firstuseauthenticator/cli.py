@@ -0,0 +1,328 @@
+"""
+Offline maintenance of the FirstUseAuthenticator password db.
+
+Run `firstuseauthenticator --help` for usage.
+
+The authenticator is configured from jupyterhub_config.py (if found),
+so the same password store and hashing configuration is used as in the Hub.
+These commands should be run while the Hub is stopped.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+from collections import Counter
+from itertools import islice
+
+from tornado import web
+from traitlets.config import Config, PyFileConfigLoader
+
+from .firstuseauthenticator import FirstUseAuthenticator, _parse_password_batch
+from .hashers import identify_hasher
+from .stores import DBMPasswordStore, RedisPasswordStore, SQLitePasswordStore
+
+STORES = {
+    "dbm": DBMPasswordStore,
+    "sqlite": SQLitePasswordStore,
+    "redis": RedisPasswordStore,
+}
+
+# number of users to process in each batch
+CHUNK_SIZE = 1000
+
+
+def _chunks(iterable, size=CHUNK_SIZE):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _load_authenticator(args):
+    """Create the FirstUseAuthenticator to work with from the command-line args"""
+    config = Config()
+    if args.config and os.path.exists(args.config):
+        loader = PyFileConfigLoader(
+            os.path.basename(args.config), os.path.dirname(os.path.abspath(args.config))
+        )
+        config = loader.load_config()
+    kwargs = {}
+    if args.dbm_path:
+        kwargs["dbm_path"] = args.dbm_path
+    if args.store:
+        kwargs["password_store_class"] = STORES[args.store]
+    if args.workers:
+        kwargs["hash_executor_workers"] = args.workers
+    if args.processes:
+        kwargs["hash_executor_type"] = "process"
+    log = logging.getLogger("firstuseauthenticator")
+    return FirstUseAuthenticator(
+        config=config, log=log, check_passwords_on_startup=False, **kwargs
+    )
+
+
+def check(auth, args):
+    """Check for and fix passwords stored under non-normalized usernames"""
+    auth._run_check_passwords(full=args.full)
+
+
+def compact(auth, args):
+    """Reclaim disk space left by deleted users"""
+    store = auth.password_store
+    before = sum(os.path.getsize(path) for path in store.files())
+    store.compact()
+    after = sum(os.path.getsize(path) for path in store.files())
+    print(f"Compacted {before} bytes to {after} bytes")
+
+
+def export(auth, args):
+    """Export password hashes as JSON lines"""
+    store = auth.password_store
+    count = 0
+    for username in store.keys():
+        hashed = store.get(username)
+        if hashed is None:
+            continue
+        args.output.write(
+            json.dumps({"name": username, "hash": hashed.decode("ascii")}) + "\n"
+        )
+        count += 1
+    auth.log.info("Exported %i users", count)
+
+
+def _read_jsonl(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+async def import_(auth, args):
+    """Import users from JSON lines, with either a hash or a password"""
+    store = auth.password_store
+    count = 0
+    errors = 0
+    for chunk in _chunks(_read_jsonl(args.input)):
+        hashes = []
+        passwords = {}
+        for user in chunk:
+            if not user.get("name") or not (user.get("hash") or user.get("password")):
+                auth.log.error("Not importing %s: needs a name and a hash or password", user)
+                errors += 1
+                continue
+            if user.get("hash"):
+                hashed = user["hash"].encode("ascii")
+                if identify_hasher(hashed) is None:
+                    auth.log.error("Unrecognized hash format for %s", user["name"])
+                    errors += 1
+                    continue
+                hashes.append((auth.normalize_username(user["name"]), hashed))
+            else:
+                passwords[user["name"]] = user["password"]
+        store.set_many(hashes)
+        count += len(hashes)
+        if passwords:
+            results = await auth.set_passwords(passwords)
+            for username, error in results.items():
+                if error:
+                    auth.log.error("Not importing %s: %s", username, error)
+                    errors += 1
+                else:
+                    count += 1
+    auth.log.info("Imported %i users", count)
+    return 1 if errors else 0
+
+
+def _location(store):
+    """Where a store keeps its data, for messages"""
+    if store.has_trait("path"):
+        return os.path.abspath(store.path)
+    return store.url
+
+
+def migrate(auth, args):
+    """Copy all password hashes to another store"""
+    source = auth.password_store
+    dest = STORES[args.to](parent=auth, log=auth.log)
+    if args.to_path:
+        if dest.has_trait("path"):
+            dest.path = args.to_path
+        else:
+            dest.url = args.to_path
+    if type(dest) is type(source) and _location(dest) == _location(source):
+        auth.log.error("Cannot migrate %s to itself", _location(source))
+        return 1
+    if isinstance(dest, SQLitePasswordStore):
+        # we are copying explicitly
+        dest.import_dbm_path = ""
+    count = 0
+    for chunk in _chunks(source.keys()):
+        dest.set_many((username, source.get(username)) for username in chunk)
+        count += len(chunk)
+    dest.close()
+    auth.log.info(
+        "Copied %i users from %s to %s", count, _location(source), _location(dest)
+    )
+
+
+def stats(auth, args):
+    """Print statistics about the password db"""
+    store = auth.password_store
+    algorithms = Counter()
+    needs_rehash = 0
+    count = 0
+    for username in store.keys():
+        hashed = store.get(username)
+        count += 1
+        algorithms[identify_hasher(hashed) or "unknown"] += 1
+        if auth._needs_rehash(hashed):
+            needs_rehash += 1
+    files = store.files()
+    info = {
+        "store": type(store).__name__,
+        "path": _location(store),
+        "users": count,
+        "size": sum(os.path.getsize(path) for path in files),
+        "files": files,
+        "algorithms": dict(algorithms),
+        "needs_rehash": needs_rehash,
+    }
+    print(json.dumps(info, indent=1))
+
+
+async def rehash(auth, args):
+    """Rehash known passwords with the configured algorithm, in parallel
+
+    Password hashes cannot be upgraded without the password,
+    so this takes the known passwords of users (e.g. from provisioning),
+    in the same JSON or CSV formats as the batch password API.
+    Only users whose stored hash matches the given password
+    and needs rehashing are updated.
+    Other users are rehashed on their next login (rehash_on_login).
+    """
+    body = args.input.read()
+    content_type = "text/csv" if args.input.name.endswith(".csv") else "application/json"
+    try:
+        users = _parse_password_batch(body, content_type)
+    except web.HTTPError as e:
+        auth.log.error("Cannot read %s: %s", args.input.name, e.log_message)
+        return 1
+    store = auth.password_store
+
+    async def rehash_one(username, password):
+        stored = store.get(username)
+        if stored is None or not auth._needs_rehash(stored):
+            return None
+        if not await auth._verify_password(password, stored, bounded=False):
+            auth.log.warning("Password for %s does not match, not rehashing", username)
+            return None
+        return (username, await auth._hash_password(password, bounded=False))
+
+    count = 0
+    for chunk in _chunks(users):
+        results = await asyncio.gather(
+            *(
+                rehash_one(auth.normalize_username(name), password)
+                for name, password in chunk
+                if password
+            )
+        )
+        rehashed = [result for result in results if result is not None]
+        store.set_many(rehashed)
+        count += len(rehashed)
+    auth.log.info("Rehashed %i passwords with %s", count, auth.password_hash_algorithm)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        "firstuseauthenticator",
+        description="Maintain the FirstUseAuthenticator password db. Run while the Hub is stopped.",
+    )
+    parser.add_argument(
+        "-f",
+        "--config",
+        default="jupyterhub_config.py",
+        help="JupyterHub config file to load FirstUseAuthenticator config from",
+    )
+    parser.add_argument(
+        "--dbm-path", help="Override FirstUseAuthenticator.dbm_path from config"
+    )
+    parser.add_argument(
+        "--store",
+        choices=list(STORES),
+        help="Override FirstUseAuthenticator.password_store_class from config",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Number of parallel workers for hashing"
+    )
+    parser.add_argument(
+        "--processes",
+        action="store_true",
+        help="Hash in worker processes instead of threads",
+    )
+    parser.add_argument(
+        "--debug", action="store_true", help="Enable debug logging"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    check_parser = subparsers.add_parser("check", help=check.__doc__)
+    check_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Scan every username, even if the db is unchanged since the last check",
+    )
+    check_parser.set_defaults(func=check)
+    subparsers.add_parser("compact", help=compact.__doc__).set_defaults(func=compact)
+    subparsers.add_parser("stats", help=stats.__doc__).set_defaults(func=stats)
+
+    export_parser = subparsers.add_parser("export", help=export.__doc__)
+    export_parser.add_argument(
+        "output", nargs="?", type=argparse.FileType("w"), default=sys.stdout
+    )
+    export_parser.set_defaults(func=export)
+
+    import_parser = subparsers.add_parser("import", help=import_.__doc__)
+    import_parser.add_argument(
+        "input", nargs="?", type=argparse.FileType("r"), default=sys.stdin
+    )
+    import_parser.set_defaults(func=import_)
+
+    migrate_parser = subparsers.add_parser("migrate", help=migrate.__doc__)
+    migrate_parser.add_argument("--to", choices=list(STORES), required=True)
+    migrate_parser.add_argument(
+        "--to-path", help="Path of the new store (URL for redis)"
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    rehash_parser = subparsers.add_parser(
+        "rehash", help=rehash.__doc__.splitlines()[0]
+    )
+    rehash_parser.add_argument(
+        "input",
+        type=argparse.FileType("r"),
+        help="JSON or CSV (.csv) file of usernames and passwords",
+    )
+    rehash_parser.set_defaults(func=rehash)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="[%(levelname)s %(asctime)s %(name)s] %(message)s",
+    )
+
+    auth = _load_authenticator(args)
+    try:
+        result = args.func(auth, args)
+        if asyncio.iscoroutine(result):
+            result = asyncio.run(result)
+    finally:
+        auth.close()
+    return result or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
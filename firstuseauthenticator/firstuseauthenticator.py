@@ -5,19 +5,61 @@ When users first log in, the password they use becomes their
 password for that account. It is hashed with bcrypt & stored
 locally in a dbm file, and checked next time they log in.
 """
+import asyncio
+import csv
+import io
+import json
+import multiprocessing
 import os
-import shutil
+import secrets
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import bcrypt
-import dbm
 from jinja2 import ChoiceLoader, FileSystemLoader
+from jupyterhub.apihandlers import APIHandler
 from jupyterhub.auth import Authenticator
 from jupyterhub.handlers import BaseHandler
 from jupyterhub.handlers import LoginHandler
 from jupyterhub.orm import User
+from jupyterhub.scopes import needs_scope
+from sqlalchemy import select
 
 from tornado import web
-from traitlets import default, Unicode, Bool, Integer
+from traitlets import (
+    default,
+    validate,
+    Any,
+    Bool,
+    Callable,
+    CaselessStrEnum,
+    Float,
+    Instance,
+    Integer,
+    Type,
+    Unicode,
+)
+
+from .cache import CredentialCache
+from .hashers import HASHERS, identify_hasher
+from .metrics import (
+    AUTHENTICATE_DURATION_SECONDS,
+    HASH_DURATION_SECONDS,
+    LOGIN_REJECTED,
+    PASSWORD_CHECK_DURATION_SECONDS,
+    PASSWORD_CHECK_RUNNING,
+    PASSWORD_CHECK_USERNAMES_SCANNED,
+    PASSWORD_RESETS,
+    USER_EXISTS_DURATION_SECONDS,
+    USERS_CREATED,
+)
+from .probe import probe
+from .stores import DBMPasswordStore, PasswordStore
+from .limiter import HashLimiter, HashQueueFull
+from .throttle import LoginThrottle, MemoryThrottleStore, ThrottleStore
+from .tracing import default_span_hook
+from .workers import WorkerPool
 
 
 TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
@@ -40,28 +82,35 @@ class CustomLoginHandler(LoginHandler):
         return super()._render(login_error, username)
 
 
-class ResetPasswordHandler(BaseHandler):
-    """Render the reset password page."""
-    def __init__(self, *args, **kwargs):
-        self._loaded = False
-        super().__init__(*args, **kwargs)
+# compiled reset.html for each jinja environment our templates have been added to
+_reset_templates = weakref.WeakKeyDictionary()
 
-    def _register_template_path(self):
-        if self._loaded:
-            return
 
-        self.log.debug('Adding %s to template path', TEMPLATE_DIR)
-        loader = FileSystemLoader([TEMPLATE_DIR])
+def _get_reset_template(env):
+    """Return the compiled reset.html template for a jinja environment
+
+    The first time, our template directory is added to the environment's loader.
+    The compiled template is cached, so neither happens again on later requests.
+    """
+    template = _reset_templates.get(env)
+    if template is None:
+        env.loader = ChoiceLoader([env.loader, FileSystemLoader([TEMPLATE_DIR])])
+        template = _reset_templates[env] = env.get_template('reset.html')
+    return template
+
 
-        env = self.settings['jinja2_env']
-        previous_loader = env.loader
-        env.loader = ChoiceLoader([previous_loader, loader])
+class ResetPasswordHandler(BaseHandler):
+    """Render the reset password page."""
 
-        self._loaded = True
+    def get_template(self, name, sync=False):
+        if name == 'reset.html':
+            return _get_reset_template(
+                self.settings['jinja2_env_sync' if sync else 'jinja2_env']
+            )
+        return super().get_template(name, sync)
 
     @web.authenticated
     async def get(self):
-        self._register_template_path()
         html = await self.render_template('reset.html')
         self.finish(html)
 
@@ -69,7 +118,7 @@ class ResetPasswordHandler(BaseHandler):
     async def post(self):
         user = self.current_user
         new_password = self.get_body_argument('password', strip=False)
-        msg = self.authenticator.reset_password(user.name, new_password)
+        msg = await self.authenticator.reset_password(user.name, new_password)
 
         if "success" in msg:
             alert = "success"
@@ -85,6 +134,111 @@ class ResetPasswordHandler(BaseHandler):
         self.finish(html)
 
 
+def _parse_password_batch(body, content_type):
+    """Parse a batch of usernames and passwords
+
+    Accepts JSON:
+
+        {"users": [{"name": "a", "password": "..."}, {"name": "b"}]}
+
+    or CSV, with one `name,password` row per user.
+
+    Users without a password get a generated one.
+
+    Returns a list of (name, password or None) tuples.
+    """
+    if content_type.split(";")[0].strip() == "text/csv":
+        rows = csv.reader(io.StringIO(body))
+        users = []
+        for row in rows:
+            if not row or not row[0].strip():
+                continue
+            name = row[0].strip()
+            password = row[1] if len(row) > 1 and row[1] else None
+            users.append((name, password))
+        return users
+
+    try:
+        model = json.loads(body)
+    except ValueError:
+        raise web.HTTPError(400, "Invalid JSON in body of request")
+    if not isinstance(model, dict) or not isinstance(model.get("users"), list):
+        raise web.HTTPError(400, "Expected {'users': [...]}")
+    users = []
+    for user in model["users"]:
+        if isinstance(user, str):
+            users.append((user, None))
+        elif (
+            isinstance(user, dict)
+            and isinstance(user.get("name"), str)
+            and isinstance(user.get("password"), (str, type(None)))
+        ):
+            users.append((user["name"], user.get("password") or None))
+        else:
+            raise web.HTTPError(400, f"Invalid user: {user!r}")
+    return users
+
+
+def _generate_password(min_length):
+    """Generate a random password at least min_length characters long"""
+    # token_urlsafe(n) is at least n characters long
+    return secrets.token_urlsafe(max(12, min_length))
+
+
+class PasswordBatchHandler(APIHandler):
+    """Set or remove passwords for many users at once
+
+    POST sets passwords from a JSON or CSV batch (see _parse_password_batch),
+    generating passwords for users who don't have one.
+    DELETE removes the passwords for {"users": ["name", ...]}.
+
+    Results are streamed back as one JSON object per line.
+    Requires the admin:users scope.
+    """
+
+    def _write_result(self, name, status, **fields):
+        self.write(json.dumps(dict(name=name, status=status, **fields)) + "\n")
+
+    @needs_scope("admin:users")
+    async def post(self):
+        body = self.request.body.decode("utf8", "replace")
+        users = _parse_password_batch(
+            body, self.request.headers.get("Content-Type", "application/json")
+        )
+        self.set_header("Content-Type", "application/x-ndjson")
+
+        min_length = self.authenticator.min_password_length
+        # generated passwords, by normalized username, as results are reported
+        generated = {}
+        passwords = {}
+        for name, password in users:
+            if password is None:
+                password = _generate_password(min_length)
+                generated[self.authenticator.normalize_username(name)] = password
+            passwords[name] = password
+
+        async for name, error in self.authenticator.iter_set_passwords(passwords):
+            if error:
+                self._write_result(name, "error", message=error)
+            elif name in generated:
+                self._write_result(name, "ok", password=generated[name])
+            else:
+                self._write_result(name, "ok")
+            await self.flush()
+        self.finish()
+
+    @needs_scope("admin:users")
+    async def delete(self):
+        users = _parse_password_batch(
+            self.request.body.decode("utf8", "replace"), "application/json"
+        )
+        self.set_header("Content-Type", "application/x-ndjson")
+        names = await self.authenticator.delete_users([name for name, _ in users])
+        for name in names:
+            self._write_result(name, "deleted")
+        self.finish()
+
+
 class FirstUseAuthenticator(Authenticator):
     """
     JupyterHub authenticator that lets users set password on first use.
@@ -97,6 +251,23 @@ class FirstUseAuthenticator(Authenticator):
         """
     )
 
+    password_store_class = Type(
+        DBMPasswordStore,
+        klass=PasswordStore,
+        config=True,
+        help="""
+        The class to use for storing password hashes.
+
+        The default stores them in the dbm file at dbm_path.
+        """,
+    )
+
+    password_store = Instance(PasswordStore)
+
+    @default("password_store")
+    def _password_store_default(self):
+        return self.password_store_class(parent=self, log=self.log)
+
     create_users = Bool(
         True,
         config=True,
@@ -109,6 +280,22 @@ class FirstUseAuthenticator(Authenticator):
         """
     )
 
+    user_exists_cache_ttl = Float(
+        300,
+        config=True,
+        help="""
+        Seconds to cache the list of Hub users for, when create_users is False.
+
+        The list is loaded with one database query when the Hub starts,
+        and kept up to date as users are added and deleted,
+        so logins don't query the Hub database.
+        It is reloaded in the background after this time,
+        to pick up any changes made elsewhere.
+
+        Set to 0 to query the database on every login.
+        """,
+    )
+
     min_password_length = Integer(
         7,
         config=True,
@@ -137,12 +324,630 @@ class FirstUseAuthenticator(Authenticator):
         """,
     )
 
+    hash_executor_type = CaselessStrEnum(
+        ["thread", "process", "prefork"],
+        default_value="thread",
+        config=True,
+        help="""
+        Type of executor used to run password hashing and verification.
+
+        bcrypt is CPU-bound and takes a noticeable amount of time per call,
+        so it is never run on the Hub's event loop.
+        'thread' uses a thread pool (bcrypt releases the GIL while hashing),
+        'process' uses a process pool.
+        'prefork' starts worker processes with the Hub,
+        and restarts them after hash_worker_max_jobs jobs or if they crash,
+        keeping the CPU and memory used by hashing out of the Hub's process.
+        """,
+    )
+
+    hash_worker_max_jobs = Integer(
+        1000,
+        config=True,
+        help="""
+        Restart each 'prefork' hash worker process after this many jobs.
+
+        Returns memory used by memory-hard hashes (argon2id, scrypt) to the system.
+        Set to 0 to never restart workers.
+        """,
+    )
+
+    hash_executor_workers = Integer(
+        config=True,
+        help="""
+        Number of workers in the password hashing executor.
+
+        Defaults to the number of CPUs.
+        """,
+    )
+
+    @default("hash_executor_workers")
+    def _hash_executor_workers_default(self):
+        return os.cpu_count() or 1
+
+    hash_executor = Any(
+        help="""
+        The concurrent.futures.Executor used for password hashing.
+
+        Created from hash_executor_type and hash_executor_workers by default.
+        """
+    )
+
+    @default("hash_executor")
+    def _hash_executor_default(self):
+        if self.hash_executor_type == "process":
+            executor_class = ProcessPoolExecutor
+        elif self.hash_executor_type == "prefork":
+            executor_class = WorkerPool
+        else:
+            executor_class = ThreadPoolExecutor
+        self.log.debug(
+            "Using %s with %i workers for password hashing",
+            executor_class.__name__,
+            self.hash_executor_workers,
+        )
+        if executor_class is WorkerPool:
+            return WorkerPool(
+                self.hash_executor_workers,
+                max_jobs=self.hash_worker_max_jobs,
+                log=self.log,
+            )
+        if executor_class is ProcessPoolExecutor:
+            # spawn, rather than fork, because the Hub is multi-threaded
+            return ProcessPoolExecutor(
+                self.hash_executor_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return executor_class(self.hash_executor_workers)
+
+    io_executor_workers = Integer(
+        4,
+        config=True,
+        help="""
+        Number of threads for password store I/O.
+
+        Reads and writes of the password store are blocking
+        (file I/O for the dbm and SQLite stores, network I/O for Redis),
+        so they are run in a dedicated thread pool instead of on the Hub's event loop.
+        """,
+    )
+
+    io_executor = Any(
+        help="""
+        The concurrent.futures.Executor used for password store I/O.
+
+        A thread pool with io_executor_workers threads by default.
+        """
+    )
+
+    @default("io_executor")
+    def _io_executor_default(self):
+        return ThreadPoolExecutor(
+            self.io_executor_workers, thread_name_prefix="firstuse-io"
+        )
+
+    check_passwords_in_background = Bool(
+        False,
+        config=True,
+        help="""
+        Run the startup password check (check_passwords_on_startup)
+        in the background instead of blocking Hub startup.
+
+        While the check is running, logins for usernames without a stored password
+        wait for it to finish, in case their password is about to be normalized.
+        Logins for users with a stored password are not affected.
+        """,
+    )
+
+    password_hash_algorithm = CaselessStrEnum(
+        list(HASHERS),
+        default_value="bcrypt",
+        config=True,
+        help="""
+        The algorithm used to hash new passwords.
+
+        - bcrypt (the default)
+        - argon2id (requires the argon2-cffi package)
+        - scrypt
+
+        Existing passwords are always verified with the algorithm that hashed them,
+        and are rehashed with this algorithm on login if rehash_on_login is True.
+        """,
+    )
+
+    @validate("password_hash_algorithm")
+    def _validate_password_hash_algorithm(self, proposal):
+        algorithm = proposal.value
+        # fail early if argon2-cffi is missing
+        self._get_hasher(algorithm)
+        return algorithm
+
+    argon2_time_cost = Integer(
+        3,
+        config=True,
+        help="""
+        argon2id time cost (number of iterations).
+        """,
+    )
+
+    argon2_memory_cost = Integer(
+        65536,
+        config=True,
+        help="""
+        argon2id memory cost, in KiB.
+        """,
+    )
+
+    argon2_parallelism = Integer(
+        4,
+        config=True,
+        help="""
+        argon2id parallelism (number of lanes/threads per hash).
+        """,
+    )
+
+    scrypt_cost = Integer(
+        14,
+        config=True,
+        help="""
+        scrypt CPU/memory cost, as log2(n).
+
+        Each hash uses 128 * 2**scrypt_cost * scrypt_block_size bytes of memory.
+        """,
+    )
+
+    scrypt_block_size = Integer(
+        8,
+        config=True,
+        help="""
+        scrypt block size (r).
+        """,
+    )
+
+    scrypt_parallelism = Integer(
+        1,
+        config=True,
+        help="""
+        scrypt parallelization (p).
+        """,
+    )
+
+    bcrypt_rounds = Integer(
+        12,
+        config=True,
+        help="""
+        The bcrypt cost factor (log2 of the number of rounds) for new password hashes.
+
+        Each increment doubles the time it takes to hash and verify a password.
+        See also bcrypt_target_verify_time to pick this automatically,
+        and rehash_on_login to apply changes to existing passwords.
+        """,
+    )
+
+    @validate("bcrypt_rounds")
+    def _validate_bcrypt_rounds(self, proposal):
+        rounds = proposal.value
+        if not 4 <= rounds <= 31:
+            raise ValueError(f"bcrypt_rounds must be between 4 and 31, not {rounds}")
+        return rounds
+
+    bcrypt_target_verify_time = Float(
+        0,
+        config=True,
+        help="""
+        Target time (in seconds) to verify a password.
+
+        If set, bcrypt is benchmarked at startup and bcrypt_rounds is set
+        to the highest cost factor that verifies within this time on this machine.
+
+        Set to 0 (the default) to use bcrypt_rounds as configured.
+        """,
+    )
+
+    startup_probe = Bool(
+        False,
+        config=True,
+        help="""
+        Measure what a login costs on this machine at startup, and log a report.
+
+        Measures password verification at the configured algorithm and cost,
+        password store latency (and which dbm flavor is used),
+        and the Hub user lookup when create_users is False,
+        and estimates the maximum number of logins per second.
+        """,
+    )
+
+    startup_probe_target_logins_per_second = Float(
+        0,
+        config=True,
+        help="""
+        Warn at startup if the startup_probe estimates that fewer logins per second
+        than this can be handled.
+        """,
+    )
+
+    startup_probe_profile_path = Unicode(
+        "",
+        config=True,
+        help="""
+        If set, the startup_probe writes a cProfile of a synthetic login to this path,
+        e.g. for `python -m pstats` or snakeviz.
+        """,
+    )
+
+    rehash_on_login = Bool(
+        True,
+        config=True,
+        help="""
+        Rehash passwords on successful login if they were hashed
+        with a different algorithm than password_hash_algorithm,
+        or different parameters (e.g. bcrypt_rounds).
+
+        This lets the algorithm and its cost be changed without resetting passwords.
+        """,
+    )
+
+    login_throttle_failures = Integer(
+        0,
+        config=True,
+        help="""
+        Number of failed logins allowed for a username before it is locked out.
+
+        Locked-out logins are rejected without checking the password,
+        so brute-force attempts cannot use up the Hub's CPU with password hashing.
+        One failure is forgiven every login_throttle_refill_seconds.
+        Each further lockout is twice as long as the previous one,
+        starting at login_throttle_lockout and up to login_throttle_max_lockout.
+
+        Set to 0 (the default) to disable throttling by username.
+        """,
+    )
+
+    login_throttle_ip_failures = Integer(
+        0,
+        config=True,
+        help="""
+        Number of failed logins allowed from an IP address before it is locked out.
+
+        Works like login_throttle_failures, but per IP address.
+        Keep this high if many users share an IP address (e.g. a classroom behind NAT).
+
+        Set to 0 (the default) to disable throttling by IP address.
+        """,
+    )
+
+    login_throttle_refill_seconds = Float(
+        60,
+        config=True,
+        help="""
+        Seconds after which one failed login is forgiven.
+        """,
+    )
+
+    login_throttle_lockout = Float(
+        30,
+        config=True,
+        help="""
+        Seconds of the first lockout.
+        """,
+    )
+
+    login_throttle_max_lockout = Float(
+        3600,
+        config=True,
+        help="""
+        Maximum number of seconds of a lockout.
+        """,
+    )
+
+    login_throttle_max_entries = Integer(
+        100000,
+        config=True,
+        help="""
+        Maximum number of usernames and IP addresses to track.
+
+        The least recently seen are forgotten first.
+        """,
+    )
+
+    login_throttle_store_class = Type(
+        MemoryThrottleStore,
+        klass=ThrottleStore,
+        config=True,
+        help="""
+        The class used to store throttle state.
+
+        The default keeps it in memory.
+        Subclass firstuseauthenticator.throttle.ThrottleStore to share it
+        between Hub replicas.
+        """,
+    )
+
+    login_throttle_store = Instance(ThrottleStore)
+
+    @default("login_throttle_store")
+    def _login_throttle_store_default(self):
+        return self.login_throttle_store_class(
+            max_entries=self.login_throttle_max_entries
+        )
+
+    def _login_throttle(self, burst):
+        return LoginThrottle(
+            self.login_throttle_store,
+            burst=burst,
+            refill_seconds=self.login_throttle_refill_seconds,
+            lockout=self.login_throttle_lockout,
+            max_lockout=self.login_throttle_max_lockout,
+        )
+
+    def _throttle_keys(self, handler, username):
+        """Return the (throttle, key) pairs that apply to a login"""
+        keys = []
+        if self.login_throttle_failures:
+            keys.append(
+                (self._login_throttle(self.login_throttle_failures), f"user:{username}")
+            )
+        if self.login_throttle_ip_failures:
+            request = getattr(handler, "request", None)
+            ip = getattr(request, "remote_ip", None)
+            if isinstance(ip, str):
+                keys.append(
+                    (self._login_throttle(self.login_throttle_ip_failures), f"ip:{ip}")
+                )
+        return keys
+
+    def _throttle_error(self, handler, locked_for):
+        handler.custom_login_error = (
+            "Too many failed login attempts. Please try again in %d seconds."
+            % max(1, round(locked_for))
+        )
+        self.log.warning(handler.custom_login_error)
+        LOGIN_REJECTED.labels(reason="throttled").inc()
+
+    max_concurrent_hashes = Integer(
+        config=True,
+        help="""
+        Maximum number of password hash operations (hashing or verifying)
+        to run at the same time.
+
+        Defaults to hash_executor_workers.
+        """,
+    )
+
+    @default("max_concurrent_hashes")
+    def _max_concurrent_hashes_default(self):
+        return self.hash_executor_workers
+
+    hash_queue_size = Integer(
+        0,
+        config=True,
+        help="""
+        Maximum number of password hash operations waiting for their turn.
+
+        When the queue is full, logins fail immediately with a message
+        asking the user to try again, instead of every login getting slower.
+        Batch password changes (set_passwords) wait without counting
+        towards this limit.
+
+        Set to 0 (the default) for no limit.
+        """,
+    )
+
+    hash_limiter = Instance(HashLimiter)
+
+    @default("hash_limiter")
+    def _hash_limiter_default(self):
+        return HashLimiter(self.max_concurrent_hashes, self.hash_queue_size)
+
+    span_hook = Callable(
+        config=True,
+        help="""
+        Hook for tracing the phases of a login.
+
+        Called with a span name (e.g. 'firstuse.verify_password')
+        and a dict of attributes, and must return a context manager
+        wrapping the phase.
+
+        Defaults to recording OpenTelemetry spans if opentelemetry-api is installed,
+        and doing nothing otherwise.
+        """,
+    )
+
+    @default("span_hook")
+    def _span_hook_default(self):
+        return default_span_hook()
+
+    def _span(self, name, **attributes):
+        return self.span_hook(f"firstuse.{name}", attributes)
+
+    credential_cache_size = Integer(
+        0,
+        config=True,
+        help="""
+        Maximum number of recently verified credentials to remember.
+
+        Repeat logins with the same password within credential_cache_ttl
+        skip the bcrypt verification.
+        Passwords are not stored, only a keyed digest that is valid
+        for the lifetime of the Hub process.
+        Entries are removed when the password is reset or the user deleted.
+
+        Set to 0 (the default) to disable the cache.
+        """,
+    )
+
+    credential_cache_ttl = Float(
+        300,
+        config=True,
+        help="""
+        Number of seconds a verified credential is remembered for.
+        """,
+    )
+
+    credential_cache = Instance(CredentialCache, allow_none=True)
+
+    @default("credential_cache")
+    def _credential_cache_default(self):
+        if self.credential_cache_size <= 0:
+            return None
+        return CredentialCache(self.credential_cache_size, self.credential_cache_ttl)
+
+    _check_passwords_future = None
+    _check_passwords_pending = False
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        if self.hash_executor_type == "prefork":
+            # start the workers now, not on the first login
+            self.hash_executor
+        if self.bcrypt_target_verify_time:
+            self._calibrate_bcrypt_rounds()
+        if (
+            not self.create_users
+            and self.user_exists_cache_ttl > 0
+            and self.db is not None
+        ):
+            # load the usernames now, not on the first login
+            self._load_user_names()
+        if self.startup_probe:
+            self._run_startup_probe()
         if self.check_passwords_on_startup:
-            self._check_passwords()
+            if self.check_passwords_in_background:
+                self._start_background_check()
+            else:
+                self._run_check_passwords()
+
+    def close(self):
+        """Close the password store, and stop the executors
+
+        The store holds its db open for the life of the authenticator,
+        so call this before opening the same db again in the same process.
+        """
+        self.password_store.close()
+        for name in ("hash_executor", "io_executor"):
+            if self.trait_has_value(name):
+                getattr(self, name).shutdown(wait=False)
+
+    def _run_check_passwords(self, full=False):
+        """Run _check_passwords, with logging and metrics"""
+        self.log.info("Checking password db")
+        PASSWORD_CHECK_RUNNING.set(1)
+        status = "failure"
+        tic = time.perf_counter()
+        try:
+            if full:
+                self._check_passwords(full=True)
+            else:
+                self._check_passwords()
+            status = "success"
+        finally:
+            duration = time.perf_counter() - tic
+            PASSWORD_CHECK_RUNNING.set(0)
+            PASSWORD_CHECK_DURATION_SECONDS.labels(status=status).observe(duration)
+            self.log.info("Password db check finished (%s) in %.2fs", status, duration)
+
+    def _start_background_check(self):
+        """Start the password check in a background thread
+
+        If there is no running event loop yet,
+        the check is started by the first call to authenticate.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.log.debug("No running event loop, deferring password db check")
+            self._check_passwords_pending = True
+            return
+        self._check_passwords_pending = False
+
+        async def check():
+            try:
+                await loop.run_in_executor(self.io_executor, self._run_check_passwords)
+            except Exception:
+                self.log.exception("Error checking password db")
+            finally:
+                # so that later logins don't wait for it
+                self._check_passwords_future = None
+
+        self._check_passwords_future = asyncio.ensure_future(check())
+
+    async def _wait_for_check(self):
+        """Wait for a background password check, if one is running"""
+        if self._check_passwords_pending:
+            self._start_background_check()
+        future = self._check_passwords_future
+        if future is not None and not future.done():
+            self.log.info("Waiting for password db check to finish")
+            await future
+
+    def _calibrate_bcrypt_rounds(self):
+        """Pick bcrypt_rounds to match bcrypt_target_verify_time on this machine
+
+        Each additional round doubles the cost,
+        so time a cheap hash and extrapolate.
+        """
+        calibration_rounds = 8
+        salt = bcrypt.gensalt(calibration_rounds)
+        # best of a few, to reduce noise
+        durations = []
+        for i in range(3):
+            tic = time.perf_counter()
+            bcrypt.hashpw(b"calibration", salt)
+            durations.append(time.perf_counter() - tic)
+        duration = min(durations)
+
+        rounds = calibration_rounds
+        while rounds > 4 and duration > self.bcrypt_target_verify_time:
+            rounds -= 1
+            duration /= 2
+        while rounds < 31 and duration * 2 <= self.bcrypt_target_verify_time:
+            rounds += 1
+            duration *= 2
+        self.log.info(
+            "Using bcrypt_rounds=%i (estimated %.3fs to verify a password, target %.3fs)",
+            rounds,
+            duration,
+            self.bcrypt_target_verify_time,
+        )
+        self.bcrypt_rounds = rounds
+
+    def _run_startup_probe(self):
+        """Measure and log what a login costs with this configuration"""
+        report = probe(self, profile_path=self.startup_probe_profile_path)
 
-    def _check_passwords(self):
+        def ms(seconds):
+            return "n/a" if seconds is None else "%.2fms" % (seconds * 1e3)
+
+        self.log.info(
+            "Startup probe: %s verify %s; %s%s open %s, get %s, set %s; user lookup %s",
+            report["hash_algorithm"],
+            ms(report["verify_seconds"]),
+            report["store"],
+            f" ({report['dbm_flavor']})" if report.get("dbm_flavor") else "",
+            ms(report.get("store_open_seconds")),
+            ms(report["store_get_seconds"]),
+            ms(report.get("store_set_seconds")),
+            ms(report["user_exists_seconds"]),
+        )
+        self.log.info(
+            "Startup probe: estimated maximum %.1f logins/s (limited by %s)",
+            report["max_logins_per_second"],
+            report["bottleneck"],
+        )
+        target = self.startup_probe_target_logins_per_second
+        if target and report["max_logins_per_second"] < target:
+            self.log.warning(
+                "Estimated maximum of %.1f logins/s, limited by %s,"
+                " does not meet the target of %.1f logins/s",
+                report["max_logins_per_second"],
+                report["bottleneck"],
+                target,
+            )
+        if report.get("profile_path"):
+            self.log.info("Startup probe: wrote login profile to %s", report["profile_path"])
+        return report
+
+    def _check_passwords(self, full=False):
         """Validation checks on the password database at startup
 
         Mainly checks for the presence of passwords for non-normalized usernames
@@ -155,140 +960,343 @@ class FirstUseAuthenticator(Authenticator):
         It will continue to produce warnings until manual intervention removes the non-normalized entries.
 
         Non-normalized entries will never be used during login.
+
+        If the db has only been written through the store since the last check,
+        the non-normalized usernames are looked up in the store's index of them.
+        Otherwise (or with full=True) the db is scanned in a single pass,
+        keeping only non-normalized usernames in memory,
+        which also rebuilds the index.
+        A backup is only made if something needs to change.
+
+        Stores wrapping the dbm store (e.g. a journal or a snapshot) are looked through:
+        the dbm is checked once their writes have been applied to it,
+        and usernames are moved through them, so that they see the changes.
         """
+        store = self.password_store
+        dbm_store = store
+        wrappers = []
+        while not isinstance(dbm_store, DBMPasswordStore):
+            if not isinstance(getattr(dbm_store, "store", None), PasswordStore):
+                # only the dbm store can have been written by FirstUseAuthenticator < 1.0
+                return
+            dbm_store.flush()
+            wrappers.append(dbm_store)
+            dbm_store = dbm_store.store
 
-        # it's nontrival to check for db existence, because there are so many extensions
-        # and you don't give dbm a path, you give it a *base* name,
-        # which may point to one or more paths.
-        # There's no way to retrieve the actual path(s) for a db
-        dbm_extensions = ("", ".db", ".pag", ".dir", ".dat", ".bak")
-        dbm_files = list(
-            filter(os.path.isfile, (self.dbm_path + ext for ext in dbm_extensions))
-        )
-        if not dbm_files:
+        if not dbm_store.files():
             # no database, nothing to do
             return
 
-        backup_path = self.dbm_path + "-backup"
-        backup_files = list(
-            filter(os.path.isfile, (backup_path + ext for ext in dbm_extensions))
-        )
+        backup_path = dbm_store.path + "-backup"
+        backup_files = dbm_store.files(backup_path)
 
-        collision_warning = (
-            f"Duplicate password entries have been found, and stored in {backup_path!r}."
-            f" Duplicate entries have been removed from {self.dbm_path!r}."
-            f" If you are happy with the solution, you can delete the backup file(s): {' '.join(backup_files)}."
-            " Or you can inspect the backup database with:\n"
-            "    import dbm\n"
-            f"    with dbm.open({backup_path!r}, 'r') as db:\n"
-            "        for username in db.keys():\n"
-            "            print(username, db[username])\n"
-        )
+        def collision_warning(backup_files):
+            return (
+                f"Duplicate password entries have been found, and stored in {backup_path!r}."
+                f" Duplicate entries have been removed from {dbm_store.path!r}."
+                f" If you are happy with the solution, you can delete the backup file(s): {' '.join(backup_files)}."
+                " Or you can inspect the backup database with:\n"
+                "    import dbm\n"
+                f"    with dbm.open({backup_path!r}, 'r') as db:\n"
+                "        for username in db.keys():\n"
+                "            print(username, db[username])\n"
+            )
 
         if backup_files:
-            self.log.warning(collision_warning)
+            self.log.warning(collision_warning(backup_files))
             return
 
-        # create a temporary backup of the passwords db
-        # to be retained only if collisions are detected
-        # or deleted if no collisions are detected
-        backup_files = []
-        for path in dbm_files:
-            base, ext = os.path.splitext(path)
-            if ext not in dbm_extensions:
-                # catch weird names with '.' and no .db extension
-                base = path
-                ext = ""
-            backup = f"{base}-backup{ext}"
-            shutil.copyfile(path, backup)
-            backup_files.append(backup)
+        # normalization map, for non-normalized usernames only
+        # keys are normalized usernames,
+        # values are lists of all non-normalized names present in the db
+        # which normalize to the same user
+        if (
+            not full
+            and dbm_store.unchanged_since_check()
+            and dbm_store.normalized_index_built
+        ):
+            # only written through the store, which kept the index up to date
+            non_normalized = dbm_store.unnormalized_index()
+            if not non_normalized:
+                self.log.debug(f"Password db {dbm_store.path} unchanged since last check")
+                return
+        else:
+            non_normalized = {}
+            scanned = 0
+            PASSWORD_CHECK_USERNAMES_SCANNED.set(0)
+            for username in dbm_store.keys():
+                normalized_username = self.normalize_username(username)
+                if username != normalized_username:
+                    non_normalized.setdefault(normalized_username, []).append(username)
+                scanned += 1
+                if scanned % 10000 == 0:
+                    self.log.info(f"Checked {scanned} usernames in password db")
+                    PASSWORD_CHECK_USERNAMES_SCANNED.set(scanned)
+            PASSWORD_CHECK_USERNAMES_SCANNED.set(scanned)
+            # from now on, the index is updated by every write
+            dbm_store.save_unnormalized_index(non_normalized)
+
+        if non_normalized:
+            # create a backup of the passwords db
+            # to be retained only if collisions are detected
+            # or deleted if no collisions are detected
+            backup_files = dbm_store.backup(backup_path)
 
         collision_found = False
 
-        with dbm.open(self.dbm_path, "w") as db:
-            # load the username:hashed_password dict
-            passwords = {}
-            for key in db.keys():
-                passwords[key.decode("utf8")] = db[key]
-
-            # normalization map
-            # compute the full map before checking in case two non-normalized forms are used
-            # keys are normalized usernames,
-            # values are lists of all names present in the db
-            # which normalize to the same user
-            normalized_usernames = {}
-            for username in passwords:
-                normalized_username = self.normalize_username(username)
-                normalized_usernames.setdefault(normalized_username, []).append(
-                    username
+        for normalized_username, usernames in non_normalized.items():
+            normalized_present = store.get(normalized_username) is not None
+            if not normalized_present and len(usernames) == 1:
+                # only one form, not normalized. Unambiguous to fix.
+                # move password from non-normalized to normalized.
+                username = usernames[0]
+                self.log.warning(
+                    f"Normalizing username in password db {username}->{normalized_username}"
                 )
+                store.set(normalized_username, store.get(username))
+                store.delete(username)
+                continue
 
-            # check if any non-normalized usernames are in the db
-            for normalized_username, usernames in normalized_usernames.items():
-                # case 1. only one form, make sure it's stored in the normalized username
-                if len(usernames) == 1:
-                    username = usernames[0]
-                    # case 1.a only normalized form, nothing to do
-                    if username == normalized_username:
-                        continue
-                    # 1.b only one form, not normalized. Unambiguous to fix.
-                    # move password from non-normalized to normalized.
-                    self.log.warning(
-                        f"Normalizing username in password db {username}->{normalized_username}"
-                    )
-                    db[normalized_username.encode("utf8")] = passwords[username]
-                    del db[username]
-                else:
-                    # collision! Multiple passwords for the same Hub user with different normalization
-                    # do not clear these automatically because the 'right' answer is ambiguous,
-                    # but make sure the normalized_username is set,
-                    # so that after upgrade, there is always a password set
-                    # the non-normalized username passwords will never be used
-                    # after jupyterhub-firstuseauthenticator 1.0
-                    self.log.warning(
-                        f"{len(usernames)} variations of the username {normalized_username} present in password database: {usernames}."
-                        f" Only the password stored for the normalized {normalized_username} will be used."
-                    )
-                    collision_found = True
-                    if normalized_username not in passwords:
-                        # we choose usernames[0] as most likely to be the first entry
-                        # this isn't guaranteed, but it's the best information we have
-                        username = usernames[0]
-                        self.log.warning(
-                            f"Normalizing username in password db {username}->{normalized_username}"
-                        )
-                        db[normalized_username.encode("utf8")] = passwords[username]
-                    for username in usernames:
-                        if username != normalized_username:
-                            self.log.warning(
-                                f"Removing un-normalized username from password db {username}"
-                            )
-                            del db[username]
+            # collision! Multiple passwords for the same Hub user with different normalization
+            # do not clear these automatically because the 'right' answer is ambiguous,
+            # but make sure the normalized_username is set,
+            # so that after upgrade, there is always a password set
+            # the non-normalized username passwords will never be used
+            # after jupyterhub-firstuseauthenticator 1.0
+            all_usernames = usernames
+            if normalized_present:
+                all_usernames = [normalized_username] + usernames
+            self.log.warning(
+                f"{len(all_usernames)} variations of the username {normalized_username} present in password database: {all_usernames}."
+                f" Only the password stored for the normalized {normalized_username} will be used."
+            )
+            collision_found = True
+            if not normalized_present:
+                # we choose usernames[0] as most likely to be the first entry
+                # this isn't guaranteed, but it's the best information we have
+                username = usernames[0]
+                self.log.warning(
+                    f"Normalizing username in password db {username}->{normalized_username}"
+                )
+                store.set(normalized_username, store.get(username))
+            for username in usernames:
+                self.log.warning(
+                    f"Removing un-normalized username from password db {username}"
+                )
+                store.delete(username)
 
         if collision_found:
-            self.log.warning(collision_warning)
+            self.log.warning(collision_warning(backup_files))
         else:
             # remove backup files, if we didn't find anything to backup
-            self.log.debug(f"No collisions found, removing backup files {backup_files}")
+            if backup_files:
+                self.log.debug(
+                    f"No collisions found, removing backup files {backup_files}"
+                )
             for path in backup_files:
                 try:
                     os.remove(path)
                 except FileNotFoundError:
                     pass
+            for wrapper in wrappers:
+                wrapper.flush()
+            dbm_store.mark_checked()
+
+    # cache of Hub usernames for _user_exists
+    _user_names = None
+    _user_names_loaded = 0
+    # background reload, and users added (True) or deleted (False) while it runs
+    _user_names_reload = None
+    _user_names_changed = None
+
+    def _load_user_names(self):
+        """Load all Hub usernames with one query"""
+        self._user_names = {name for (name,) in self.db.query(User.name)}
+        self._user_names_loaded = time.monotonic()
+        self.log.debug("Loaded %i usernames from the Hub db", len(self._user_names))
+
+    def _query_user_names(self):
+        """Query all Hub usernames on a connection of their own
+
+        Runs in the io_executor, while the Hub keeps using its db session.
+        """
+        with self.db.get_bind().connect() as connection:
+            return {name for (name,) in connection.execute(select(User.name))}
+
+    async def _reload_user_names(self):
+        """Reload the cached Hub usernames in the io_executor"""
+        loop = asyncio.get_running_loop()
+        try:
+            user_names = await loop.run_in_executor(
+                self.io_executor, self._query_user_names
+            )
+        except Exception:
+            self.log.exception("Error reloading usernames from the Hub db")
+            # keep the old usernames, and try again after another ttl
+            self._user_names_loaded = time.monotonic()
+            return
+        else:
+            for name, exists in self._user_names_changed.items():
+                if exists:
+                    user_names.add(name)
+                else:
+                    user_names.discard(name)
+            self._user_names = user_names
+            self._user_names_loaded = time.monotonic()
+            self.log.debug("Reloaded %i usernames from the Hub db", len(user_names))
+        finally:
+            self._user_names_changed = None
+            self._user_names_reload = None
+
+    def _user_names_stale(self):
+        return time.monotonic() - self._user_names_loaded > self.user_exists_cache_ttl
+
+    def _user_names_track(self, name, exists):
+        """Track a user added or deleted by the Hub in the cached usernames"""
+        if self._user_names is None:
+            return
+        if exists:
+            self._user_names.add(name)
+        else:
+            self._user_names.discard(name)
+        if self._user_names_changed is not None:
+            self._user_names_changed[name] = exists
 
     def _user_exists(self, username):
         """
         Return true if given user already exists.
 
+        Usernames are loaded with one query and cached for user_exists_cache_ttl,
+        and kept up to date by add_user and delete_user in between.
+        Once stale, they are reloaded in the background,
+        and logins use the stale usernames until that finishes.
+
         Note: Depends on internal details of JupyterHub that might change
         across versions. Tested with v0.9
         """
-        return self.db.query(User).filter_by(name=username).first() is not None
+        with self._span("user_exists"), USER_EXISTS_DURATION_SECONDS.time():
+            if self.user_exists_cache_ttl <= 0:
+                return self.db.query(User).filter_by(name=username).first() is not None
+            if self._user_names is None:
+                self._load_user_names()
+            elif self._user_names_stale() and self._user_names_reload is None:
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    self._load_user_names()
+                else:
+                    self._user_names_changed = {}
+                    self._user_names_reload = asyncio.ensure_future(
+                        self._reload_user_names()
+                    )
+            return username in self._user_names
+
+    def add_user(self, user):
+        """Track new users in the _user_exists cache"""
+        super().add_user(user)
+        self._user_names_track(user.name, True)
 
 
     def _validate_password(self, password):
         return len(password) >= self.min_password_length
 
+    def _get_hasher(self, algorithm=None):
+        """Return a hasher for algorithm, configured from our traits
+
+        Defaults to password_hash_algorithm.
+        """
+        if algorithm is None:
+            algorithm = self.password_hash_algorithm
+        if algorithm == "bcrypt":
+            kwargs = dict(rounds=self.bcrypt_rounds)
+        elif algorithm == "argon2id":
+            kwargs = dict(
+                time_cost=self.argon2_time_cost,
+                memory_cost=self.argon2_memory_cost,
+                parallelism=self.argon2_parallelism,
+            )
+        elif algorithm == "scrypt":
+            kwargs = dict(
+                cost=self.scrypt_cost,
+                block_size=self.scrypt_block_size,
+                parallelism=self.scrypt_parallelism,
+            )
+        else:
+            kwargs = {}
+        return HASHERS[algorithm](**kwargs)
+
+    async def _hash_password(self, password, bounded=True):
+        """Hash a new password in the hash executor
+
+        Raises HashQueueFull if bounded and too many hash operations are waiting.
+        """
+        loop = asyncio.get_running_loop()
+        hasher = self._get_hasher()
+        async with self.hash_limiter.slot(bounded=bounded):
+            with self._span(
+                "hash_password", algorithm=hasher.name
+            ), HASH_DURATION_SECONDS.labels(
+                operation="hash", algorithm=hasher.name
+            ).time():
+                return await loop.run_in_executor(
+                    self.hash_executor, hasher.hash, password.encode("utf8")
+                )
+
+    async def _verify_password(self, password, stored_pw, bounded=True):
+        """Check a password against a stored hash in the hash executor
+
+        The stored hash is verified with whichever algorithm produced it.
+        Raises HashQueueFull if bounded and too many hash operations are waiting.
+        """
+        algorithm = identify_hasher(stored_pw)
+        if algorithm is None:
+            self.log.error("Unrecognized password hash format in password db")
+            return False
+        loop = asyncio.get_running_loop()
+        async with self.hash_limiter.slot(bounded=bounded):
+            with self._span(
+                "verify_password", algorithm=algorithm
+            ), HASH_DURATION_SECONDS.labels(
+                operation="verify", algorithm=algorithm
+            ).time():
+                return await loop.run_in_executor(
+                    self.hash_executor,
+                    self._get_hasher(algorithm).verify,
+                    password.encode("utf8"),
+                    stored_pw,
+                )
+
+    def _server_busy(self, handler):
+        """Reject a login because the hash queue is full"""
+        handler.custom_login_error = (
+            "The server is handling too many logins. Please try again in a moment."
+        )
+        self.log.warning("Password hash queue is full, rejecting login")
+        LOGIN_REJECTED.labels(reason="busy").inc()
+        return None
+
+    def _needs_rehash(self, stored_pw):
+        """Whether a stored hash uses a different algorithm or parameters than configured"""
+        algorithm = identify_hasher(stored_pw)
+        if algorithm is None:
+            return False
+        if algorithm != self.password_hash_algorithm:
+            return True
+        return self._get_hasher(algorithm).needs_rehash(stored_pw)
+
+    async def _rehash_password(self, username, password, stored_pw):
+        """Store a new hash of password with the current algorithm and parameters"""
+        hashed = await self._hash_password(password)
+        if await self.password_store.aget(username) != stored_pw:
+            # the password changed while we were hashing, leave it alone
+            return
+        self.log.info(
+            "Rehashing password for %s with %s",
+            username,
+            self.password_hash_algorithm,
+        )
+        await self.password_store.aset(username, hashed)
+
 
     def validate_username(self, name):
         invalid_chars = [',', ' ']
@@ -304,47 +1312,109 @@ class FirstUseAuthenticator(Authenticator):
         return (not self.allowed_users)
 
     async def authenticate(self, handler, data):
+        tic = time.perf_counter()
+        with self._span("authenticate"):
+            username = await self._authenticate(handler, data)
+        status = "success" if username else "failure"
+        AUTHENTICATE_DURATION_SECONDS.labels(status=status).observe(
+            time.perf_counter() - tic
+        )
+        return username
+
+    async def _authenticate(self, handler, data):
         username = self.normalize_username(data["username"])
         password = data["password"]
 
+        throttle_keys = self._throttle_keys(handler, username)
+        for throttle, key in throttle_keys:
+            locked_for = throttle.locked_for(key)
+            if locked_for:
+                self._throttle_error(handler, locked_for)
+                return None
+
         if not self.create_users:
             if not self._user_exists(username):
+                LOGIN_REJECTED.labels(reason="unknown_user").inc()
                 return None
 
-        with dbm.open(self.dbm_path, 'c', 0o600) as db:
-            stored_pw = db.get(username.encode("utf8"), None)
+        stored_pw = await self.password_store.aget(username)
 
-            if stored_pw is not None:
-                # for existing passwords: ensure password hash match
-                if bcrypt.hashpw(password.encode("utf8"), stored_pw) != stored_pw:
-                    return None
-            else:
-                # for new users: ensure password validity and store password hash
-                if not self._validate_password(password):
-                    handler.custom_login_error = (
-                        'Password too short! Please choose a password at least %d characters long.'
-                        % self.min_password_length
-                    )
-                    self.log.error(handler.custom_login_error)
-                    return None
-                db[username] = bcrypt.hashpw(password.encode("utf8"), bcrypt.gensalt())
+        if stored_pw is None and (
+            self._check_passwords_pending or self._check_passwords_future is not None
+        ):
+            # the password may be stored under a non-normalized username
+            # that the background check hasn't moved yet
+            await self._wait_for_check()
+            stored_pw = await self.password_store.aget(username)
 
+        if stored_pw is None:
+            # for new users: ensure password validity and store password hash
+            if not self._validate_password(password):
+                handler.custom_login_error = (
+                    'Password too short! Please choose a password at least %d characters long.'
+                    % self.min_password_length
+                )
+                self.log.error(handler.custom_login_error)
+                LOGIN_REJECTED.labels(reason="short_password").inc()
+                return None
+            # hash outside the db, then check again before storing:
+            # another login for the same new user may have stored
+            # its password while we were hashing
+            try:
+                hashed = await self._hash_password(password)
+            except HashQueueFull:
+                return self._server_busy(handler)
+            stored_pw = await self.password_store.asetdefault(username, hashed)
+            if stored_pw == hashed:
+                USERS_CREATED.inc()
+                return username
+
+        cache = self.credential_cache
+        if cache is not None and cache.check(username, password, stored_pw):
+            return username
+
+        # for existing passwords: ensure password hash match
+        try:
+            verified = await self._verify_password(password, stored_pw)
+        except HashQueueFull:
+            return self._server_busy(handler)
+        if not verified:
+            LOGIN_REJECTED.labels(reason="wrong_password").inc()
+            for throttle, key in throttle_keys:
+                locked_for = throttle.failure(key)
+                if locked_for:
+                    self._throttle_error(handler, locked_for)
+            return None
+        # a successful login resets the username's failures,
+        # but not the IP address's, which could be shared with an attacker
+        for throttle, key in throttle_keys:
+            if key.startswith("user:"):
+                throttle.success(key)
+        if self.rehash_on_login and self._needs_rehash(stored_pw):
+            try:
+                await self._rehash_password(username, password, stored_pw)
+            except HashQueueFull:
+                # too busy, rehash on a later login
+                pass
+            else:
+                stored_pw = await self.password_store.aget(username)
+        if cache is not None:
+            cache.add(username, password, stored_pw)
         return username
 
 
-    def delete_user(self, user):
+    async def delete_user(self, user):
         """
         When user is deleted, remove their entry from password db.
 
         This lets passwords be reset by deleting users.
         """
-        try:
-            with dbm.open(self.dbm_path, 'c', 0o600) as db:
-                del db[user.name]
-        except KeyError:
-            pass
+        await self.password_store.adelete(user.name)
+        if self.credential_cache is not None:
+            self.credential_cache.invalidate(user.name)
+        self._user_names_track(user.name, False)
 
-    def reset_password(self, username, new_password):
+    async def reset_password(self, username, new_password):
         """
         This allows changing the password of a logged user.
         """
@@ -354,16 +1424,98 @@ class FirstUseAuthenticator(Authenticator):
                 % self.min_password_length
             )
             self.log.error(login_err)
+            PASSWORD_RESETS.labels(status="short_password").inc()
             # Resetting the password will fail if the new password is too short.
             return login_err
-        with dbm.open(self.dbm_path, "c", 0o600) as db:
-            db[username] = bcrypt.hashpw(new_password.encode("utf8"), bcrypt.gensalt())
+        try:
+            hashed = await self._hash_password(new_password)
+        except HashQueueFull:
+            login_err = "The server is busy. Please try again in a moment."
+            self.log.warning("Password hash queue is full, rejecting password reset")
+            PASSWORD_RESETS.labels(status="busy").inc()
+            return login_err
+        await self.password_store.aset(username, hashed)
+        if self.credential_cache is not None:
+            self.credential_cache.invalidate(username)
+        PASSWORD_RESETS.labels(status="success").inc()
         login_msg = "Your password has been changed successfully!"
         self.log.info(login_msg)
         return login_msg
 
+    async def set_passwords(self, passwords):
+        """Set the passwords for many users at once
+
+        passwords is a dict of username: password.
+        Passwords are hashed in parallel in the hash executor,
+        and stored in batches.
+
+        Returns a dict of normalized username: error message (None on success),
+        in the same order as passwords.
+        """
+        results = {self.normalize_username(name): None for name in passwords}
+        async for username, error in self.iter_set_passwords(passwords):
+            results[username] = error
+        return results
+
+    async def iter_set_passwords(self, passwords, batch_size=100):
+        """Set the passwords for many users at once, yielding results as they are stored
+
+        Like set_passwords, but yields (normalized username, error message or None)
+        for each user: first the invalid ones,
+        then the rest as each batch of batch_size passwords is hashed and stored.
+        """
+        to_hash = {}
+        for name, password in passwords.items():
+            username = self.normalize_username(name)
+            if not self.validate_username(username):
+                yield username, f"Invalid username: {name!r}"
+            elif not self._validate_password(password):
+                yield username, (
+                    'Password too short! Please choose a password at least %d characters long.'
+                    % self.min_password_length
+                )
+            else:
+                to_hash[username] = password
+
+        usernames = list(to_hash)
+        for start in range(0, len(usernames), batch_size):
+            batch = usernames[start : start + batch_size]
+            hashes = await asyncio.gather(
+                *(
+                    self._hash_password(to_hash[username], bounded=False)
+                    for username in batch
+                )
+            )
+            await self.password_store.aset_many(zip(batch, hashes))
+            if self.credential_cache is not None:
+                for username in batch:
+                    self.credential_cache.invalidate(username)
+            for username in batch:
+                yield username, None
+        self.log.info("Set passwords for %i users", len(to_hash))
+
+    async def delete_users(self, names):
+        """Remove the passwords for many users at once
+
+        Like delete_user, but for a list of usernames.
+        Returns the list of normalized usernames.
+        """
+        usernames = [self.normalize_username(name) for name in names]
+        await self.password_store.adelete_many(usernames)
+        if self.credential_cache is not None:
+            for username in usernames:
+                self.credential_cache.invalidate(username)
+        self.log.info("Removed passwords for %i users", len(usernames))
+        return usernames
+
     def get_handlers(self, app):
+        # compile the reset page once, at startup
+        tornado_settings = getattr(app, 'tornado_settings', None) or {}
+        for key in ('jinja2_env', 'jinja2_env_sync'):
+            if key in tornado_settings:
+                _get_reset_template(tornado_settings[key])
         return [
             (r"/login", CustomLoginHandler),
             (r"/auth/change-password", ResetPasswordHandler),
+            (r"/api/firstuse/passwords", PasswordBatchHandler),
         ]
@@ -0,0 +1,208 @@
+"""
+Password hashing algorithms for FirstUseAuthenticator.
+
+Each hasher produces self-describing hashes with a prefix identifying the algorithm
+(`$2b$` for bcrypt, `$argon2id$` for argon2id, `$scrypt$` for scrypt),
+so stored hashes can always be verified with the algorithm that created them,
+whatever the currently configured algorithm is.
+
+Hashers are plain picklable objects, so their methods can be run in a process pool.
+"""
+import base64
+import hashlib
+import hmac
+import os
+
+import bcrypt
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+class PasswordHasher:
+    """Base class for password hashers
+
+    Passwords and hashes are bytes.
+    """
+
+    #: the name of the algorithm, as used in FirstUseAuthenticator.password_hash_algorithm
+    name = ""
+    #: hash prefixes identifying this algorithm
+    prefixes = ()
+
+    @classmethod
+    def identify(cls, hashed):
+        """Return whether hashed was produced by this algorithm"""
+        return hashed.startswith(cls.prefixes)
+
+    def hash(self, password):
+        """Return a new salted hash of password"""
+        raise NotImplementedError()
+
+    def verify(self, password, hashed):
+        """Return whether password matches hashed"""
+        raise NotImplementedError()
+
+    def needs_rehash(self, hashed):
+        """Return whether hashed was produced with different parameters"""
+        return False
+
+
+class BcryptHasher(PasswordHasher):
+    name = "bcrypt"
+    prefixes = (b"$2a$", b"$2b$", b"$2y$")
+
+    def __init__(self, rounds=12):
+        self.rounds = rounds
+
+    def hash(self, password):
+        return bcrypt.hashpw(password, bcrypt.gensalt(self.rounds))
+
+    def verify(self, password, hashed):
+        return bcrypt.hashpw(password, hashed) == hashed
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$12$<salt+hash>
+        try:
+            rounds = int(hashed.split(b"$")[2])
+        except (IndexError, ValueError):
+            return False
+        return rounds != self.rounds
+
+
+class Argon2Hasher(PasswordHasher):
+    """argon2id, from the argon2-cffi package"""
+
+    name = "argon2id"
+    prefixes = (b"$argon2id$",)
+
+    def __init__(self, time_cost=3, memory_cost=65536, parallelism=4):
+        if argon2 is None:
+            raise ImportError(
+                "argon2id password hashing requires the argon2-cffi package"
+            )
+        self.time_cost = time_cost
+        self.memory_cost = memory_cost
+        self.parallelism = parallelism
+
+    @property
+    def _hasher(self):
+        return argon2.PasswordHasher(
+            time_cost=self.time_cost,
+            memory_cost=self.memory_cost,
+            parallelism=self.parallelism,
+            type=argon2.Type.ID,
+        )
+
+    def hash(self, password):
+        return self._hasher.hash(password).encode("ascii")
+
+    def verify(self, password, hashed):
+        try:
+            return self._hasher.verify(hashed, password)
+        except (
+            argon2.exceptions.VerificationError,
+            argon2.exceptions.InvalidHashError,
+        ):
+            return False
+
+    def needs_rehash(self, hashed):
+        return self._hasher.check_needs_rehash(hashed.decode("ascii"))
+
+
+def _b64encode(data):
+    return base64.b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data):
+    return base64.b64decode(data + b"=" * (-len(data) % 4))
+
+
+class ScryptHasher(PasswordHasher):
+    """scrypt, from the standard library
+
+    Hashes look like `$scrypt$ln=14,r=8,p=1$<salt>$<hash>`,
+    with unpadded base64 salt and hash,
+    where ln is the log2 of the CPU/memory cost n.
+    """
+
+    name = "scrypt"
+    prefixes = (b"$scrypt$",)
+    salt_size = 16
+    hash_size = 32
+
+    def __init__(self, cost=14, block_size=8, parallelism=1):
+        self.cost = cost
+        self.block_size = block_size
+        self.parallelism = parallelism
+
+    def _scrypt(self, password, salt, cost, block_size, parallelism):
+        n = 2**cost
+        return hashlib.scrypt(
+            password,
+            salt=salt,
+            n=n,
+            r=block_size,
+            p=parallelism,
+            # scrypt needs 128 * n * r bytes, plus a bit, and the default limit is 32MB
+            maxmem=129 * n * block_size * parallelism + 2**20,
+            dklen=self.hash_size,
+        )
+
+    def _parse(self, hashed):
+        _, _, params, salt, digest = hashed.split(b"$")
+        params = dict(param.split(b"=") for param in params.split(b","))
+        return (
+            int(params[b"ln"]),
+            int(params[b"r"]),
+            int(params[b"p"]),
+            _b64decode(salt),
+            _b64decode(digest),
+        )
+
+    def hash(self, password):
+        salt = os.urandom(self.salt_size)
+        digest = self._scrypt(
+            password, salt, self.cost, self.block_size, self.parallelism
+        )
+        params = f"ln={self.cost},r={self.block_size},p={self.parallelism}"
+        return b"$".join(
+            [b"", b"scrypt", params.encode("ascii"), _b64encode(salt), _b64encode(digest)]
+        )
+
+    def verify(self, password, hashed):
+        try:
+            cost, block_size, parallelism, salt, digest = self._parse(hashed)
+        except (KeyError, ValueError):
+            return False
+        return hmac.compare_digest(
+            self._scrypt(password, salt, cost, block_size, parallelism), digest
+        )
+
+    def needs_rehash(self, hashed):
+        try:
+            cost, block_size, parallelism, salt, digest = self._parse(hashed)
+        except (KeyError, ValueError):
+            return False
+        return (cost, block_size, parallelism) != (
+            self.cost,
+            self.block_size,
+            self.parallelism,
+        )
+
+
+#: registry of available hashers, by name
+HASHERS = {
+    hasher_class.name: hasher_class
+    for hasher_class in (BcryptHasher, Argon2Hasher, ScryptHasher)
+}
+
+
+def identify_hasher(hashed):
+    """Return the name of the algorithm that produced hashed, or None"""
+    for name, hasher_class in HASHERS.items():
+        if hasher_class.identify(hashed):
+            return name
+    return None
@@ -0,0 +1,78 @@
+"""
+Admission control for password hashing.
+
+Limits how many hash/verify operations run at once,
+and how many may wait for a turn,
+so that a login storm is turned away quickly
+instead of slowing down every login.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from .metrics import (
+    HASH_IN_FLIGHT,
+    HASH_QUEUE_DEPTH,
+    HASH_QUEUE_REJECTED,
+    HASH_QUEUE_WAIT_SECONDS,
+)
+
+
+class HashQueueFull(Exception):
+    """Raised when too many hash operations are already waiting"""
+
+
+class HashLimiter:
+    """Bounded admission queue for hash operations
+
+    max_in_flight operations run at once, and up to max_queued bounded operations
+    wait for a turn (0 for no limit on waiting).
+    Unbounded waiters don't count towards max_queued,
+    so that an admin batch doesn't fill the queue and turn logins away.
+    """
+
+    def __init__(self, max_in_flight, max_queued=0):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.in_flight = 0
+        self.queued = 0
+        self.queued_bounded = 0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    @asynccontextmanager
+    async def slot(self, bounded=True):
+        """Wait for a turn to run a hash operation
+
+        Raises HashQueueFull if bounded and the queue is full.
+        Unbounded waits are for admin batch operations,
+        which should wait rather than fail.
+        """
+        if (
+            bounded
+            and self.max_queued
+            and self.in_flight >= self.max_in_flight
+            and self.queued_bounded >= self.max_queued
+        ):
+            HASH_QUEUE_REJECTED.inc()
+            raise HashQueueFull()
+        self.queued += 1
+        if bounded:
+            self.queued_bounded += 1
+        HASH_QUEUE_DEPTH.set(self.queued)
+        tic = time.perf_counter()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+            if bounded:
+                self.queued_bounded -= 1
+            HASH_QUEUE_DEPTH.set(self.queued)
+        HASH_QUEUE_WAIT_SECONDS.observe(time.perf_counter() - tic)
+        self.in_flight += 1
+        HASH_IN_FLIGHT.set(self.in_flight)
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            HASH_IN_FLIGHT.set(self.in_flight)
+            self._semaphore.release()
@@ -0,0 +1,160 @@
+"""
+Prometheus metrics exported by FirstUseAuthenticator
+
+Metrics are registered in the default registry,
+so they are served by JupyterHub's /hub/metrics endpoint,
+with the same `jupyterhub_` prefix as JupyterHub's own metrics.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+from jupyterhub import metrics
+
+# configurable with $JUPYTERHUB_METRICS_PREFIX in JupyterHub >=5
+metrics_prefix = getattr(metrics, "metrics_prefix", "jupyterhub")
+
+CREDENTIAL_CACHE_REQUESTS = Counter(
+    'firstuse_credential_cache_requests',
+    'Lookups in the verified-credential cache',
+    ['result'],
+    namespace=metrics_prefix,
+)
+
+# create the labels up front, so they exist before the first hit/miss
+for _result in ("hit", "miss"):
+    CREDENTIAL_CACHE_REQUESTS.labels(result=_result)
+
+PASSWORD_CHECK_RUNNING = Gauge(
+    'firstuse_password_check_running',
+    'Whether the password db check is currently running',
+    namespace=metrics_prefix,
+)
+
+PASSWORD_CHECK_USERNAMES_SCANNED = Gauge(
+    'firstuse_password_check_usernames_scanned',
+    'Number of usernames scanned by the current or last password db check',
+    namespace=metrics_prefix,
+)
+
+PASSWORD_CHECK_DURATION_SECONDS = Histogram(
+    'firstuse_password_check_duration_seconds',
+    'Time taken to check the password db at startup',
+    ['status'],
+    namespace=metrics_prefix,
+)
+
+HASH_QUEUE_DEPTH = Gauge(
+    'firstuse_hash_queue_depth',
+    'Number of password hash operations waiting for a slot',
+    namespace=metrics_prefix,
+)
+
+HASH_IN_FLIGHT = Gauge(
+    'firstuse_hash_in_flight',
+    'Number of password hash operations currently running',
+    namespace=metrics_prefix,
+)
+
+HASH_QUEUE_WAIT_SECONDS = Histogram(
+    'firstuse_hash_queue_wait_seconds',
+    'Time password hash operations waited for a slot',
+    namespace=metrics_prefix,
+)
+
+HASH_QUEUE_REJECTED = Counter(
+    'firstuse_hash_queue_rejected',
+    'Password hash operations rejected because the queue was full',
+    namespace=metrics_prefix,
+)
+
+# buckets for operations from sub-millisecond (store lookups)
+# to about a second (expensive password hashes)
+_fast_buckets = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    float("inf"),
+)
+
+AUTHENTICATE_DURATION_SECONDS = Histogram(
+    'firstuse_authenticate_duration_seconds',
+    'Time taken by FirstUseAuthenticator.authenticate',
+    ['status'],
+    buckets=_fast_buckets,
+    namespace=metrics_prefix,
+)
+
+HASH_DURATION_SECONDS = Histogram(
+    'firstuse_hash_duration_seconds',
+    'Time taken to hash or verify a password, excluding time waiting in the queue',
+    ['operation', 'algorithm'],
+    buckets=_fast_buckets,
+    namespace=metrics_prefix,
+)
+
+STORE_DURATION_SECONDS = Histogram(
+    'firstuse_store_duration_seconds',
+    'Time taken by password store operations',
+    ['operation'],
+    buckets=_fast_buckets,
+    namespace=metrics_prefix,
+)
+
+USER_EXISTS_DURATION_SECONDS = Histogram(
+    'firstuse_user_exists_duration_seconds',
+    'Time taken to check whether a user exists in the Hub db',
+    buckets=_fast_buckets,
+    namespace=metrics_prefix,
+)
+
+USERS_CREATED = Counter(
+    'firstuse_users_created',
+    'Passwords set on first use',
+    namespace=metrics_prefix,
+)
+
+LOGIN_REJECTED = Counter(
+    'firstuse_login_rejected',
+    'Rejected logins, by reason',
+    ['reason'],
+    namespace=metrics_prefix,
+)
+
+for _reason in ("wrong_password", "short_password", "unknown_user", "throttled", "busy"):
+    LOGIN_REJECTED.labels(reason=_reason)
+
+PASSWORD_RESETS = Counter(
+    'firstuse_password_resets',
+    'Password resets, by status',
+    ['status'],
+    namespace=metrics_prefix,
+)
+
+for _status in ("success", "short_password", "busy"):
+    PASSWORD_RESETS.labels(status=_status)
+
+JOURNAL_COMMIT_SIZE = Histogram(
+    'firstuse_journal_commit_size',
+    'Number of password writes made durable by each journal fsync',
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+    namespace=metrics_prefix,
+)
+
+HASH_WORKER_RESTARTS = Counter(
+    'firstuse_hash_worker_restarts',
+    'Restarts of pre-forked password hash worker processes, by reason',
+    ['reason'],
+    namespace=metrics_prefix,
+)
+
+for _reason in ("max_jobs", "crash"):
+    HASH_WORKER_RESTARTS.labels(reason=_reason)
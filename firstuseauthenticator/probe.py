@@ -0,0 +1,130 @@
+"""
+Startup probe: measure what a login costs on this machine.
+
+Measures password verification at the configured algorithm and cost,
+password store latency on the configured storage,
+and the Hub user lookup used when create_users is False,
+then estimates how many logins per second the authenticator can handle.
+"""
+import cProfile
+import dbm
+import os
+import statistics
+import time
+
+from jupyterhub.orm import User
+
+from .stores import DBMPasswordStore, SQLitePasswordStore
+
+PROBE_USERNAME = "firstuse-probe-user"
+PROBE_PASSWORD = b"firstuse-probe-password"
+
+
+def _median_time(func, repeat):
+    durations = []
+    for i in range(repeat):
+        tic = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - tic)
+    return statistics.median(durations)
+
+
+def _scratch_store(auth):
+    """A throwaway store like the configured one, on the same storage
+
+    Returns None if the configured store can't be copied safely.
+    """
+    store = auth.password_store
+    if type(store) not in (DBMPasswordStore, SQLitePasswordStore):
+        return None
+    directory = os.path.dirname(os.path.abspath(store.path))
+    path = os.path.join(directory, f".firstuse-probe-{os.getpid()}")
+    scratch = type(store)(parent=auth, log=auth.log, path=path)
+    if isinstance(scratch, SQLitePasswordStore):
+        scratch.import_dbm_path = ""
+    return scratch
+
+
+def _query_user(auth):
+    """The Hub db lookup behind _user_exists, without its cache"""
+    return auth.db.query(User).filter_by(name=PROBE_USERNAME).first()
+
+
+def _probe_store(auth, report, repeat):
+    store = auth.password_store
+    report["store"] = type(store).__name__
+    scratch = _scratch_store(auth)
+    if scratch is not None:
+        try:
+            tic = time.perf_counter()
+            if isinstance(scratch, DBMPasswordStore):
+                scratch.db
+            else:
+                scratch.conn
+            report["store_open_seconds"] = time.perf_counter() - tic
+            report["store_set_seconds"] = _median_time(
+                lambda: scratch.set(PROBE_USERNAME, b"probe"), repeat
+            )
+            if isinstance(scratch, DBMPasswordStore):
+                report["dbm_flavor"] = dbm.whichdb(scratch.path)
+        finally:
+            scratch.close()
+            for path in scratch.files():
+                os.remove(path)
+    if isinstance(store, DBMPasswordStore) and dbm.whichdb(store.path):
+        # the flavor of the existing db, which is what will be opened
+        report["dbm_flavor"] = dbm.whichdb(store.path)
+    report["store_get_seconds"] = _median_time(
+        lambda: store.get(PROBE_USERNAME), repeat
+    )
+
+
+def probe(auth, repeat=5, profile_path=""):
+    """Measure the cost of a login with the authenticator's configuration
+
+    Returns a dict of measurements and estimates.
+    If profile_path is given, a cProfile of the blocking work of a synthetic login
+    is written there.
+    """
+    report = {}
+    hasher = auth._get_hasher()
+    report["hash_algorithm"] = hasher.name
+    hashed = hasher.hash(PROBE_PASSWORD)
+    report["verify_seconds"] = _median_time(
+        lambda: hasher.verify(PROBE_PASSWORD, hashed), repeat
+    )
+    _probe_store(auth, report, repeat)
+
+    report["user_exists_seconds"] = None
+    if not auth.create_users:
+        report["user_exists_seconds"] = _median_time(lambda: _query_user(auth), repeat)
+
+    # hashes run in parallel, up to the number of CPUs
+    hash_parallelism = min(
+        auth.max_concurrent_hashes, auth.hash_executor_workers, os.cpu_count() or 1
+    )
+    # the dbm store serializes access to its one handle
+    store_parallelism = (
+        1 if isinstance(auth.password_store, DBMPasswordStore) else auth.io_executor_workers
+    )
+    limits = {
+        "hashing": hash_parallelism / report["verify_seconds"],
+        "store": store_parallelism / max(report["store_get_seconds"], 1e-9),
+    }
+    if report["user_exists_seconds"] is not None:
+        # runs on the event loop
+        limits["user_exists"] = 1 / max(report["user_exists_seconds"], 1e-9)
+    report["bottleneck"] = min(limits, key=limits.get)
+    report["max_logins_per_second"] = limits[report["bottleneck"]]
+
+    if profile_path:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        if not auth.create_users:
+            _query_user(auth)
+        auth.password_store.get(PROBE_USERNAME)
+        hasher.verify(PROBE_PASSWORD, hashed)
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        report["profile_path"] = profile_path
+    return report
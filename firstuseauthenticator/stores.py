@@ -0,0 +1,1712 @@
+"""
+Password stores for FirstUseAuthenticator.
+
+A password store maps (normalized) usernames to password hashes.
+The store to use is selected with `FirstUseAuthenticator.password_store_class`.
+"""
+import asyncio
+import dbm
+import importlib
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from traitlets import default, Bool, Float, Instance, Integer, Type, Unicode
+from traitlets.config import LoggingConfigurable
+
+from .metrics import JOURNAL_COMMIT_SIZE, STORE_DURATION_SECONDS
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class PasswordStore(LoggingConfigurable):
+    """Base class for password stores
+
+    Usernames are str, password hashes are bytes.
+    Subclasses must implement get, set, delete and keys.
+
+    On the event loop, the authenticator uses the async versions (aget, aset, ...),
+    which run the blocking methods in FirstUseAuthenticator.io_executor,
+    so slow storage (e.g. on NFS) doesn't stall the Hub.
+    """
+
+    @contextmanager
+    def _observe(self, operation):
+        """Time a store operation, and trace it with the parent's span_hook if any"""
+        span_hook = getattr(self.parent, "span_hook", None)
+        with STORE_DURATION_SECONDS.labels(operation=operation).time():
+            if span_hook is None:
+                yield
+            else:
+                with span_hook(f"firstuse.store.{operation}", {"store": type(self).__name__}):
+                    yield
+
+    def get(self, username):
+        """Return the password hash for username, or None if there isn't one"""
+        raise NotImplementedError()
+
+    def set(self, username, hashed):
+        """Store the password hash for username"""
+        raise NotImplementedError()
+
+    def delete(self, username):
+        """Remove the password hash for username, if there is one"""
+        raise NotImplementedError()
+
+    def keys(self):
+        """Iterate over all usernames in the store"""
+        raise NotImplementedError()
+
+    def setdefault(self, username, hashed):
+        """Store hashed for username, unless a hash is already stored
+
+        Returns the stored hash.
+        Stores that are shared between processes should override this
+        to make it atomic.
+        """
+        stored = self.get(username)
+        if stored is None:
+            self.set(username, hashed)
+            stored = hashed
+        return stored
+
+    def set_many(self, items):
+        """Store many (username, hashed) pairs at once"""
+        for username, hashed in items:
+            self.set(username, hashed)
+
+    def delete_many(self, usernames):
+        """Remove many usernames at once"""
+        for username in usernames:
+            self.delete(username)
+
+    def __contains__(self, username):
+        return self.get(username) is not None
+
+    def _normalize(self, username):
+        normalize_username = getattr(self.parent, "normalize_username", None)
+        if normalize_username is None:
+            return username
+        return normalize_username(username)
+
+    #: whether unnormalized_index can answer without scanning the store
+    normalized_index_built = False
+
+    def unnormalized_index(self):
+        """Return a dict of {normalized username: [non-normalized usernames]}
+        for all non-normalized usernames in the store
+
+        The default scans all keys.
+        Stores that keep an index (normalized_index_built) look it up instead.
+        """
+        index = {}
+        for username in self.keys():
+            normalized_username = self._normalize(username)
+            if username != normalized_username:
+                index.setdefault(normalized_username, []).append(username)
+        return index
+
+    # async versions of the above, used by the authenticator on the event loop.
+    # By default, the blocking methods are run in the parent's io_executor.
+    # Stores with non-blocking clients can override these.
+
+    async def _run_blocking(self, method, *args):
+        """Run a blocking store method in the I/O executor"""
+        executor = getattr(self.parent, "io_executor", None)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, method, *args)
+
+    async def aget(self, username):
+        return await self._run_blocking(self.get, username)
+
+    async def aset(self, username, hashed):
+        return await self._run_blocking(self.set, username, hashed)
+
+    async def adelete(self, username):
+        return await self._run_blocking(self.delete, username)
+
+    async def asetdefault(self, username, hashed):
+        return await self._run_blocking(self.setdefault, username, hashed)
+
+    async def aset_many(self, items):
+        return await self._run_blocking(self.set_many, list(items))
+
+    async def adelete_many(self, usernames):
+        return await self._run_blocking(self.delete_many, list(usernames))
+
+    def files(self):
+        """Return the files on disk that hold the store, if any"""
+        return []
+
+    def flush(self):
+        """Apply writes held back by the store (e.g. in a journal) to where they are kept"""
+        pass
+
+    def compact(self):
+        """Reclaim space left by deleted or overwritten entries"""
+        pass
+
+    def close(self):
+        """Release any resources held by the store"""
+        pass
+
+
+class _CheckedMarker:
+    """Whether a dbm file has changed since the authenticator last checked it
+
+    The check stores the fingerprint (path, mtime and size of each file) of the db
+    in path + "-checked".
+    While the db matches it, writes made through the store record it again
+    (see tracking), so that only writes made with other tools
+    make the db look changed.
+    """
+
+    def __init__(self, path, extensions):
+        self.path = path
+        self.marker_path = path + "-checked"
+        self.extensions = extensions
+        # the fingerprint in the marker, as long as the db still matches it
+        self.fingerprint = None
+
+    def current(self):
+        """The fingerprint of the db files as they are now"""
+        fingerprint = []
+        for path in (self.path + ext for ext in self.extensions):
+            if os.path.isfile(path):
+                st = os.stat(path)
+                fingerprint.append([path, st.st_mtime_ns, st.st_size])
+        return fingerprint
+
+    def load(self):
+        """Read the marker, and track it if the db still matches"""
+        try:
+            with open(self.marker_path) as f:
+                fingerprint = json.load(f).get("fingerprint")
+        except (OSError, ValueError, AttributeError):
+            fingerprint = None
+        if fingerprint is not None and fingerprint == self.current():
+            self.fingerprint = fingerprint
+        else:
+            self.fingerprint = None
+
+    def record(self):
+        """Record the current fingerprint in the marker"""
+        fingerprint = self.current()
+        tmp_path = self.marker_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": fingerprint}, f)
+        os.replace(tmp_path, self.marker_path)
+        self.fingerprint = fingerprint
+
+    @property
+    def unchanged(self):
+        return self.fingerprint is not None and self.fingerprint == self.current()
+
+    @contextmanager
+    def tracking(self):
+        """Record the marker again after a write by the store
+
+        Only if the db matched it before the write.
+        Otherwise something else has written to the db since the check,
+        and the marker is left alone, so that the next check scans the db.
+        """
+        unchanged = self.unchanged
+        self.fingerprint = None
+        yield
+        if unchanged:
+            self.record()
+
+
+def _close_dbm(db, checked):
+    # some flavors (dbm.dumb) write their files again on close
+    with checked.tracking():
+        db.close()
+
+
+class DBMPasswordStore(PasswordStore):
+    """Store passwords in a dbm file
+
+    A single handle is opened on first use and kept open
+    for the lifetime of the store, instead of opening the file for every request.
+
+    The db also holds an index of non-normalized usernames,
+    under reserved keys that can't be usernames,
+    kept up to date by every write once it has been built
+    (by the authenticator's password check).
+    It only knows about writes made through the store,
+    so the store also keeps the check's "-checked" marker up to date
+    after its own writes, and the check only scans the whole db
+    if something else has written to it.
+    """
+
+    # reserved keys start with a NUL byte
+    _reserved_prefix = b"\0"
+    # present once the index has been built:
+    # JSON [normalized usernames with an index entry]
+    _index_key = b"\0unnormalized-index"
+    # one key per normalized username with non-normalized forms in the db:
+    # prefix + normalized username: JSON [non-normalized usernames]
+    _index_entry_prefix = b"\0unnormalized:"
+
+    path = Unicode(
+        config=True,
+        help="""
+        Path to the dbm file.
+
+        Defaults to FirstUseAuthenticator.dbm_path.
+        """,
+    )
+
+    @default("path")
+    def _path_default(self):
+        return getattr(self.parent, "dbm_path", "passwords.dbm")
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # dbm handles are not threadsafe
+        self._lock = threading.Lock()
+        self._db = None
+        self._finalizer = None
+        self._checked = None
+
+    @property
+    def db(self):
+        """The open dbm handle, opened on first access"""
+        if self._db is None:
+            # resolve the path now, because some dbm flavors (dbm.dumb)
+            # keep a relative path and write to it again on close
+            path = os.path.abspath(self.path)
+            self.log.debug("Opening password db %s", path)
+            self._checked = _CheckedMarker(path, self.dbm_extensions)
+            self._checked.load()
+            with self._observe("open"):
+                self._db = dbm.open(path, "c", 0o600)
+            # close the handle on garbage collection or exit
+            self._finalizer = weakref.finalize(
+                self, _close_dbm, self._db, self._checked
+            )
+        return self._db
+
+    def _sync(self):
+        # not all dbm flavors have sync (ndbm doesn't)
+        sync = getattr(self._db, "sync", None)
+        if sync is not None:
+            sync()
+
+    @contextmanager
+    def _writing(self):
+        """Write to the db and sync, keeping the "-checked" marker up to date
+
+        Must be called with the lock held.
+        """
+        db = self.db
+        with self._checked.tracking():
+            yield db
+            self._sync()
+
+    def unchanged_since_check(self):
+        """Whether the db is unchanged since mark_checked, but for writes through the store"""
+        with self._lock:
+            self.db
+            return self._checked.unchanged
+
+    def mark_checked(self):
+        """Record that the db has been checked, as it is now"""
+        with self._lock:
+            self.db
+            self._sync()
+            self._checked.record()
+
+    def _index_entry_key(self, normalized_username):
+        return self._index_entry_prefix + normalized_username.encode("utf8")
+
+    def _load_index_entry(self, db, normalized_username):
+        """The non-normalized forms of normalized_username in the index"""
+        raw = db.get(self._index_entry_key(normalized_username), None)
+        if raw is None:
+            return []
+        return json.loads(raw)
+
+    def _load_indexed(self, db):
+        """The normalized usernames with an index entry, None if the index isn't built"""
+        raw = db.get(self._index_key, None)
+        if raw is None:
+            return None
+        indexed = json.loads(raw)
+        if not isinstance(indexed, list):
+            return None
+        return indexed
+
+    def _update_index(self, db, username, present):
+        """Record whether a non-normalized username is present
+
+        Must be called with the lock held.
+        Normalized usernames, which are most writes, cost nothing,
+        and others only read and write their own index entry.
+        """
+        normalized_username = self._normalize(username)
+        if username == normalized_username:
+            return
+        indexed = self._load_indexed(db)
+        if indexed is None:
+            return
+        usernames = self._load_index_entry(db, normalized_username)
+        if present and username not in usernames:
+            usernames.append(username)
+        elif not present and username in usernames:
+            usernames.remove(username)
+        else:
+            return
+        key = self._index_entry_key(normalized_username)
+        if usernames:
+            db[key] = json.dumps(usernames).encode("utf8")
+            if normalized_username not in indexed:
+                indexed.append(normalized_username)
+        else:
+            del db[key]
+            indexed.remove(normalized_username)
+        db[self._index_key] = json.dumps(indexed).encode("utf8")
+
+    @property
+    def normalized_index_built(self):
+        with self._lock:
+            return self._load_indexed(self.db) is not None
+
+    def unnormalized_index(self):
+        with self._lock:
+            db = self.db
+            indexed = self._load_indexed(db)
+            if indexed is not None:
+                return {
+                    normalized_username: self._load_index_entry(db, normalized_username)
+                    for normalized_username in indexed
+                }
+        return super().unnormalized_index()
+
+    def save_unnormalized_index(self, index):
+        """Store the index of non-normalized usernames, built by a full scan"""
+        with self._lock, self._writing() as db:
+            for normalized_username in self._load_indexed(db) or []:
+                del db[self._index_entry_key(normalized_username)]
+            for normalized_username, usernames in index.items():
+                db[self._index_entry_key(normalized_username)] = json.dumps(
+                    usernames
+                ).encode("utf8")
+            db[self._index_key] = json.dumps(list(index)).encode("utf8")
+
+    def get(self, username):
+        with self._lock:
+            db = self.db
+            with self._observe("get"):
+                return db.get(username.encode("utf8"), None)
+
+    def set(self, username, hashed):
+        with self._lock, self._observe("set"), self._writing() as db:
+            db[username.encode("utf8")] = hashed
+            self._update_index(db, username, True)
+
+    def delete(self, username):
+        with self._lock, self._observe("delete"):
+            if username.encode("utf8") not in self.db:
+                return
+            with self._writing() as db:
+                del db[username.encode("utf8")]
+                self._update_index(db, username, False)
+
+    def keys(self):
+        with self._lock:
+            db = self.db
+            if hasattr(db, "firstkey"):
+                return self._walk_keys()
+            # other flavors can only list all keys at once
+            keys = db.keys()
+        return (
+            key.decode("utf8")
+            for key in keys
+            if not key.startswith(self._reserved_prefix)
+        )
+
+    def _walk_keys(self):
+        """Walk keys one at a time (dbm.gnu), without loading them all"""
+        with self._lock:
+            key = self.db.firstkey()
+        while key is not None:
+            if not key.startswith(self._reserved_prefix):
+                yield key.decode("utf8")
+            with self._lock:
+                key = self.db.nextkey(key)
+
+    # it's nontrival to check for db existence, because there are so many extensions
+    # and you don't give dbm a path, you give it a *base* name,
+    # which may point to one or more paths.
+    # There's no way to retrieve the actual path(s) for a db
+    dbm_extensions = ("", ".db", ".pag", ".dir", ".dat", ".bak")
+
+    def files(self, path=None):
+        """Return the files on disk that make up the dbm at path
+
+        Defaults to this store's path.
+        """
+        if path is None:
+            path = self.path
+        return list(
+            filter(os.path.isfile, (path + ext for ext in self.dbm_extensions))
+        )
+
+    def compact(self):
+        """Rewrite the db without the space left by deleted entries
+
+        dbm files never shrink on their own.
+        dbm.gnu can reorganize in place,
+        other flavors are copied into a new db of the same flavor,
+        which then replaces the original files.
+        """
+        with self._lock, self._writing() as db:
+            if hasattr(db, "reorganize"):
+                db.reorganize()
+                return
+            path = os.path.abspath(self.path)
+            flavor = dbm.whichdb(path)
+            module = importlib.import_module(flavor)
+            compact_path = path + "-compact"
+            with module.open(compact_path, "n", 0o600) as new_db:
+                for key in db.keys():
+                    new_db[key] = db[key]
+            self._finalizer()
+            self._db = None
+            self._finalizer = None
+            for old_file in self.files(path):
+                os.remove(old_file)
+            for new_file in self.files(compact_path):
+                os.replace(new_file, path + new_file[len(compact_path) :])
+
+    def backup(self, backup_path):
+        """Copy the db files to backup_path
+
+        Returns the list of backup files.
+        """
+        backup_files = []
+        with self._lock:
+            # every write is synced already
+            for path in self.files():
+                # each file is self.path + one of dbm_extensions
+                backup = backup_path + path[len(self.path) :]
+                shutil.copyfile(path, backup)
+                backup_files.append(backup)
+        return backup_files
+
+    def close(self):
+        with self._lock:
+            if self._finalizer is not None:
+                self._finalizer()
+            self._db = None
+            self._finalizer = None
+
+
+class SQLitePasswordStore(PasswordStore):
+    """Store passwords in a SQLite database
+
+    The database is used in WAL mode, so that logins can read
+    while another thread or process is writing,
+    and concurrent writers wait for each other instead of failing.
+    WAL mode needs memory shared between the processes using the database,
+    so all of them must be on the same host, with the database on a local filesystem.
+    """
+
+    path = Unicode(
+        config=True,
+        help="""
+        Path to the SQLite database file.
+
+        Defaults to FirstUseAuthenticator.dbm_path with a .sqlite extension.
+        """,
+    )
+
+    @default("path")
+    def _path_default(self):
+        dbm_path = getattr(self.parent, "dbm_path", "passwords.dbm")
+        return os.path.splitext(dbm_path)[0] + ".sqlite"
+
+    import_dbm_path = Unicode(
+        config=True,
+        help="""
+        Path to an existing dbm password file to import.
+
+        The import happens once, the first time the SQLite database is opened.
+        Defaults to FirstUseAuthenticator.dbm_path.
+        Set to an empty string to skip the import.
+        """,
+    )
+
+    @default("import_dbm_path")
+    def _import_dbm_path_default(self):
+        return getattr(self.parent, "dbm_path", "passwords.dbm")
+
+    busy_timeout = Float(
+        30,
+        config=True,
+        help="""
+        Seconds to wait for another writer to finish before failing.
+        """,
+    )
+
+    synchronous_full = Bool(
+        False,
+        config=True,
+        help="""
+        Use synchronous=FULL instead of NORMAL.
+
+        With NORMAL (the default), WAL mode never corrupts the database,
+        but the most recent writes may be lost on power failure.
+        """,
+    )
+
+    _create_sql = """
+    CREATE TABLE IF NOT EXISTS passwords (
+        username TEXT PRIMARY KEY NOT NULL,
+        normalized_username TEXT NOT NULL,
+        hash BLOB NOT NULL,
+        created REAL NOT NULL,
+        updated REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS ix_passwords_normalized_username
+        ON passwords (normalized_username);
+    CREATE TABLE IF NOT EXISTS metadata (
+        key TEXT PRIMARY KEY NOT NULL,
+        value TEXT NOT NULL
+    );
+    """
+    # sqlite3 keeps compiled statements in a per-connection cache,
+    # so using the same SQL strings avoids re-preparing them on every call
+    _get_sql = "SELECT hash FROM passwords WHERE username = ?"
+    _set_sql = (
+        "INSERT INTO passwords (username, normalized_username, hash, created, updated)"
+        " VALUES (?, ?, ?, ?, ?)"
+        " ON CONFLICT (username) DO UPDATE SET hash = excluded.hash, updated = excluded.updated"
+    )
+    _insert_sql = (
+        "INSERT OR IGNORE INTO passwords (username, normalized_username, hash, created, updated)"
+        " VALUES (?, ?, ?, ?, ?)"
+    )
+    _delete_sql = "DELETE FROM passwords WHERE username = ?"
+    _keys_sql = "SELECT username FROM passwords"
+    _unnormalized_index_sql = (
+        "SELECT normalized_username, username FROM passwords"
+        " WHERE username != normalized_username"
+    )
+
+    # the normalized_username column is indexed
+    normalized_index_built = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # sqlite connections cannot be shared across threads,
+        # so there is one connection per thread
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._initialized = False
+        # resolved on first connect, so that connections opened later
+        # in other threads use the same file
+        self._abspath = None
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self._abspath,
+            timeout=self.busy_timeout,
+            isolation_level=None,
+            cached_statements=32,
+            check_same_thread=False,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "PRAGMA synchronous=%s" % ("FULL" if self.synchronous_full else "NORMAL")
+        )
+        return conn
+
+    @property
+    def conn(self):
+        """The sqlite connection for the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            return conn
+        with self._connections_lock:
+            if self._abspath is None:
+                self._abspath = os.path.abspath(self.path)
+            if not os.path.exists(self._abspath):
+                # create the file with restricted permissions
+                os.close(os.open(self._abspath, os.O_CREAT | os.O_WRONLY, 0o600))
+            with self._observe("open"):
+                conn = self._connect()
+            if not self._initialized:
+                conn.executescript(self._create_sql)
+                self._import_dbm(conn)
+                self._initialized = True
+            self._connections.append(conn)
+        weakref.finalize(self, conn.close)
+        self._local.conn = conn
+        return conn
+
+    def _import_dbm(self, conn):
+        """One-shot import of an existing dbm password file"""
+        if not self.import_dbm_path:
+            return
+        if conn.execute(
+            "SELECT value FROM metadata WHERE key = 'imported_dbm'"
+        ).fetchone():
+            return
+        if not dbm.whichdb(self.import_dbm_path):
+            # no dbm file to import
+            return
+        now = time.time()
+        with dbm.open(self.import_dbm_path, "r") as db:
+            rows = []
+            for key in db.keys():
+                if key.startswith(DBMPasswordStore._reserved_prefix):
+                    continue
+                username = key.decode("utf8")
+                rows.append((username, self._normalize(username), db[key], now, now))
+        with self._transaction(conn):
+            conn.executemany(self._insert_sql, rows)
+            conn.execute(
+                "INSERT INTO metadata (key, value) VALUES ('imported_dbm', ?)",
+                (self.import_dbm_path,),
+            )
+        self.log.info(
+            "Imported %i passwords from %s into %s",
+            len(rows),
+            self.import_dbm_path,
+            self.path,
+        )
+
+    @contextmanager
+    def _transaction(self, conn):
+        """Context manager for a write transaction"""
+        # take the write lock up front,
+        # rather than failing to upgrade a read lock later
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def get(self, username):
+        conn = self.conn
+        with self._observe("get"):
+            row = conn.execute(self._get_sql, (username,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def set(self, username, hashed):
+        self.set_many([(username, hashed)])
+
+    def set_many(self, items):
+        now = time.time()
+        rows = [
+            (username, self._normalize(username), hashed, now, now)
+            for username, hashed in items
+        ]
+        with self._observe("set"), self._transaction(self.conn) as conn:
+            conn.executemany(self._set_sql, rows)
+
+    def setdefault(self, username, hashed):
+        now = time.time()
+        with self._observe("set"), self._transaction(self.conn) as conn:
+            conn.execute(
+                self._insert_sql,
+                (username, self._normalize(username), hashed, now, now),
+            )
+            return conn.execute(self._get_sql, (username,)).fetchone()[0]
+
+    def delete(self, username):
+        self.delete_many([username])
+
+    def delete_many(self, usernames):
+        with self._observe("delete"), self._transaction(self.conn) as conn:
+            conn.executemany(self._delete_sql, [(username,) for username in usernames])
+
+    def keys(self):
+        for (username,) in self.conn.execute(self._keys_sql):
+            yield username
+
+    def unnormalized_index(self):
+        index = {}
+        for normalized_username, username in self.conn.execute(
+            self._unnormalized_index_sql
+        ):
+            index.setdefault(normalized_username, []).append(username)
+        return index
+
+    def files(self):
+        return list(
+            filter(os.path.isfile, (self.path + ext for ext in ("", "-wal", "-shm")))
+        )
+
+    def compact(self):
+        self.conn.execute("VACUUM")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+        self._local = threading.local()
+
+
+class RedisPasswordStore(PasswordStore):
+    """Store passwords in Redis (or a server speaking the Redis protocol)
+
+    For running multiple Hub replicas against one password store.
+    Connections are pooled, and batch operations are pipelined.
+
+    Hashes read from the server are kept in a local LRU cache.
+    Every write publishes the changed username on `invalidation_channel`,
+    and each store evicts usernames it hears about from its cache,
+    so a password changed via one Hub is not served stale by another.
+    The cache is only used while subscribed to the channel,
+    and is cleared on every (re)subscription, because messages may have been missed.
+
+    Requires the redis package.
+    """
+
+    url = Unicode(
+        "redis://localhost:6379/0",
+        config=True,
+        help="""
+        URL of the Redis server, e.g. `redis://:password@host:6379/0`
+        or `rediss://` for TLS.
+        """,
+    )
+
+    key_prefix = Unicode(
+        "firstuse:password:",
+        config=True,
+        help="""
+        Prefix of the keys holding password hashes.
+
+        Change to share one Redis database between multiple Hubs.
+        """,
+    )
+
+    max_connections = Integer(
+        32,
+        config=True,
+        help="""
+        Maximum number of connections in the pool.
+
+        When all connections are in use, requests wait for one to be returned
+        for up to `connection_timeout` seconds.
+        """,
+    )
+
+    connection_timeout = Float(
+        10,
+        config=True,
+        help="""
+        Seconds to wait for a free connection, or to connect to the server.
+        """,
+    )
+
+    local_cache_size = Integer(
+        10000,
+        config=True,
+        help="""
+        Number of password hashes to keep in the local cache.
+
+        Set to 0 to disable the cache and always read from the server.
+        """,
+    )
+
+    invalidation_channel = Unicode(
+        config=True,
+        help="""
+        Pub/sub channel for cache invalidation messages.
+
+        Defaults to `key_prefix` + `invalidate`.
+        """,
+    )
+
+    @default("invalidation_channel")
+    def _invalidation_channel_default(self):
+        return self.key_prefix + "invalidate"
+
+    scan_count = Integer(
+        1000,
+        config=True,
+        help="""
+        Number of keys to ask for in each SCAN when listing users.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        if redis is None:
+            raise ImportError("RedisPasswordStore requires the redis package")
+        super().__init__(**kwargs)
+        self._client = None
+        self._client_lock = threading.Lock()
+        # local cache of username: hash, only used while _subscribed is set
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        # incremented on every eviction, so that a value read from the server
+        # is not cached if it may have been invalidated while we were reading it
+        self._cache_version = 0
+        self._subscribed = threading.Event()
+        self._closed = threading.Event()
+        self._listener = None
+        # to recognize our own invalidation messages
+        self._origin = uuid.uuid4().hex
+
+    @property
+    def client(self):
+        """The Redis client, connecting on first access"""
+        if self._client is not None:
+            return self._client
+        with self._client_lock:
+            if self._client is None:
+                pool = redis.BlockingConnectionPool.from_url(
+                    self.url,
+                    max_connections=self.max_connections,
+                    timeout=self.connection_timeout,
+                    socket_connect_timeout=self.connection_timeout,
+                    # RESP2 is spoken by every Redis-compatible server
+                    protocol=2,
+                )
+                self._client = redis.Redis(connection_pool=pool)
+                self._closed.clear()
+                if self.local_cache_size:
+                    self._listener = threading.Thread(
+                        target=self._listen,
+                        name="firstuse-redis-invalidation",
+                        daemon=True,
+                    )
+                    self._listener.start()
+        return self._client
+
+    def _key(self, username):
+        return (self.key_prefix + username).encode("utf8")
+
+    def _listen(self):
+        """Evict usernames published on invalidation_channel from the cache"""
+        while not self._closed.is_set():
+            pubsub = self._client.pubsub()
+            try:
+                pubsub.subscribe(self.invalidation_channel)
+                while not self._closed.is_set():
+                    message = pubsub.get_message(timeout=1)
+                    if message is None:
+                        continue
+                    if message["type"] == "subscribe":
+                        # anything cached so far may have been changed
+                        # without us hearing about it
+                        self._cache_clear()
+                        self._subscribed.set()
+                    elif message["type"] == "message":
+                        origin, _, username = message["data"].decode("utf8").partition("\0")
+                        if origin != self._origin:
+                            self._cache_evict(username)
+            except Exception as e:
+                if self._closed.is_set():
+                    break
+                self.log.warning("Lost invalidation subscription to %s: %s", self.url, e)
+                self._subscribed.clear()
+                self._cache_clear()
+                self._closed.wait(1)
+            finally:
+                self._subscribed.clear()
+                pubsub.close()
+
+    def _cache_get(self, username):
+        if not self._subscribed.is_set():
+            return None
+        with self._cache_lock:
+            hashed = self._cache.get(username)
+            if hashed is not None:
+                self._cache.move_to_end(username)
+            return hashed
+
+    def _cache_put(self, username, hashed, version):
+        if not self.local_cache_size or not self._subscribed.is_set():
+            return
+        with self._cache_lock:
+            if version != self._cache_version:
+                return
+            self._cache[username] = hashed
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.local_cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_evict(self, username):
+        with self._cache_lock:
+            self._cache_version += 1
+            self._cache.pop(username, None)
+
+    def _cache_clear(self):
+        with self._cache_lock:
+            self._cache_version += 1
+            self._cache.clear()
+
+    def _publish(self, pipe, username):
+        """Add an invalidation message for username to a pipeline"""
+        pipe.publish(self.invalidation_channel, f"{self._origin}\0{username}")
+
+    def get(self, username):
+        hashed = self._cache_get(username)
+        if hashed is not None:
+            return hashed
+        client = self.client
+        version = self._cache_version
+        with self._observe("get"):
+            hashed = client.get(self._key(username))
+        if hashed is not None:
+            self._cache_put(username, hashed, version)
+        return hashed
+
+    async def aget(self, username):
+        # serve cache hits without a trip through the executor
+        hashed = self._cache_get(username)
+        if hashed is not None:
+            return hashed
+        return await super().aget(username)
+
+    def set(self, username, hashed):
+        self.set_many([(username, hashed)])
+
+    def set_many(self, items):
+        client = self.client
+        items = list(items)
+        version = self._cache_version
+        with self._observe("set"):
+            with client.pipeline(transaction=False) as pipe:
+                for username, hashed in items:
+                    pipe.set(self._key(username), hashed)
+                    self._publish(pipe, username)
+                pipe.execute()
+        for username, hashed in items:
+            self._cache_put(username, hashed, version)
+
+    def setdefault(self, username, hashed):
+        client = self.client
+        version = self._cache_version
+        with self._observe("set"):
+            with client.pipeline(transaction=True) as pipe:
+                pipe.set(self._key(username), hashed, nx=True)
+                pipe.get(self._key(username))
+                created, stored = pipe.execute()
+            if created:
+                with client.pipeline(transaction=False) as pipe:
+                    self._publish(pipe, username)
+                    pipe.execute()
+        self._cache_put(username, stored, version)
+        return stored
+
+    def delete(self, username):
+        self.delete_many([username])
+
+    def delete_many(self, usernames):
+        client = self.client
+        usernames = list(usernames)
+        with self._observe("delete"):
+            with client.pipeline(transaction=False) as pipe:
+                for username in usernames:
+                    pipe.delete(self._key(username))
+                    self._publish(pipe, username)
+                pipe.execute()
+        for username in usernames:
+            self._cache_evict(username)
+
+    def keys(self):
+        prefix = self.key_prefix.encode("utf8")
+        # escape glob characters in the prefix
+        pattern = b"".join(
+            b"\\" + bytes([c]) if c in b"*?[]\\" else bytes([c]) for c in prefix
+        )
+        for key in self.client.scan_iter(match=pattern + b"*", count=self.scan_count):
+            yield key[len(prefix) :].decode("utf8")
+
+    def close(self):
+        self._closed.set()
+        if self._listener is not None:
+            self._listener.join()
+            self._listener = None
+        with self._client_lock:
+            if self._client is not None:
+                self._client.connection_pool.disconnect()
+                self._client = None
+        self._cache_clear()
+
+
+class JournalPasswordStore(PasswordStore):
+    """Write-behind journal in front of another password store
+
+    Writes are appended to a journal file,
+    and acknowledged once the journal has been fsynced.
+    Writes arriving while an fsync is in progress are committed together by the next one
+    (group commit), so a burst of first logins costs a few fsyncs
+    instead of one synchronous store write each.
+
+    Journaled writes are kept in memory (the tail), where reads look first,
+    and are periodically applied to the backing store (`store_class`) in batches,
+    after which the journal is emptied.
+    On startup, any journal left by a crash is replayed,
+    so no acknowledged write is lost.
+    """
+
+    store_class = Type(
+        DBMPasswordStore,
+        klass=PasswordStore,
+        config=True,
+        help="""
+        The password store that journaled writes are applied to.
+        """,
+    )
+
+    store = Instance(PasswordStore)
+
+    @default("store")
+    def _store_default(self):
+        return self.store_class(parent=self.parent, log=self.log)
+
+    path = Unicode(
+        config=True,
+        help="""
+        Path to the journal file.
+
+        Defaults to the backing store's path (or FirstUseAuthenticator.dbm_path)
+        with a .journal extension.
+        """,
+    )
+
+    @default("path")
+    def _path_default(self):
+        path = getattr(self.store, "path", None) or getattr(
+            self.parent, "dbm_path", "passwords.dbm"
+        )
+        return path + ".journal"
+
+    commit_delay = Float(
+        0,
+        config=True,
+        help="""
+        Seconds to wait for more writes before each fsync.
+
+        Writes are already grouped while an fsync is in progress.
+        A small delay (e.g. 0.005) makes groups bigger on fast disks,
+        at the cost of that much latency per write.
+        """,
+    )
+
+    compact_threshold = Integer(
+        1000,
+        config=True,
+        help="""
+        Apply the journal to the backing store once it has this many writes.
+        """,
+    )
+
+    compact_interval = Float(
+        10,
+        config=True,
+        help="""
+        Apply the journal to the backing store at least this often, in seconds,
+        if it has any writes.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._opened = False
+        self._closing = False
+        self._committer = None
+        self._journal = None
+        # username: hash (None if deleted), for writes not yet in the backing store
+        self._tail = {}
+        # writes waiting for the next fsync, and the future resolved by it
+        self._pending = []
+        self._pending_future = Future()
+        # writes in the journal file, not yet applied to the backing store
+        self._committed = {}
+        # held while writing or truncating the journal file,
+        # so that a compaction can't truncate records committed after it started
+        self._journal_lock = threading.Lock()
+        # incremented by every compaction, which moves writes from the tail
+        # to the backing store
+        self._generation = 0
+
+    def _open(self):
+        """Replay any existing journal and start the committer thread"""
+        if self._opened:
+            return
+        with self._lock:
+            if self._opened:
+                return
+            path = os.path.abspath(self.path)
+            replayed = 0
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    for line in f:
+                        try:
+                            username, hashed = json.loads(line)
+                        except ValueError:
+                            # incomplete last write from a crash, never acknowledged
+                            self.log.warning("Ignoring incomplete record at end of %s", path)
+                            break
+                        if hashed is not None:
+                            hashed = hashed.encode("ascii")
+                        self._tail[username] = self._committed[username] = hashed
+                        replayed += 1
+            if replayed:
+                self.log.info("Replayed %i password writes from %s", replayed, path)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+            self._journal = os.fdopen(fd, "ab")
+            if not replayed:
+                # start from a clean journal, without any incomplete record
+                self._journal.truncate(0)
+            self._committer = threading.Thread(
+                target=self._commit_loop, name="firstuse-journal", daemon=True
+            )
+            self._committer.start()
+            self._opened = True
+        if replayed:
+            try:
+                self._compact_journal()
+            except Exception:
+                # still served from the journal, and retried by the committer
+                self.log.exception("Failed to apply password journal to %s", self.store)
+
+    async def _aopen(self):
+        if not self._opened:
+            await self._run_blocking(self._open)
+
+    def _append_locked(self, records):
+        """Queue (username, hash or None) records for the next commit
+
+        Must be called with the lock held.
+        Returns a Future resolved when they are durable.
+        """
+        for username, hashed in records:
+            self._tail[username] = hashed
+            self._pending.append((username, hashed))
+        self._wakeup.notify()
+        return self._pending_future
+
+    def _append(self, records):
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Password journal is closed")
+            return self._append_locked(records)
+
+    def _commit_loop(self):
+        last_compaction = time.monotonic()
+        while True:
+            with self._lock:
+                while not (self._pending or self._closing):
+                    if not self._committed:
+                        self._wakeup.wait()
+                        continue
+                    remaining = self.compact_interval - (time.monotonic() - last_compaction)
+                    if remaining <= 0:
+                        break
+                    self._wakeup.wait(timeout=remaining)
+                if self._pending and self.commit_delay:
+                    self._wakeup.wait(timeout=self.commit_delay)
+                records, self._pending = self._pending, []
+                future, self._pending_future = self._pending_future, Future()
+                closing = self._closing
+            if records:
+                self._commit(records, future)
+            if self._committed and (
+                closing
+                or len(self._committed) >= self.compact_threshold
+                or time.monotonic() - last_compaction >= self.compact_interval
+            ):
+                try:
+                    self._compact_journal()
+                except Exception:
+                    self.log.exception("Failed to apply password journal to %s", self.store)
+                last_compaction = time.monotonic()
+            if closing and not self._pending:
+                return
+
+    def _commit(self, records, future):
+        """Write and fsync a group of records, then acknowledge them"""
+        data = b"".join(
+            json.dumps(
+                [username, None if hashed is None else hashed.decode("ascii")]
+            ).encode("utf8")
+            + b"\n"
+            for username, hashed in records
+        )
+        with self._journal_lock:
+            try:
+                with self._observe("commit"):
+                    self._journal.write(data)
+                    self._journal.flush()
+                    os.fsync(self._journal.fileno())
+            except Exception as e:
+                self.log.error("Failed to write password journal %s: %s", self.path, e)
+                with self._lock:
+                    # forget writes that aren't durable
+                    for username, hashed in records:
+                        if self._tail.get(username, ...) is hashed:
+                            self._tail.pop(username)
+                future.set_exception(e)
+                return
+            with self._lock:
+                self._committed.update(records)
+        JOURNAL_COMMIT_SIZE.observe(len(records))
+        future.set_result(None)
+
+    def _compact_journal(self):
+        """Apply committed writes to the backing store and empty the journal
+
+        If that fails, the writes stay in the journal, to be applied next time.
+        """
+        with self._journal_lock:
+            with self._lock:
+                committed, self._committed = self._committed, {}
+            try:
+                with self._observe("compact"):
+                    self.store.set_many(
+                        (username, hashed)
+                        for username, hashed in committed.items()
+                        if hashed is not None
+                    )
+                    self.store.delete_many(
+                        username
+                        for username, hashed in committed.items()
+                        if hashed is None
+                    )
+                    # everything in the journal is in the store now
+                    self._journal.truncate(0)
+                    os.fsync(self._journal.fileno())
+            except BaseException:
+                with self._lock:
+                    # keep the writes for the next compaction,
+                    # behind any committed since
+                    committed.update(self._committed)
+                    self._committed = committed
+                raise
+        with self._lock:
+            for username, hashed in committed.items():
+                # unless it has been written again since
+                if self._tail.get(username, ...) is hashed:
+                    self._tail.pop(username)
+            self._generation += 1
+        self.log.debug("Applied %i journaled password writes", len(committed))
+
+    def _tail_get(self, username):
+        """Return (found, hash) from the tail"""
+        with self._lock:
+            if username in self._tail:
+                return True, self._tail[username]
+            return False, None
+
+    def get(self, username):
+        self._open()
+        found, hashed = self._tail_get(username)
+        if found:
+            return hashed
+        return self.store.get(username)
+
+    async def aget(self, username):
+        await self._aopen()
+        found, hashed = self._tail_get(username)
+        if found:
+            return hashed
+        return await self.store.aget(username)
+
+    def set(self, username, hashed):
+        self.set_many([(username, hashed)])
+
+    def set_many(self, items):
+        self._open()
+        self._append(list(items)).result()
+
+    async def aset(self, username, hashed):
+        await self.aset_many([(username, hashed)])
+
+    async def aset_many(self, items):
+        await self._aopen()
+        await asyncio.wrap_future(self._append(list(items)))
+
+    def delete(self, username):
+        self.delete_many([username])
+
+    def delete_many(self, usernames):
+        self._open()
+        self._append([(username, None) for username in usernames]).result()
+
+    async def adelete(self, username):
+        await self.adelete_many([username])
+
+    async def adelete_many(self, usernames):
+        await self._aopen()
+        await asyncio.wrap_future(
+            self._append([(username, None) for username in usernames])
+        )
+
+    def _try_setdefault(self, username, hashed, stored, generation):
+        """Store hashed unless a hash is stored, given the hash read for username
+
+        Returns (stored hash, Future or None),
+        or None if a compaction happened since stored was read, and it should be read again.
+        """
+        with self._lock:
+            if self._closing:
+                raise RuntimeError("Password journal is closed")
+            if username in self._tail:
+                stored = self._tail[username]
+            elif generation != self._generation:
+                return None
+            if stored is not None:
+                return stored, None
+            return hashed, self._append_locked([(username, hashed)])
+
+    def setdefault(self, username, hashed):
+        self._open()
+        result = None
+        while result is None:
+            generation = self._generation
+            result = self._try_setdefault(
+                username, hashed, self.get(username), generation
+            )
+        stored, future = result
+        if future is not None:
+            future.result()
+        return stored
+
+    async def asetdefault(self, username, hashed):
+        await self._aopen()
+        result = None
+        while result is None:
+            generation = self._generation
+            result = self._try_setdefault(
+                username, hashed, await self.aget(username), generation
+            )
+        stored, future = result
+        if future is not None:
+            await asyncio.wrap_future(future)
+        return stored
+
+    def keys(self):
+        self._open()
+        with self._lock:
+            tail = dict(self._tail)
+        for username in self.store.keys():
+            if username not in tail:
+                yield username
+        for username, hashed in tail.items():
+            if hashed is not None:
+                yield username
+
+    @property
+    def normalized_index_built(self):
+        return self.store.normalized_index_built
+
+    def unnormalized_index(self):
+        # the backing store's index, once it has every journaled write
+        self.flush()
+        return self.store.unnormalized_index()
+
+    def files(self):
+        return [self.path] + self.store.files()
+
+    def flush(self):
+        self._open()
+        self._compact_journal()
+
+    def compact(self):
+        self.flush()
+        self.store.compact()
+
+    def close(self):
+        with self._lock:
+            if not self._opened:
+                self.store.close()
+                return
+            self._closing = True
+            self._wakeup.notify()
+        # the committer commits pending writes and applies the journal before exiting
+        self._committer.join()
+        self._journal.close()
+        self.store.close()
+        with self._lock:
+            self._tail = {}
+            self._opened = False
+            self._closing = False
+
+
+class _Snapshot:
+    """An immutable table of username: hash, sorted by username, in a memory-mapped file
+
+    The file is a header (magic, number of entries),
+    a table of fixed-size (offset, key length, value length) entries sorted by key,
+    and the keys and values they point to.
+    Lookups are a binary search over the mapped table,
+    without reading the file into memory or any locking.
+    """
+
+    magic = b"FUSNAP1\n"
+    header = struct.Struct("<8sQ")
+    entry = struct.Struct("<QII")
+
+    @classmethod
+    def write(cls, path, items):
+        """Atomically write a snapshot of sorted (key, value) bytes pairs to path"""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(cls.header.pack(cls.magic, len(items)))
+            offset = cls.header.size + cls.entry.size * len(items)
+            for key, value in items:
+                f.write(cls.entry.pack(offset, len(key), len(value)))
+                offset += len(key) + len(value)
+            for key, value in items:
+                f.write(key)
+                f.write(value)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count = self.header.unpack_from(self._mmap)
+        if magic != self.magic:
+            raise ValueError(f"{path} is not a password snapshot")
+
+    def get(self, key):
+        """Return the value for key (bytes), or None"""
+        mm = self._mmap
+        entry = self.entry
+        table = self.header.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, key_size, value_size = entry.unpack_from(mm, table + mid * entry.size)
+            found = mm[offset : offset + key_size]
+            if found < key:
+                lo = mid + 1
+            elif found > key:
+                hi = mid
+            else:
+                start = offset + key_size
+                return mm[start : start + value_size]
+        return None
+
+
+class SnapshotPasswordStore(PasswordStore):
+    """Serve password lookups from a read-only snapshot of another store
+
+    For deployments where almost all logins are for existing users.
+    Lookups use a sorted, memory-mapped snapshot of all password hashes,
+    with no file opened, lock taken, or executor used per login.
+    Writes (first logins, password resets, deletions) go to the writable store
+    (`store_class`), and the usernames they touch are read from it
+    until the snapshot is next rebuilt.
+
+    The snapshot is built in a background thread when the store is first used,
+    and rebuilt every `rebuild_interval` seconds if anything was written,
+    then atomically swapped in.
+    Until the first snapshot is ready, lookups go to the writable store.
+    """
+
+    store_class = Type(
+        DBMPasswordStore,
+        klass=PasswordStore,
+        config=True,
+        help="""
+        The writable password store that snapshots are made from.
+        """,
+    )
+
+    store = Instance(PasswordStore)
+
+    @default("store")
+    def _store_default(self):
+        return self.store_class(parent=self.parent, log=self.log)
+
+    path = Unicode(
+        config=True,
+        help="""
+        Path to the snapshot file.
+
+        Defaults to the writable store's path (or FirstUseAuthenticator.dbm_path)
+        with a .snapshot extension.
+        """,
+    )
+
+    @default("path")
+    def _path_default(self):
+        path = getattr(self.store, "path", None) or getattr(
+            self.parent, "dbm_path", "passwords.dbm"
+        )
+        return path + ".snapshot"
+
+    rebuild_interval = Float(
+        60,
+        config=True,
+        help="""
+        Seconds between snapshot rebuilds, if any passwords have changed.
+        """,
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._snapshot = None
+        # usernames written since the current snapshot was started,
+        # and those written while the next one is being built
+        self._dirty = set()
+        self._building = set()
+        self._closed = threading.Event()
+        self._rebuilder = None
+
+    def _start(self):
+        if self._rebuilder is not None:
+            return
+        with self._lock:
+            if self._rebuilder is not None:
+                return
+            self._closed.clear()
+            self._rebuilder = threading.Thread(
+                target=self._rebuild_loop, name="firstuse-snapshot", daemon=True
+            )
+            self._rebuilder.start()
+
+    def _rebuild_loop(self):
+        try:
+            self.rebuild()
+        except Exception:
+            self.log.exception("Failed to build password snapshot %s", self.path)
+        while not self._closed.wait(self.rebuild_interval):
+            if not self._dirty:
+                continue
+            try:
+                self.rebuild()
+            except Exception:
+                self.log.exception("Failed to rebuild password snapshot %s", self.path)
+
+    def rebuild(self):
+        """Build a new snapshot from the writable store and swap it in"""
+        with self._lock:
+            self._building, self._dirty = self._dirty, set()
+        with self._observe("snapshot"):
+            items = []
+            for username in self.store.keys():
+                hashed = self.store.get(username)
+                if hashed is not None:
+                    items.append((username.encode("utf8"), hashed))
+            items.sort()
+            path = os.path.abspath(self.path)
+            _Snapshot.write(path, items)
+            snapshot = _Snapshot(path)
+        # the old snapshot is unmapped when the last lookup using it is done
+        self._snapshot = snapshot
+        self._building = set()
+        self.log.debug("Built password snapshot of %i users", len(items))
+
+    def _snapshot_get(self, username):
+        """Return (found, hash) from the snapshot
+
+        found is False if the writable store must be asked.
+        """
+        # check for writes first, then use whichever snapshot is current:
+        # a snapshot is swapped in before the usernames written during its build are forgotten
+        if username in self._dirty or username in self._building:
+            return False, None
+        snapshot = self._snapshot
+        if snapshot is None:
+            return False, None
+        hashed = snapshot.get(username.encode("utf8"))
+        # users not in the snapshot may have been created since
+        return hashed is not None, hashed
+
+    @contextmanager
+    def _writing(self, usernames):
+        """Mark usernames as changed around a write to the writable store"""
+        usernames = list(usernames)
+        with self._lock:
+            self._dirty.update(usernames)
+        yield usernames
+        # again, in case a rebuild started during the write,
+        # and may not have seen it
+        with self._lock:
+            self._dirty.update(usernames)
+
+    def get(self, username):
+        self._start()
+        found, hashed = self._snapshot_get(username)
+        if found:
+            return hashed
+        return self.store.get(username)
+
+    async def aget(self, username):
+        self._start()
+        found, hashed = self._snapshot_get(username)
+        if found:
+            return hashed
+        return await self.store.aget(username)
+
+    def set(self, username, hashed):
+        self.set_many([(username, hashed)])
+
+    def set_many(self, items):
+        items = list(items)
+        with self._writing(username for username, hashed in items):
+            self.store.set_many(items)
+
+    def setdefault(self, username, hashed):
+        with self._writing([username]):
+            return self.store.setdefault(username, hashed)
+
+    def delete(self, username):
+        self.delete_many([username])
+
+    def delete_many(self, usernames):
+        with self._writing(usernames) as usernames:
+            self.store.delete_many(usernames)
+
+    def keys(self):
+        return self.store.keys()
+
+    @property
+    def normalized_index_built(self):
+        return self.store.normalized_index_built
+
+    def unnormalized_index(self):
+        return self.store.unnormalized_index()
+
+    def files(self):
+        return [path for path in [self.path] if os.path.exists(path)] + self.store.files()
+
+    def compact(self):
+        self.store.compact()
+
+    def close(self):
+        self._closed.set()
+        if self._rebuilder is not None:
+            self._rebuilder.join()
+            self._rebuilder = None
+        self._snapshot = None
+        self.store.close()
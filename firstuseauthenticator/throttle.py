@@ -0,0 +1,120 @@
+"""
+Throttling of failed login attempts.
+
+Failed logins are tracked per username and per IP address with a token bucket:
+each key can fail `burst` times, and one failure is forgiven every `refill_seconds`.
+When the bucket is empty, the key is locked out, for twice as long each time.
+Locked-out logins are rejected before any password hashing happens.
+"""
+import time
+from collections import OrderedDict
+
+
+class ThrottleStore:
+    """Base class for storing throttle state
+
+    State is a small JSON-serializable dict per key,
+    so stores shared between Hub replicas (e.g. in a database or cache server)
+    can be implemented by subclassing this and setting
+    FirstUseAuthenticator.login_throttle_store_class.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+
+    def get(self, key):
+        """Return the state for key, or None"""
+        raise NotImplementedError()
+
+    def set(self, key, state):
+        """Store the state for key"""
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """Forget the state for key"""
+        raise NotImplementedError()
+
+
+class MemoryThrottleStore(ThrottleStore):
+    """Keep throttle state in memory, evicting least recently used keys
+
+    O(1) per operation, and bounded by max_entries.
+    """
+
+    def __init__(self, max_entries=100000):
+        super().__init__(max_entries)
+        self._states = OrderedDict()
+
+    def __len__(self):
+        return len(self._states)
+
+    def get(self, key):
+        return self._states.get(key)
+
+    def set(self, key, state):
+        self._states[key] = state
+        self._states.move_to_end(key)
+        while len(self._states) > self.max_entries:
+            self._states.popitem(last=False)
+
+    def delete(self, key):
+        self._states.pop(key, None)
+
+
+class LoginThrottle:
+    """Token bucket with exponential lockout, per key"""
+
+    def __init__(self, store, burst, refill_seconds, lockout, max_lockout):
+        self.store = store
+        self.burst = burst
+        self.refill_seconds = refill_seconds
+        self.lockout = lockout
+        self.max_lockout = max_lockout
+
+    def locked_for(self, key, now=None):
+        """Return the number of seconds key is locked out for (0 if not locked out)"""
+        state = self.store.get(key)
+        if state is None:
+            return 0
+        if now is None:
+            now = time.time()
+        return max(0, state["locked_until"] - now)
+
+    def failure(self, key, now=None):
+        """Record a failed attempt for key
+
+        Returns the number of seconds key is now locked out for.
+        """
+        if now is None:
+            now = time.time()
+        state = self.store.get(key)
+        if state is None:
+            state = {"tokens": self.burst, "updated": now, "lockouts": 0, "locked_until": 0}
+        tokens = state["tokens"]
+        if self.refill_seconds > 0:
+            tokens += (now - state["updated"]) / self.refill_seconds
+        tokens = min(self.burst, tokens) - 1
+        lockouts = state["lockouts"]
+        locked_until = state["locked_until"]
+        if tokens < 1:
+            lockouts += 1
+            locked_until = now + min(self.max_lockout, self.lockout * 2 ** (lockouts - 1))
+            # one more failure after the lockout locks out again, for longer
+            tokens = 1
+        elif tokens >= self.burst - 1 and now > locked_until:
+            # the bucket has refilled, forget past lockouts
+            lockouts = 0
+        self.store.set(
+            key,
+            {
+                "tokens": tokens,
+                "updated": now,
+                "lockouts": lockouts,
+                "locked_until": locked_until,
+            },
+        )
+        return max(0, locked_until - now)
+
+    def success(self, key):
+        """Record a successful attempt for key, resetting its state"""
+        self.store.delete(key)
@@ -0,0 +1,32 @@
+"""
+Span hooks for tracing the login path.
+
+FirstUseAuthenticator.span_hook is called with a span name and a dict of attributes
+around each phase of a login (store access, hashing, Hub db lookups),
+and must return a context manager.
+By default, spans are recorded with OpenTelemetry if it is installed,
+and are no-ops otherwise.
+"""
+from contextlib import nullcontext
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+
+def null_span(name, attributes):
+    """A span hook that does nothing"""
+    return nullcontext()
+
+
+def opentelemetry_span(name, attributes):
+    """A span hook that records OpenTelemetry spans"""
+    tracer = trace.get_tracer("firstuseauthenticator")
+    return tracer.start_as_current_span(name, attributes=attributes)
+
+
+def default_span_hook():
+    if trace is None:
+        return null_span
+    return opentelemetry_span
@@ -0,0 +1,240 @@
+"""
+Pre-forked worker processes for password hashing.
+
+Hashing and verifying passwords is CPU-heavy, and memory-hard algorithms
+(argon2id, scrypt) need a lot of memory per call.
+Running them in separate processes keeps both off the Hub's process:
+its event loop never competes with hashing for the GIL,
+and memory used by hashing is returned when a worker is recycled.
+
+Each worker is a long-lived process with a pipe to the Hub,
+over which jobs are sent as small pickled (function, args) tuples
+and results come back as (ok, value) tuples.
+A thread in the Hub feeds each worker from a shared job queue.
+Workers are restarted after a number of jobs, and when they crash.
+"""
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import Executor, Future
+
+from .metrics import HASH_WORKER_RESTARTS
+
+
+class WorkerCrashed(Exception):
+    """Raised for a job whose worker process died while running it"""
+
+
+def _worker_main(conn):
+    """Run jobs received on conn until told to stop"""
+    # the Hub handles shutdown, and stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        fn, args, kwargs = job
+        try:
+            result = (True, fn(*args, **kwargs))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception as e:
+            # result or exception could not be pickled
+            conn.send((False, RuntimeError(f"Could not send result: {e!r}")))
+
+
+class _Worker:
+    """A worker process, and the Hub's end of its pipe"""
+
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn,),
+            name="firstuse-hash-worker",
+            daemon=True,
+        )
+        self.process.start()
+        # so that recv fails with EOFError if the worker dies
+        child_conn.close()
+        self.jobs = 0
+
+    def run(self, fn, args, kwargs):
+        """Run a job in the worker
+
+        Raises EOFError or OSError if the worker dies.
+        """
+        self.conn.send((fn, args, kwargs))
+        self.jobs += 1
+        return self.conn.recv()
+
+    def stop(self, timeout=5):
+        try:
+            self.conn.send(None)
+        except OSError:
+            # already gone
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool(Executor):
+    """concurrent.futures.Executor running jobs in pre-forked worker processes
+
+    All workers are started when the pool is created.
+    Each worker is replaced after max_jobs jobs (0 for never),
+    or when it crashes, in which case the job it was running
+    fails with WorkerCrashed.
+    """
+
+    def __init__(self, max_workers, max_jobs=1000, context="spawn", log=None):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        self.log = log or logging.getLogger(__name__)
+        # spawn, rather than fork, because the Hub is multi-threaded
+        self._context = multiprocessing.get_context(context)
+        self._jobs = queue.SimpleQueue()
+        self._shutdown = False
+        self._shutdown_lock = threading.Lock()
+        self._threads = []
+        self.pids = set()
+        for i in range(max_workers):
+            worker = self._start_worker()
+            thread = threading.Thread(
+                target=self._feed_worker,
+                args=(worker,),
+                name=f"firstuse-hash-worker-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _start_worker(self):
+        worker = _Worker(self._context)
+        self.pids.add(worker.process.pid)
+        return worker
+
+    def _replace_worker(self, worker, reason):
+        """Replace a worker with a new one
+
+        Retries until a worker starts, or the pool is shut down (returns None).
+        Queued jobs fail while workers can't be started.
+        """
+        HASH_WORKER_RESTARTS.labels(reason=reason).inc()
+        worker.stop()
+        self.pids.discard(worker.process.pid)
+        delay = 0.1
+        while not self._shutdown:
+            try:
+                return self._start_worker()
+            except Exception as e:
+                self.log.error(
+                    "Failed to start password hash worker, retrying in %.1fs: %s",
+                    delay,
+                    e,
+                )
+                self._fail_queued(WorkerCrashed(f"Could not start hash worker: {e}"))
+                time.sleep(delay)
+                delay = min(2 * delay, 10)
+        return None
+
+    def _fail_queued(self, exc):
+        """Fail all queued jobs with exc"""
+        stops = 0
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                stops += 1
+            elif job[0].set_running_or_notify_cancel():
+                job[0].set_exception(exc)
+        # keep the stop signals for the other workers
+        for i in range(stops):
+            self._jobs.put(None)
+
+    def _feed_worker(self, worker):
+        """Run jobs from the queue in one worker, until shutdown"""
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                ok, value = worker.run(fn, args, kwargs)
+            except (EOFError, OSError):
+                worker.process.join()
+                self.log.error(
+                    "Password hash worker %i died with exit code %s, restarting",
+                    worker.process.pid,
+                    worker.process.exitcode,
+                )
+                future.set_exception(
+                    WorkerCrashed(
+                        f"Hash worker exited with code {worker.process.exitcode}"
+                    )
+                )
+                worker = self._replace_worker(worker, "crash")
+                if worker is None:
+                    return
+                continue
+            except Exception as e:
+                # the job could not be sent, e.g. not picklable
+                future.set_exception(e)
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+            if self.max_jobs and worker.jobs >= self.max_jobs:
+                self.log.debug(
+                    "Recycling password hash worker %i after %i jobs",
+                    worker.process.pid,
+                    worker.jobs,
+                )
+                worker = self._replace_worker(worker, "max_jobs")
+                if worker is None:
+                    return
+        worker.stop()
+        self.pids.discard(worker.process.pid)
+
+    def submit(self, fn, *args, **kwargs):
+        with self._shutdown_lock:
+            if self._shutdown:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            future = Future()
+            self._jobs.put((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._shutdown_lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if cancel_futures:
+                while True:
+                    try:
+                        job = self._jobs.get_nowait()
+                    except queue.Empty:
+                        break
+                    job[0].cancel()
+            # one stop signal per worker, after any queued jobs
+            for thread in self._threads:
+                self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -18,15 +18,23 @@ setup(
     author="Yuvi Panda, Project Jupyter Contributors",
     author_email="yuvipanda@gmail.com",
     license="BSD-3-Clause",
-    python_requires=">=3.6",
+    python_requires=">=3.7",
     packages=find_packages(),
     entry_points={
+        "console_scripts": [
+            "firstuseauthenticator = firstuseauthenticator.cli:main",
+        ],
         "jupyterhub.authenticators": [
             "firstuse = firstuseauthenticator:FirstUseAuthenticator",
             "firstuseauthenticator = firstuseauthenticator:FirstUseAuthenticator",
         ],
     },
-    install_requires=['bcrypt', 'jupyterhub>=1.3'],
+    install_requires=['bcrypt', 'jupyterhub>=2'],
+    extras_require={
+        'argon2': ['argon2-cffi'],
+        'redis': ['redis>=5'],
+        'tracing': ['opentelemetry-api'],
+    },
     package_data={
         '': ['*.html'],
     },
@@ -0,0 +1,6 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def tmpcwd(tmpdir):
+    tmpdir.chdir()
@@ -0,0 +1,171 @@
+"""tests for the password batch API, through a real Hub"""
+
+import json
+import os
+import re
+import secrets
+import socket
+import subprocess
+import sys
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+
+import pytest
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+HUB_CONFIG = """
+from jupyterhub.proxy import Proxy
+
+
+class NoProxy(Proxy):
+    should_start = False
+
+    async def add_route(self, routespec, target, data):
+        pass
+
+    async def delete_route(self, routespec):
+        pass
+
+    async def get_all_routes(self):
+        return {{}}
+
+
+c.JupyterHub.proxy_class = NoProxy
+c.JupyterHub.hub_ip = "127.0.0.1"
+c.JupyterHub.hub_port = {port}
+c.JupyterHub.authenticator_class = "firstuseauthenticator.FirstUseAuthenticator"
+c.Authenticator.allow_all = True
+c.FirstUseAuthenticator.bcrypt_rounds = 4
+c.FirstUseAuthenticator.min_password_length = 20
+c.JupyterHub.services = [
+    {{"name": "admin-service", "api_token": {admin_token!r}}},
+    {{"name": "other-service", "api_token": {other_token!r}}},
+]
+c.JupyterHub.load_roles = [
+    {{"name": "passwords", "scopes": ["admin:users"], "services": ["admin-service"]}},
+]
+"""
+
+
+@pytest.fixture
+def hub():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    hub = {
+        "url": f"http://127.0.0.1:{port}/hub",
+        "admin_token": secrets.token_hex(16),
+        "other_token": secrets.token_hex(16),
+    }
+    with open("jupyterhub_config.py", "w") as f:
+        f.write(HUB_CONFIG.format(port=port, **hub))
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [os.path.join(here, os.pardir), env.get("PYTHONPATH")])
+    )
+    with open("jupyterhub.log", "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, "-m", "jupyterhub", "-f", "jupyterhub_config.py"],
+            env=env,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+        )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            assert process.poll() is None, open("jupyterhub.log").read()
+            assert time.monotonic() < deadline, "Hub did not start"
+            try:
+                with socket.create_connection(("127.0.0.1", port)):
+                    break
+            except OSError:
+                time.sleep(0.1)
+        yield hub
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def api_request(hub, method, token, body=None, content_type="application/json"):
+    chunks = []
+    request = HTTPRequest(
+        hub["url"] + "/api/firstuse/passwords",
+        method=method,
+        headers={"Authorization": f"token {token}", "Content-Type": content_type},
+        body=body,
+        allow_nonstandard_methods=True,
+        streaming_callback=chunks.append,
+    )
+    response = await AsyncHTTPClient().fetch(request, raise_error=False)
+    lines = b"".join(chunks).decode("utf8").splitlines()
+    return response, [json.loads(line) for line in lines if response.code == 200]
+
+
+async def login(hub, username, password):
+    """Log in through the login form, return True on success"""
+    client = AsyncHTTPClient()
+    page = await client.fetch(hub["url"] + "/login")
+    xsrf = re.search(rb'name="_xsrf" value="([^"]+)"', page.body).group(1).decode()
+    cookies = "; ".join(
+        f"{name}={morsel.value}"
+        for header in page.headers.get_list("Set-Cookie")
+        for name, morsel in SimpleCookie(header).items()
+    )
+    response = await client.fetch(
+        hub["url"] + "/login",
+        method="POST",
+        headers={"Cookie": cookies},
+        body=urlencode({"username": username, "password": password, "_xsrf": xsrf}),
+        follow_redirects=False,
+        raise_error=False,
+    )
+    return response.code == 302
+
+
+async def test_password_batch_api(hub):
+    body = json.dumps(
+        {"users": ["Alice", {"name": "bob", "password": "bob-password-long-enough"}]}
+    )
+    # requires the admin:users scope
+    response, _ = await api_request(hub, "POST", hub["other_token"], body)
+    assert response.code == 403
+
+    response, results = await api_request(hub, "POST", hub["admin_token"], body)
+    assert response.code == 200
+    assert response.headers["Content-Type"] == "application/x-ndjson"
+    # streamed as results come in
+    assert response.headers["Transfer-Encoding"] == "chunked"
+    assert [(r["name"], r["status"]) for r in results] == [("alice", "ok"), ("bob", "ok")]
+    # the generated password is returned for the normalized username
+    password = results[0]["password"]
+    assert len(password) >= 20
+    assert await login(hub, "alice", password)
+    assert await login(hub, "bob", "bob-password-long-enough")
+
+    # invalid batches are rejected
+    bad = json.dumps({"users": [{"name": "carol", "password": 12345678}]})
+    response, _ = await api_request(hub, "POST", hub["admin_token"], bad)
+    assert response.code == 400
+
+    csv_body = "carol,carol-password-long-enough\ndave,short\n"
+    response, results = await api_request(
+        hub, "POST", hub["admin_token"], csv_body, content_type="text/csv"
+    )
+    assert [(r["name"], r["status"]) for r in results] == [
+        ("dave", "error"),
+        ("carol", "ok"),
+    ]
+
+    response, results = await api_request(
+        hub, "DELETE", hub["admin_token"], json.dumps({"users": ["Alice", "carol"]})
+    )
+    assert response.code == 200
+    assert results == [
+        {"name": "alice", "status": "deleted"},
+        {"name": "carol", "status": "deleted"},
+    ]
+    # a deleted user is a new user again
+    assert await login(hub, "alice", "a-new-password-long-enough")
@@ -1,16 +1,29 @@
 """tests for first-use authenticator"""
 
+import asyncio
+import json
+import os
+import pstats
+import time
 from unittest import mock
 
 import dbm
 import pytest
+from contextlib import contextmanager
+from jinja2 import ChoiceLoader, Environment, FileSystemLoader
+from prometheus_client import REGISTRY
+from jupyterhub import orm
+from jupyterhub.app import JupyterHub
+from tornado import web
+from tornado.httputil import HTTPServerRequest
 
 from firstuseauthenticator import FirstUseAuthenticator
-
-
-@pytest.fixture(autouse=True)
-def tmpcwd(tmpdir):
-    tmpdir.chdir()
+from firstuseauthenticator.firstuseauthenticator import (
+    ResetPasswordHandler,
+    _generate_password,
+    _parse_password_batch,
+)
+from firstuseauthenticator.stores import DBMPasswordStore, SQLitePasswordStore
 
 
 async def test_basic(tmpcwd):
@@ -28,6 +41,219 @@ async def test_basic(tmpcwd):
         mock.Mock(), {"username": name, "password": "differentpassword"}
     )
     assert username is None
+    auth.close()
+
+async def test_process_executor(tmpcwd):
+    auth = FirstUseAuthenticator(
+        hash_executor_type="process", hash_executor_workers=1, bcrypt_rounds=4
+    )
+    # not forked from the multi-threaded Hub
+    assert auth.hash_executor._mp_context.get_start_method() == "spawn"
+    data = {"username": "name", "password": "password"}
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    auth.close()
+
+
+async def test_concurrent_logins_overlap(tmpcwd):
+    auth = FirstUseAuthenticator(hash_executor_workers=4)
+
+    def slow_hashpw(password, salt):
+        time.sleep(0.5)
+        return b"hashed:" + password
+
+    with mock.patch("bcrypt.hashpw", slow_hashpw):
+        tic = time.perf_counter()
+        usernames = await asyncio.gather(
+            *(
+                auth.authenticate(
+                    mock.Mock(), {"username": f"user{i}", "password": "password"}
+                )
+                for i in range(4)
+            )
+        )
+        toc = time.perf_counter()
+    assert usernames == [f"user{i}" for i in range(4)]
+    # run one after another, this would take at least 2 seconds
+    assert toc - tic < 1.5
+    auth.close()
+
+
+async def test_hash_queue_full(tmpcwd):
+    auth = FirstUseAuthenticator(max_concurrent_hashes=1, hash_queue_size=1)
+
+    def slow_hashpw(password, salt):
+        time.sleep(0.2)
+        return b"hashed:" + password
+
+    handlers = [mock.Mock(custom_login_error="") for i in range(3)]
+    with mock.patch("bcrypt.hashpw", slow_hashpw):
+        usernames = await asyncio.gather(
+            *(
+                auth.authenticate(
+                    handler, {"username": f"user{i}", "password": "password"}
+                )
+                for i, handler in enumerate(handlers)
+            )
+        )
+    # one running, one waiting, one rejected
+    assert usernames == ["user0", "user1", None]
+    assert "too many logins" in handlers[2].custom_login_error
+    assert auth.hash_limiter.in_flight == 0
+    assert auth.hash_limiter.queued == 0
+    auth.close()
+
+
+async def test_hash_queue_batch(tmpcwd):
+    auth = FirstUseAuthenticator(max_concurrent_hashes=2, hash_queue_size=10)
+
+    def slow_hashpw(password, salt):
+        time.sleep(0.01)
+        return b"hashed:" + password
+
+    handlers = [mock.Mock(custom_login_error="") for i in range(5)]
+    with mock.patch("bcrypt.hashpw", slow_hashpw):
+        batch = asyncio.ensure_future(
+            auth.set_passwords({f"batch{i}": "password" for i in range(50)})
+        )
+        await asyncio.sleep(0)
+        usernames = await asyncio.gather(
+            *(
+                auth.authenticate(
+                    handler, {"username": f"user{i}", "password": "password"}
+                )
+                for i, handler in enumerate(handlers)
+            )
+        )
+        results = await batch
+    # the batch waits for its turn without filling the queue for logins
+    assert usernames == [f"user{i}" for i in range(5)]
+    assert set(results.values()) == {None}
+    assert auth.hash_limiter.queued == auth.hash_limiter.queued_bounded == 0
+    auth.close()
+
+
+async def test_reset_password(tmpcwd):
+    auth = FirstUseAuthenticator()
+    name = "name"
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": "firstpassword"})
+    msg = await auth.reset_password(name, "short")
+    assert "too short" in msg
+    msg = await auth.reset_password(name, "secondpassword")
+    assert "success" in msg
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": "firstpassword"}) is None
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": "secondpassword"}) == name
+    auth.close()
+
+
+async def test_password_store_kept_open(tmpcwd):
+    auth = FirstUseAuthenticator()
+    with mock.patch("dbm.open", wraps=dbm.open) as dbm_open:
+        for i in range(3):
+            assert await auth.authenticate(
+                mock.Mock(), {"username": f"user{i}", "password": "password"}
+            )
+        user = mock.Mock()
+        user.name = "user0"
+        await auth.delete_user(user)
+    assert dbm_open.call_count == 1
+    assert sorted(auth.password_store.keys()) == ["user1", "user2"]
+    auth.password_store.close()
+    assert auth.password_store.get("user1")
+
+
+class SlowStore(DBMPasswordStore):
+    """A store on slow storage"""
+
+    def get(self, username):
+        time.sleep(0.2)
+        return super().get(username)
+
+
+async def test_store_io_off_event_loop(tmpcwd):
+    auth = FirstUseAuthenticator(password_store_class=SlowStore, bcrypt_rounds=4)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    assert await auth.authenticate(mock.Mock(), {"username": "name", "password": "password"})
+    user = mock.Mock()
+    user.name = "name"
+    await auth.delete_user(user)
+    ticker.cancel()
+    # the event loop kept running while the store was reading
+    assert ticks >= 10
+    assert auth.password_store.get("name") is None
+    auth.password_store.close()
+
+
+async def test_credential_cache(tmpcwd):
+    auth = FirstUseAuthenticator(credential_cache_size=1)
+    name = "name"
+    password = "firstpassword"
+    data = {"username": name, "password": password}
+    assert await auth.authenticate(mock.Mock(), data) == name
+    # first verification is a miss
+    assert await auth.authenticate(mock.Mock(), data) == name
+    cache = auth.credential_cache
+    assert (cache.hits, cache.misses) == (0, 1)
+    with mock.patch("bcrypt.hashpw") as hashpw:
+        assert await auth.authenticate(mock.Mock(), data) == name
+        assert (
+            await auth.authenticate(mock.Mock(), {"username": name, "password": "wrong"})
+            is None
+        )
+    # only the wrong password needed bcrypt
+    assert hashpw.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # LRU eviction
+    assert await auth.authenticate(mock.Mock(), {"username": "other", "password": password})
+    assert await auth.authenticate(mock.Mock(), {"username": "other", "password": password})
+    assert len(cache) == 1
+    assert name not in cache._entries
+
+    # reset invalidates
+    assert "success" in await auth.reset_password("other", "secondpassword")
+    assert len(cache) == 0
+    assert await auth.authenticate(mock.Mock(), {"username": "other", "password": password}) is None
+    auth.close()
+
+
+async def test_rehash_on_login(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=5)
+    data = {"username": "name", "password": "firstpassword"}
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert auth.password_store.get("name").startswith(b"$2b$05$")
+
+    auth.bcrypt_rounds = 4
+    assert await auth.authenticate(mock.Mock(), {"username": "name", "password": "wrong"}) is None
+    # not rehashed on failed login
+    assert auth.password_store.get("name").startswith(b"$2b$05$")
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert auth.password_store.get("name").startswith(b"$2b$04$")
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+
+    auth.rehash_on_login = False
+    auth.bcrypt_rounds = 5
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert auth.password_store.get("name").startswith(b"$2b$04$")
+    auth.close()
+
+
+def test_calibrate_bcrypt_rounds(tmpcwd):
+    fast = FirstUseAuthenticator(bcrypt_target_verify_time=1e-6)
+    assert fast.bcrypt_rounds == 4
+    slow = FirstUseAuthenticator(bcrypt_target_verify_time=1e6)
+    assert slow.bcrypt_rounds == 31
+    fast.close()
+    slow.close()
+
 
 async def test_min_pass_length(caplog, tmpcwd):
     users = []
@@ -70,6 +296,7 @@ async def test_min_pass_length(caplog, tmpcwd):
                     'Password too short! Please choose a password at least %d characters long.'
                     % auth.min_password_length
                 )
+    auth.close()
 
 
 async def test_normalized_check(caplog, tmpcwd):
@@ -100,6 +327,8 @@ async def test_normalized_check(caplog, tmpcwd):
                 },
             )
 
+    auth1.password_store.close()
+
     # first make sure normalization was skipped
     with dbm.open(auth1.dbm_path) as db:
         for username in to_load:
@@ -185,5 +414,369 @@ async def test_normalized_check(caplog, tmpcwd):
         assert authenticated
         assert authenticated == auth2.normalize_username(username)
 
+    auth2.close()
+
     # load again, should skip the
     auth3 = FirstUseAuthenticator()
+    auth3.close()
+
+
+async def test_check_passwords_skips_unchanged(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    for name in ("a", "b"):
+        assert await auth.authenticate(mock.Mock(), {"username": name, "password": "password"})
+    auth.password_store.close()
+
+    # first check scans, finds nothing to do, and makes no backup
+    with mock.patch.object(DBMPasswordStore, "backup") as backup:
+        auth = FirstUseAuthenticator()
+    assert backup.call_count == 0
+    assert not auth.password_store.files(auth.dbm_path + "-backup")
+    auth.close()
+
+    # second check skips the scan
+    with mock.patch.object(DBMPasswordStore, "keys") as keys:
+        auth = FirstUseAuthenticator()
+    assert keys.call_count == 0
+
+    # nor after writes through the store, even if it is closed on exit
+    assert await auth.authenticate(mock.Mock(), {"username": "c", "password": "password"})
+    user = mock.Mock()
+    user.name = "b"
+    await auth.delete_user(user)
+    auth.password_store._finalizer()
+    with mock.patch.object(DBMPasswordStore, "keys") as keys:
+        auth = FirstUseAuthenticator()
+    assert keys.call_count == 0
+    assert sorted(auth.password_store.keys()) == ["a", "c"]
+    auth.close()
+
+    # changes made with other tools are scanned
+    with dbm.open(auth.dbm_path, "w") as db:
+        db[b"d"] = db[b"a"]
+    with mock.patch.object(DBMPasswordStore, "keys", return_value=iter([])) as keys:
+        auth = FirstUseAuthenticator()
+    assert keys.call_count == 1
+    auth.close()
+
+    # and when asked for
+    with mock.patch.object(DBMPasswordStore, "keys", return_value=iter([])) as keys:
+        auth._run_check_passwords(full=True)
+    assert keys.call_count == 1
+
+
+async def test_check_passwords_finds_external_writes(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    data = {"username": "stray", "password": "password"}
+    assert await auth.authenticate(mock.Mock(), {"username": "a", "password": "password"})
+    hashed = auth.password_store.get("a")
+    auth.close()
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    # the index has been built
+    assert auth.password_store.normalized_index_built
+    auth.close()
+
+    # written with another tool, not in the index
+    with dbm.open(auth.dbm_path, "w") as db:
+        db[b"Stray"] = hashed
+
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    # normalized at startup, not taken over by the first login
+    assert auth.password_store.get("stray") == hashed
+    assert await auth.authenticate(mock.Mock(), dict(data, password="takeover")) is None
+    assert await auth.authenticate(mock.Mock(), data) == "stray"
+    auth.close()
+
+
+@pytest.mark.parametrize("store_class", [DBMPasswordStore, SQLitePasswordStore])
+async def test_normalized_index(tmpcwd, store_class):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4, password_store_class=store_class)
+    store = auth.password_store
+    data = {"username": "name", "password": "password"}
+    assert await auth.authenticate(mock.Mock(), data)
+    # build the index
+    auth._run_check_passwords()
+    assert store.normalized_index_built
+
+    # non-normalized usernames written through the store are indexed
+    hashed = store.get("name")
+    store.set("Imported", hashed)
+    store.set_many([("OTHER", hashed), ("Other", hashed)])
+    assert store.unnormalized_index() == {
+        "imported": ["Imported"],
+        "other": ["OTHER", "Other"],
+    }
+    store.delete("OTHER")
+    assert store.unnormalized_index() == {"imported": ["Imported"], "other": ["Other"]}
+    assert sorted(store.keys()) == ["Imported", "Other", "name"]
+
+    if store_class is DBMPasswordStore:
+        # and normalized by the next check, without a scan
+        with mock.patch.object(type(store), "keys") as keys:
+            auth._run_check_passwords()
+        assert keys.call_count == 0
+        assert sorted(store.keys()) == ["imported", "name", "other"]
+        assert store.get("imported") == hashed
+    else:
+        store.delete_many(["Imported", "Other"])
+    assert store.unnormalized_index() == {}
+    auth.close()
+
+
+async def test_check_passwords_in_background(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    with mock.patch.object(auth, "normalize_username", lambda x: x):
+        assert await auth.authenticate(
+            mock.Mock(), {"username": "notNormalized", "password": "password"}
+        )
+    auth.password_store.close()
+
+    def slow_check(self):
+        time.sleep(0.5)
+        return check_passwords(self)
+
+    check_passwords = FirstUseAuthenticator._check_passwords
+    with mock.patch.object(FirstUseAuthenticator, "_check_passwords", slow_check):
+        tic = time.perf_counter()
+        auth = FirstUseAuthenticator(check_passwords_in_background=True)
+        assert time.perf_counter() - tic < 0.5
+        assert not auth._check_passwords_future.done()
+        # not treated as a new user while the check is moving the password
+        assert (
+            await auth.authenticate(
+                mock.Mock(), {"username": "notnormalized", "password": "different"}
+            )
+            is None
+        )
+        assert auth._check_passwords_future is None
+    assert await auth.authenticate(
+        mock.Mock(), {"username": "notNormalized", "password": "password"}
+    ) == "notnormalized"
+    assert list(auth.password_store.keys()) == ["notnormalized"]
+    auth.close()
+
+
+def test_parse_password_batch():
+    body = json.dumps(
+        {"users": [{"name": "a", "password": "apassword"}, {"name": "b"}, "c"]}
+    )
+    assert _parse_password_batch(body, "application/json") == [
+        ("a", "apassword"),
+        ("b", None),
+        ("c", None),
+    ]
+    for user in ({"name": "a", "password": 12345678}, {"password": "apassword"}):
+        with pytest.raises(web.HTTPError) as e:
+            _parse_password_batch(json.dumps({"users": [user]}), "application/json")
+        assert e.value.status_code == 400
+    body = "a,apassword\nb\n\nc,\n"
+    assert _parse_password_batch(body, "text/csv; charset=utf-8") == [
+        ("a", "apassword"),
+        ("b", None),
+        ("c", None),
+    ]
+
+
+def test_generate_password():
+    assert len(_generate_password(7)) >= 16
+    assert len(_generate_password(40)) >= 40
+
+
+async def test_set_passwords(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4, credential_cache_size=10)
+    data = {"username": "a", "password": "oldpassword"}
+    assert await auth.authenticate(mock.Mock(), data) == "a"
+    assert await auth.authenticate(mock.Mock(), data) == "a"
+    with mock.patch.object(
+        auth.password_store, "set_many", wraps=auth.password_store.set_many
+    ) as set_many:
+        results = await auth.set_passwords(
+            {"a": "apassword", "B": "bpassword", "c": "short", "d d": "dpassword"}
+        )
+    assert set_many.call_count == 1
+    assert results == {
+        "a": None,
+        "b": None,
+        "c": 'Password too short! Please choose a password at least 7 characters long.',
+        "d d": "Invalid username: 'd d'",
+    }
+    # cache invalidated
+    assert await auth.authenticate(mock.Mock(), data) is None
+    assert await auth.authenticate(mock.Mock(), {"username": "a", "password": "apassword"}) == "a"
+    assert await auth.authenticate(mock.Mock(), {"username": "b", "password": "bpassword"}) == "b"
+    assert sorted(auth.password_store.keys()) == ["a", "b"]
+
+    # stored in batches, results as each batch is stored
+    with mock.patch.object(
+        auth.password_store, "set_many", wraps=auth.password_store.set_many
+    ) as set_many:
+        results = []
+        async for name, error in auth.iter_set_passwords(
+            {name: "password" for name in "cdefg"}, batch_size=2
+        ):
+            results.append(name)
+            assert set_many.call_count == (len(results) + 1) // 2
+    assert results == list("cdefg")
+    await auth.delete_users(list("cdefg"))
+
+    assert await auth.delete_users(["A", "b"]) == ["a", "b"]
+    assert list(auth.password_store.keys()) == []
+    auth.close()
+
+
+async def test_user_exists_cache(tmpcwd):
+    db = orm.new_session_factory("sqlite:///jupyterhub.sqlite")()
+    db.add(orm.User(name="existing"))
+    db.commit()
+    auth = FirstUseAuthenticator(create_users=False, bcrypt_rounds=4, db=db)
+    # loaded with the authenticator, not on the first login
+    assert auth._user_names == {"existing"}
+
+    with mock.patch.object(db, "query", wraps=db.query) as query:
+        assert await auth.authenticate(mock.Mock(), {"username": "existing", "password": "password"})
+        assert await auth.authenticate(mock.Mock(), {"username": "new", "password": "password"}) is None
+
+        # added by the Hub
+        user = orm.User(name="new")
+        db.add(user)
+        db.commit()
+        auth.add_user(user)
+        assert await auth.authenticate(mock.Mock(), {"username": "new", "password": "password"})
+        await auth.delete_user(user)
+        assert await auth.authenticate(mock.Mock(), {"username": "new", "password": "password"}) is None
+
+        # added elsewhere, and reloaded in the background after ttl
+        db.add(orm.User(name="other"))
+        db.commit()
+        auth.user_exists_cache_ttl = 1e-9
+        assert await auth.authenticate(mock.Mock(), {"username": "other", "password": "password"}) is None
+        await auth._user_names_reload
+        auth.user_exists_cache_ttl = 300
+        assert await auth.authenticate(mock.Mock(), {"username": "other", "password": "password"})
+        # not on the event loop, with the Hub's session
+        assert query.call_count == 0
+
+    # users added while reloading are kept
+    auth.user_exists_cache_ttl = 1e-9
+    with mock.patch.object(auth, "_query_user_names", return_value={"existing"}):
+        auth._user_exists("existing")
+        user = orm.User(name="late")
+        auth.add_user(user)
+        await auth._user_names_reload
+    assert auth._user_names == {"existing", "late"}
+    auth.close()
+
+
+async def test_metrics_and_spans(tmpcwd):
+    spans = []
+
+    @contextmanager
+    def span_hook(name, attributes):
+        spans.append(name)
+        yield
+
+    def sample(name, **labels):
+        return REGISTRY.get_sample_value(f"jupyterhub_firstuse_{name}", labels) or 0
+
+    before_created = sample("users_created_total")
+    before_wrong = sample("login_rejected_total", reason="wrong_password")
+    before_short = sample("login_rejected_total", reason="short_password")
+    before_verify = sample(
+        "hash_duration_seconds_count", operation="verify", algorithm="bcrypt"
+    )
+    before_get = sample("store_duration_seconds_count", operation="get")
+    before_auth = sample("authenticate_duration_seconds_count", status="failure")
+
+    auth = FirstUseAuthenticator(bcrypt_rounds=4, span_hook=span_hook)
+    assert await auth.authenticate(mock.Mock(), {"username": "a", "password": "password"})
+    assert await auth.authenticate(mock.Mock(), {"username": "a", "password": "wrong"}) is None
+    assert await auth.authenticate(mock.Mock(), {"username": "b", "password": "short"}) is None
+
+    assert sample("users_created_total") == before_created + 1
+    assert sample("login_rejected_total", reason="wrong_password") == before_wrong + 1
+    assert sample("login_rejected_total", reason="short_password") == before_short + 1
+    assert (
+        sample("hash_duration_seconds_count", operation="verify", algorithm="bcrypt")
+        == before_verify + 1
+    )
+    assert sample("store_duration_seconds_count", operation="get") >= before_get + 3
+    assert sample("authenticate_duration_seconds_count", status="failure") == before_auth + 2
+    assert spans[:5] == [
+        "firstuse.authenticate",
+        "firstuse.store.open",
+        "firstuse.store.get",
+        "firstuse.hash_password",
+        "firstuse.store.get",
+    ]
+    assert "firstuse.verify_password" in spans
+    auth.close()
+
+
+def _loader_depth(loader):
+    depth = 0
+    while isinstance(loader, ChoiceLoader):
+        depth += 1
+        loader = loader.loaders[0]
+    return depth
+
+
+async def test_reset_template_registered_once(tmpcwd):
+    # a jinja environment like JupyterHub's
+    env = Environment(
+        loader=ChoiceLoader([FileSystemLoader([JupyterHub().template_paths[0]])]),
+        autoescape=True,
+        enable_async=True,
+    )
+    app = web.Application(jinja2_env=env, hub=mock.Mock(base_url="/hub/"))
+    auth = FirstUseAuthenticator()
+    auth.get_handlers(mock.Mock(tornado_settings=app.settings))
+    depth = _loader_depth(env.loader)
+    namespace = dict(static_url=lambda *args, **kwargs: "", base_url="/hub/")
+
+    durations = []
+    for i in range(2000):
+        # tornado creates a new handler for every request
+        request = HTTPServerRequest(method="GET", uri="/hub/auth/change-password")
+        request.connection = mock.Mock()
+        handler = ResetPasswordHandler(app, request)
+        tic = time.perf_counter()
+        template = handler.get_template("reset.html")
+        await template.render_async(**namespace)
+        durations.append(time.perf_counter() - tic)
+        assert _loader_depth(env.loader) == depth
+    # rendering doesn't get slower over time
+    assert min(durations[-100:]) < 2 * min(durations[:100]) + 1e-3
+    auth.close()
+
+
+@pytest.mark.parametrize("store_class", [DBMPasswordStore, SQLitePasswordStore])
+def test_startup_probe(tmpcwd, caplog, store_class):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4, password_store_class=store_class)
+    auth.startup_probe_target_logins_per_second = 1e9
+    auth.startup_probe_profile_path = "login.prof"
+    report = auth._run_startup_probe()
+    assert report["hash_algorithm"] == "bcrypt"
+    assert report["verify_seconds"] > 0
+    assert report["store_open_seconds"] > 0
+    assert report["store_get_seconds"] > 0
+    assert report["store_set_seconds"] > 0
+    assert report["max_logins_per_second"] > 0
+    if store_class is DBMPasswordStore:
+        assert report["dbm_flavor"].startswith("dbm.")
+    assert "does not meet the target" in caplog.text
+    assert pstats.Stats("login.prof").total_calls > 0
+    # no probe files left behind
+    assert not [name for name in os.listdir() if "probe" in name]
+    auth.password_store.close()
+
+
+def test_startup_probe_user_exists(tmpcwd):
+    db = orm.new_session_factory("sqlite:///:memory:")()
+    auth = FirstUseAuthenticator(create_users=False, bcrypt_rounds=4, db=db)
+    auth._user_exists("name")
+    with mock.patch.object(db, "query", wraps=db.query) as query:
+        report = auth._run_startup_probe()
+    # the Hub db is queried, not the cached usernames
+    assert query.call_count == 5
+    assert report["user_exists_seconds"] > 0
+    auth.close()
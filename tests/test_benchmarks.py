@@ -0,0 +1,60 @@
+"""smoke test for the benchmark script, so it keeps working"""
+
+import importlib.util
+import json
+import os
+
+import pytest
+
+here = os.path.dirname(os.path.abspath(__file__))
+bench_path = os.path.join(here, os.pardir, "benchmarks", "bench_authenticator.py")
+
+
+@pytest.fixture
+def bench():
+    spec = importlib.util.spec_from_file_location("bench_authenticator", bench_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_benchmark_baseline(bench):
+    args = ["--users", "10", "--calls", "5", "--concurrency", "2"]
+    assert bench.main(args + ["--save-baseline", "baseline.json"]) == 0
+    with open("baseline.json") as f:
+        baseline = json.load(f)
+    operations = {result["operation"] for result in baseline}
+    assert operations == set(bench.OPERATIONS)
+    assert all(result["calls"] > 0 for result in baseline)
+
+    # everything takes forever in the baseline: no regressions
+    for result in baseline:
+        result["p99"] = 1e6
+    with open("baseline.json", "w") as f:
+        json.dump(baseline, f)
+    assert bench.main(args + ["--baseline", "baseline.json"]) == 0
+
+    # everything is instant in the baseline: regressions
+    for result in baseline:
+        result["p99"] = 0
+    with open("baseline.json", "w") as f:
+        json.dump(baseline, f)
+    assert bench.main(args + ["--baseline", "baseline.json"]) == 1
+
+
+def test_loadtest():
+    spec = importlib.util.spec_from_file_location(
+        "loadtest", os.path.join(here, os.pardir, "benchmarks", "loadtest.py")
+    )
+    loadtest = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(loadtest)
+    args = ["--users", "5", "--concurrency", "2", "--rounds", "4"]
+    assert loadtest.main(args + ["--output", "results.json"]) == 0
+    with open("results.json") as f:
+        results = json.load(f)
+    assert [result["phase"] for result in results] == list(loadtest.PHASES)
+    for result in results:
+        assert result["errors"] == 0
+        assert result["p99"] > 0
+        # the Hub's event loop was measured while it ran
+        assert result["loop_lag_mean"] is not None
@@ -0,0 +1,103 @@
+"""tests for the firstuseauthenticator command-line tool"""
+
+import asyncio
+import json
+
+import pytest
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.cli import main
+from firstuseauthenticator.hashers import BcryptHasher
+from firstuseauthenticator.stores import DBMPasswordStore, SQLitePasswordStore
+
+
+@pytest.fixture
+def config():
+    with open("jupyterhub_config.py", "w") as f:
+        f.write("c.FirstUseAuthenticator.bcrypt_rounds = 4\n")
+
+
+def test_import_export_stats(config, capsys):
+    with open("users.jsonl", "w") as f:
+        f.write(json.dumps({"name": "A", "password": "apassword"}) + "\n")
+        f.write(json.dumps({"name": "b", "password": "bpassword"}) + "\n")
+    assert main(["import", "users.jsonl"]) == 0
+
+    # incomplete records are errors, and don't stop the import
+    with open("incomplete.jsonl", "w") as f:
+        f.write(json.dumps({"name": "c"}) + "\n")
+        f.write(json.dumps({"password": "dpassword"}) + "\n")
+    assert main(["import", "incomplete.jsonl"]) == 1
+
+    assert main(["export", "export.jsonl"]) == 0
+    with open("export.jsonl") as f:
+        exported = [json.loads(line) for line in f]
+    assert sorted(user["name"] for user in exported) == ["a", "b"]
+    assert all(user["hash"].startswith("$2b$04$") for user in exported)
+
+    # import hashes into sqlite
+    assert main(["--store", "sqlite", "import", "export.jsonl"]) == 0
+    store = SQLitePasswordStore(path="passwords.sqlite")
+    assert sorted(store.keys()) == ["a", "b"]
+    store.close()
+
+    capsys.readouterr()
+    assert main(["--store", "sqlite", "stats"]) == 0
+    info = json.loads(capsys.readouterr().out)
+    assert info["users"] == 2
+    assert info["algorithms"] == {"bcrypt": 2}
+    assert info["needs_rehash"] == 0
+
+
+def test_migrate_and_compact(config, capsys):
+    with open("users.jsonl", "w") as f:
+        for i in range(20):
+            f.write(json.dumps({"name": f"user{i}", "hash": "$2b$04$" + "x" * 53}) + "\n")
+    assert main(["import", "users.jsonl"]) == 0
+    assert main(["migrate", "--to", "dbm"]) == 1
+    assert main(["migrate", "--to", "sqlite", "--to-path", "new.sqlite"]) == 0
+    store = SQLitePasswordStore(path="new.sqlite")
+    assert len(list(store.keys())) == 20
+    store.close()
+
+    auth = FirstUseAuthenticator(check_passwords_on_startup=False)
+    asyncio.run(auth.delete_users([f"user{i}" for i in range(10)]))
+    auth.close()
+    assert main(["compact"]) == 0
+    before, after = [
+        int(word) for word in capsys.readouterr().out.split() if word.isdigit()
+    ]
+    assert after < before
+    auth = FirstUseAuthenticator(check_passwords_on_startup=False)
+    assert sorted(auth.password_store.keys()) == sorted(f"user{i}" for i in range(10, 20))
+    auth.close()
+
+
+def test_rehash(config):
+    store = DBMPasswordStore(path="passwords.dbm")
+    hasher = BcryptHasher(rounds=4)
+    store.set_many([("a", hasher.hash(b"apassword")), ("b", hasher.hash(b"bpassword"))])
+    old_b = store.get("b")
+    store.close()
+    with open("passwords.csv", "w") as f:
+        f.write("a,apassword\nb,wrongpassword\nc,cpassword\n")
+    with open("jupyterhub_config.py", "a") as f:
+        f.write("c.FirstUseAuthenticator.bcrypt_rounds = 5\n")
+
+    assert main(["--workers", "2", "rehash", "passwords.csv"]) == 0
+    store = DBMPasswordStore(path="passwords.dbm")
+    assert store.get("a").startswith(b"$2b$05$")
+    assert hasher.verify(b"apassword", store.get("a"))
+    # wrong password, not rehashed
+    assert store.get("b") == old_b
+    assert store.get("c") is None
+    store.close()
+
+
+def test_rehash_invalid_input(config):
+    with open("passwords.json", "w") as f:
+        f.write('{"users": [{"name": "a", "password": 12345678}]}')
+    assert main(["rehash", "passwords.json"]) == 1
+    with open("passwords.json", "w") as f:
+        f.write("not json")
+    assert main(["rehash", "passwords.json"]) == 1
@@ -0,0 +1,63 @@
+"""tests for password hashers"""
+
+from unittest import mock
+
+import pytest
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.hashers import (
+    Argon2Hasher,
+    BcryptHasher,
+    ScryptHasher,
+    identify_hasher,
+)
+
+
+def _argon2_hasher(**kwargs):
+    pytest.importorskip("argon2")
+    return Argon2Hasher(**kwargs)
+
+
+@pytest.mark.parametrize(
+    "make_hasher, cheap, expensive",
+    [
+        (BcryptHasher, dict(rounds=4), dict(rounds=5)),
+        (ScryptHasher, dict(cost=4), dict(cost=5)),
+        (_argon2_hasher, dict(time_cost=1, memory_cost=1024), dict(time_cost=2, memory_cost=1024)),
+    ],
+)
+def test_hasher(make_hasher, cheap, expensive):
+    hasher = make_hasher(**cheap)
+    hashed = hasher.hash(b"password")
+    assert hashed != hasher.hash(b"password")
+    assert identify_hasher(hashed) == hasher.name
+    assert hasher.verify(b"password", hashed)
+    assert not hasher.verify(b"wrong", hashed)
+    assert not hasher.needs_rehash(hashed)
+    assert make_hasher(**expensive).needs_rehash(hashed)
+    # hashes are verified with their own parameters
+    assert make_hasher(**expensive).verify(b"password", hashed)
+
+
+def test_identify_unknown():
+    assert identify_hasher(b"plaintext") is None
+
+
+async def test_migrate_algorithm(tmpcwd):
+    auth = FirstUseAuthenticator(bcrypt_rounds=4)
+    data = {"username": "name", "password": "firstpassword"}
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert identify_hasher(auth.password_store.get("name")) == "bcrypt"
+
+    auth.password_hash_algorithm = "scrypt"
+    auth.scrypt_cost = 4
+    assert await auth.authenticate(mock.Mock(), {"username": "name", "password": "wrong"}) is None
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert auth.password_store.get("name").startswith(b"$scrypt$ln=4,r=8,p=1$")
+    assert await auth.authenticate(mock.Mock(), data) == "name"
+    assert await auth.authenticate(mock.Mock(), {"username": "name", "password": "wrong"}) is None
+
+    # new users use the new algorithm
+    assert await auth.authenticate(mock.Mock(), {"username": "new", "password": "firstpassword"})
+    assert identify_hasher(auth.password_store.get("new")) == "scrypt"
+    auth.close()
@@ -0,0 +1,218 @@
+"""tests for the Redis password store, against an in-process fake server"""
+
+import fnmatch
+import socketserver
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("redis")
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.stores import RedisPasswordStore
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Speak enough of the Redis protocol (RESP2) for RedisPasswordStore"""
+
+    def setup(self):
+        super().setup()
+        self.transaction = None
+        self.channels = set()
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        assert line.startswith(b"*"), line
+        args = []
+        for _ in range(int(line[1:])):
+            size = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(size + 2)[:-2])
+        return args
+
+    def encode(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            return b":%i\r\n" % value
+        if isinstance(value, list):
+            return b"*%i\r\n" % len(value) + b"".join(self.encode(v) for v in value)
+        if isinstance(value, str):
+            return b"+%s\r\n" % value.encode()
+        return b"$%i\r\n%s\r\n" % (len(value), value)
+
+    def send(self, data):
+        with self.server.lock:
+            self.wfile.write(data)
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if args is None:
+                break
+            command = args[0].upper().decode()
+            self.server.commands.append(command)
+            if self.transaction is not None and command not in {"EXEC", "DISCARD"}:
+                self.transaction.append(args)
+                self.send(self.encode("QUEUED"))
+                continue
+            self.send(self.run(command, args[1:]))
+        with self.server.lock:
+            self.server.subscribers.discard(self)
+
+    def run(self, command, args):
+        server = self.server
+        data = server.data
+        if command in {"PING", "CLIENT", "SELECT"}:
+            return self.encode("OK")
+        if command == "MULTI":
+            self.transaction = []
+            return self.encode("OK")
+        if command == "EXEC":
+            queued, self.transaction = self.transaction, None
+            # commands are run while holding the lock, so they are atomic
+            with server.lock:
+                results = [
+                    self.run(q[0].upper().decode(), q[1:]) for q in queued
+                ]
+            return b"*%i\r\n" % len(results) + b"".join(results)
+        if command == "GET":
+            return self.encode(data.get(args[0]))
+        if command == "SET":
+            key, value, *options = args
+            if b"NX" in [o.upper() for o in options] and key in data:
+                return self.encode(None)
+            data[key] = value
+            return self.encode("OK")
+        if command == "DEL":
+            return self.encode(sum(data.pop(key, None) is not None for key in args))
+        if command == "SCAN":
+            # everything in one go
+            pattern = args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*"
+            keys = [k for k in list(data) if fnmatch.fnmatchcase(k.decode(), pattern)]
+            return self.encode([b"0", keys])
+        if command == "PUBLISH":
+            channel, message = args
+            count = 0
+            for subscriber in list(server.subscribers):
+                if channel in subscriber.channels:
+                    subscriber.send(self.encode([b"message", channel, message]))
+                    count += 1
+            return self.encode(count)
+        if command == "SUBSCRIBE":
+            response = b""
+            for channel in args:
+                self.channels.add(channel)
+                response += self.encode([b"subscribe", channel, len(self.channels)])
+            with server.lock:
+                server.subscribers.add(self)
+            return response
+        if command == "UNSUBSCRIBE":
+            self.channels.clear()
+            return self.encode([b"unsubscribe", None, 0])
+        return b"-ERR unknown command '%s'\r\n" % command.encode()
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), FakeRedisHandler)
+        self.data = {}
+        self.commands = []
+        self.subscribers = set()
+        self.lock = threading.RLock()
+
+    @property
+    def url(self):
+        return "redis://127.0.0.1:%i/0" % self.server_address[1]
+
+
+@pytest.fixture
+def redis_server():
+    server = FakeRedisServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timeout"
+        time.sleep(0.01)
+
+
+def test_redis_store_operations(redis_server):
+    store = RedisPasswordStore(url=redis_server.url, local_cache_size=0)
+    assert store.get("a") is None
+    store.set("a", b"hash-a")
+    assert store.get("a") == b"hash-a"
+    assert "a" in store
+    assert store.setdefault("a", b"other") == b"hash-a"
+    assert store.setdefault("b", b"hash-b") == b"hash-b"
+    store.set_many([("c", b"hash-c"), ("d", b"hash-d")])
+    assert sorted(store.keys()) == ["a", "b", "c", "d"]
+    store.delete("a")
+    store.delete_many(["b", "c"])
+    assert sorted(store.keys()) == ["d"]
+    assert redis_server.data == {b"firstuse:password:d": b"hash-d"}
+    store.close()
+
+
+def test_redis_store_pipelines_batches(redis_server):
+    store = RedisPasswordStore(url=redis_server.url, local_cache_size=0)
+    store.set_many((f"user{i}", b"hash") for i in range(100))
+    store.delete_many(f"user{i}" for i in range(50))
+    assert len(list(store.keys())) == 50
+    # one connection from the pool reused, no reconnect per command
+    assert redis_server.commands.count("CLIENT") <= 2
+    store.close()
+
+
+def test_redis_store_cache_invalidation(redis_server):
+    # two replicas
+    store1 = RedisPasswordStore(url=redis_server.url)
+    store2 = RedisPasswordStore(url=redis_server.url)
+    store1.client
+    store2.client
+    wait_for(lambda: store1._subscribed.is_set() and store2._subscribed.is_set())
+
+    store1.set("user", b"old")
+    assert store2.get("user") == b"old"
+    # served from the cache
+    gets = redis_server.commands.count("GET")
+    assert store2.get("user") == b"old"
+    assert redis_server.commands.count("GET") == gets
+
+    # changing the password on one replica evicts it on the other
+    store1.set("user", b"new")
+    wait_for(lambda: "user" not in store2._cache)
+    assert store2.get("user") == b"new"
+
+    store1.delete("user")
+    wait_for(lambda: "user" not in store2._cache)
+    assert store2.get("user") is None
+    store1.close()
+    store2.close()
+
+
+async def test_authenticate_redis(redis_server):
+    auth = FirstUseAuthenticator(password_store_class=RedisPasswordStore)
+    auth.password_store.url = redis_server.url
+    name = "Name"
+    password = "firstpassword"
+    username = await auth.authenticate(mock.Mock(), {"username": name, "password": password})
+    assert username == "name"
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": password}) == "name"
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": "wrongpassword"}) is None
+    assert b"firstuse:password:name" in redis_server.data
+    auth.password_store.close()
@@ -0,0 +1,271 @@
+"""tests for password stores"""
+
+import asyncio
+import dbm
+import os
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.hashers import BcryptHasher
+from firstuseauthenticator.stores import (
+    DBMPasswordStore,
+    JournalPasswordStore,
+    SnapshotPasswordStore,
+    SQLitePasswordStore,
+)
+
+
+@pytest.mark.parametrize(
+    "store_class",
+    [DBMPasswordStore, SQLitePasswordStore, JournalPasswordStore, SnapshotPasswordStore],
+)
+def test_store_operations(store_class):
+    store = store_class(path="passwords-test")
+    assert store.get("a") is None
+    store.set("a", b"hash-a")
+    assert store.get("a") == b"hash-a"
+    assert "a" in store
+    assert store.setdefault("a", b"other") == b"hash-a"
+    assert store.setdefault("b", b"hash-b") == b"hash-b"
+    store.set_many([("c", b"hash-c"), ("d", b"hash-d")])
+    assert sorted(store.keys()) == ["a", "b", "c", "d"]
+    store.delete("a")
+    store.delete("nosuchuser")
+    store.delete_many(["b", "c"])
+    assert sorted(store.keys()) == ["d"]
+    store.close()
+    # reopen
+    store = store_class(path="passwords-test")
+    assert store.get("d") == b"hash-d"
+    store.close()
+
+
+def test_sqlite_concurrent_writers():
+    # separate stores on the same file, like multiple Hub replicas
+    stores = [SQLitePasswordStore(path="passwords.sqlite") for i in range(4)]
+    errors = []
+
+    def write(store, n):
+        try:
+            for i in range(50):
+                store.set(f"user-{n}-{i}", b"hash")
+                store.setdefault("shared", f"hash-{n}".encode())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [
+        threading.Thread(target=write, args=(store, n))
+        for n, store in enumerate(stores)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(list(stores[0].keys())) == 4 * 50 + 1
+    # only the first setdefault wins
+    shared = stores[0].get("shared")
+    assert all(store.get("shared") == shared for store in stores)
+    for store in stores:
+        store.close()
+
+
+def test_sqlite_imports_dbm():
+    with dbm.open("passwords.dbm", "c") as db:
+        db["olduser"] = b"oldhash"
+    store = SQLitePasswordStore(import_dbm_path="passwords.dbm")
+    assert store.path == "passwords.sqlite"
+    assert store.get("olduser") == b"oldhash"
+    store.delete("olduser")
+    store.close()
+
+    # only imported once
+    store = SQLitePasswordStore(import_dbm_path="passwords.dbm")
+    assert store.get("olduser") is None
+    store.close()
+
+
+async def test_authenticate_sqlite():
+    auth = FirstUseAuthenticator(password_store_class=SQLitePasswordStore)
+    name = "Name"
+    password = "firstpassword"
+    username = await auth.authenticate(mock.Mock(), {"username": name, "password": password})
+    assert username == "name"
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": password}) == "name"
+    assert await auth.authenticate(mock.Mock(), {"username": name, "password": "wrongpassword"}) is None
+    row = auth.password_store.conn.execute(
+        "SELECT normalized_username FROM passwords WHERE username = 'name'"
+    ).fetchone()
+    assert row == ("name",)
+    auth.close()
+
+
+async def test_journal_group_commit():
+    store = JournalPasswordStore()
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        time.sleep(0.05)
+        fsync(fd)
+
+    with mock.patch("os.fsync", side_effect=slow_fsync) as fsync_mock:
+        results = await asyncio.gather(
+            *(store.asetdefault(f"user{i}", f"hash{i}".encode()) for i in range(50))
+        )
+    assert results == [f"hash{i}".encode() for i in range(50)]
+    # grouped into a few fsyncs
+    assert fsync_mock.call_count < 10
+    assert await store.asetdefault("user0", b"other") == b"hash0"
+    await store.adelete("user1")
+    assert await store.aget("user1") is None
+    assert len(list(store.keys())) == 49
+    store.close()
+
+    # everything applied to the backing store on close
+    assert os.path.getsize("passwords.dbm.journal") == 0
+    dbm_store = DBMPasswordStore()
+    assert dbm_store.get("user0") == b"hash0"
+    assert dbm_store.get("user1") is None
+    dbm_store.close()
+
+
+def test_journal_compaction():
+    store = JournalPasswordStore(compact_threshold=10)
+    store.set_many((f"user{i}", b"hash") for i in range(10))
+    # applied in the background
+    for i in range(100):
+        if not store._tail:
+            break
+        time.sleep(0.05)
+    assert store._tail == {}
+    assert os.path.getsize(store.path) == 0
+    assert store.store.get("user9") == b"hash"
+    assert store.get("user9") == b"hash"
+    store.close()
+
+
+def test_journal_replay():
+    store = JournalPasswordStore(compact_threshold=1000, compact_interval=1e6)
+    store.set("user", b"hash")
+    store.set("deleted", b"hash")
+    store.delete("deleted")
+    # crash: nothing applied to the backing store, and a half-written record
+    assert store.store.get("user") is None
+    with mock.patch.object(store, "_compact_journal"):
+        store.close()
+    with open(store.path, "ab") as f:
+        f.write(b'["partial", "$2b$')
+
+    store = JournalPasswordStore()
+    assert store.get("user") == b"hash"
+    assert store.get("deleted") is None
+    assert store.get("partial") is None
+    # replayed into the backing store
+    assert store.store.get("user") == b"hash"
+    assert os.path.getsize(store.path) == 0
+    store.close()
+
+
+def test_journal_compaction_failure():
+    store = JournalPasswordStore(compact_threshold=1000, compact_interval=1e6)
+    store.set("alice", b"hash-a")
+    with mock.patch.object(store.store, "set_many", side_effect=OSError("down")):
+        with pytest.raises(OSError):
+            store.compact()
+    # still in the journal, and applied by the next compaction
+    store.set("bob", b"hash-b")
+    store.compact()
+    assert store.store.get("alice") == b"hash-a"
+    assert store.store.get("bob") == b"hash-b"
+    store.close()
+
+
+def test_journal_replay_failure():
+    store = JournalPasswordStore(compact_threshold=1000, compact_interval=1e6)
+    store.set("alice", b"hash-a")
+    # crash, without applying the journal
+    with mock.patch.object(store, "_compact_journal"):
+        store.close()
+
+    store = JournalPasswordStore(compact_interval=0.1)
+    with mock.patch.object(store.store, "set_many", side_effect=OSError("down")):
+        # replay can't be applied, but the journal still works
+        store.set("bob", b"hash-b")
+    assert store.get("alice") == b"hash-a"
+    # applied once the backing store is back
+    for i in range(100):
+        if store.store.get("alice") is not None:
+            break
+        time.sleep(0.05)
+    assert store.store.get("alice") == b"hash-a"
+    assert store.store.get("bob") == b"hash-b"
+    store.close()
+
+
+@pytest.mark.parametrize("store_class", [JournalPasswordStore, SnapshotPasswordStore])
+async def test_check_passwords_wrapped(store_class):
+    # written by FirstUseAuthenticator < 1.0 to the dbm behind the wrapper
+    hashed = BcryptHasher(rounds=4).hash(b"realpassword")
+    with dbm.open("passwords.dbm", "c") as db:
+        db[b"Alice"] = hashed
+
+    auth = FirstUseAuthenticator(password_store_class=store_class)
+    # normalized at startup, not taken over by the first login
+    assert auth.password_store.get("alice") == hashed
+    data = {"username": "alice", "password": "attackerpw"}
+    assert await auth.authenticate(mock.Mock(), data) is None
+    data["password"] = "realpassword"
+    assert await auth.authenticate(mock.Mock(), data) == "alice"
+    auth.close()
+
+    store = DBMPasswordStore()
+    assert list(store.keys()) == ["alice"]
+    assert store.unnormalized_index() == {}
+    store.close()
+
+
+async def test_snapshot_store():
+    dbm_store = DBMPasswordStore()
+    dbm_store.set_many((f"user{i}", f"hash{i}".encode()) for i in range(100))
+    dbm_store.close()
+
+    store = SnapshotPasswordStore(rebuild_interval=1e6)
+    store._start()
+    for i in range(100):
+        if store._snapshot is not None:
+            break
+        time.sleep(0.05)
+    assert store._snapshot.count == 100
+
+    # lookups don't touch the writable store
+    with mock.patch.object(store.store, "get") as get:
+        for i in range(100):
+            assert await store.aget(f"user{i}") == f"hash{i}".encode()
+    assert get.call_count == 0
+    assert store.get("nosuchuser") is None
+
+    # writes are read from the writable store until the next snapshot
+    await store.aset("user0", b"new")
+    assert await store.asetdefault("newuser", b"hash") == b"hash"
+    await store.adelete("user1")
+    assert store.get("user0") == b"new"
+    assert store.get("newuser") == b"hash"
+    assert store.get("user1") is None
+
+    old_snapshot = store._snapshot
+    store.rebuild()
+    assert store._snapshot is not old_snapshot
+    assert store._dirty == set()
+    # lookups still in progress on the old snapshot keep working
+    assert old_snapshot.get(b"user1") == b"hash1"
+    with mock.patch.object(store.store, "get") as get:
+        assert store.get("user0") == b"new"
+        assert store.get("newuser") == b"hash"
+        assert store.get("user2") == b"hash2"
+    assert get.call_count == 0
+    assert store.get("user1") is None
+    store.close()
@@ -0,0 +1,64 @@
+"""tests for login throttling"""
+
+from unittest import mock
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.throttle import LoginThrottle, MemoryThrottleStore
+
+
+def test_exponential_lockout():
+    throttle = LoginThrottle(
+        MemoryThrottleStore(), burst=3, refill_seconds=60, lockout=10, max_lockout=25
+    )
+    assert throttle.failure("key", now=0) == 0
+    assert throttle.failure("key", now=0) == 0
+    assert throttle.failure("key", now=0) == 10
+    assert throttle.locked_for("key", now=5) == 5
+    assert throttle.locked_for("key", now=10) == 0
+    # next failure locks out for twice as long, up to max_lockout
+    assert throttle.failure("key", now=10) == 20
+    assert throttle.failure("key", now=30) == 25
+    throttle.success("key")
+    assert throttle.locked_for("key", now=30) == 0
+
+    # failures are forgiven over time
+    for i in range(10):
+        assert throttle.failure("other", now=i * 60) == 0
+
+
+def test_memory_store_bounded():
+    store = MemoryThrottleStore(max_entries=2)
+    for key in "abc":
+        store.set(key, {})
+    assert len(store) == 2
+    assert store.get("a") is None
+
+
+async def test_throttled_login():
+    auth = FirstUseAuthenticator(
+        bcrypt_rounds=4, login_throttle_failures=2, login_throttle_ip_failures=3
+    )
+    handler = mock.Mock()
+    handler.request.remote_ip = "10.0.0.1"
+    assert await auth.authenticate(handler, {"username": "a", "password": "password"})
+    assert await auth.authenticate(handler, {"username": "b", "password": "password"})
+
+    for i in range(2):
+        assert await auth.authenticate(handler, {"username": "a", "password": "wrong"}) is None
+    assert "Too many failed login attempts" in handler.custom_login_error
+
+    # locked out: rejected without hashing, even with the right password
+    with mock.patch("bcrypt.hashpw") as hashpw:
+        assert await auth.authenticate(handler, {"username": "a", "password": "password"}) is None
+    assert hashpw.call_count == 0
+
+    # other users from another IP are not affected
+    other_handler = mock.Mock()
+    other_handler.request.remote_ip = "10.0.0.2"
+    assert await auth.authenticate(other_handler, {"username": "b", "password": "password"})
+
+    # a third failure from the same IP locks out the IP
+    assert await auth.authenticate(handler, {"username": "b", "password": "wrong"}) is None
+    assert await auth.authenticate(handler, {"username": "b", "password": "password"}) is None
+    assert await auth.authenticate(other_handler, {"username": "b", "password": "password"})
+    auth.close()
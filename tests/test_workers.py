@@ -0,0 +1,77 @@
+"""tests for the pre-forked hash worker pool"""
+
+import os
+from unittest import mock
+
+import pytest
+
+from firstuseauthenticator import FirstUseAuthenticator
+from firstuseauthenticator.workers import WorkerCrashed, WorkerPool
+
+
+def test_worker_pool_recycles_workers():
+    pool = WorkerPool(1, max_jobs=2)
+    try:
+        pids = [pool.submit(os.getpid).result() for i in range(4)]
+        assert os.getpid() not in pids
+        # 2 jobs per worker
+        assert pids[0] == pids[1] != pids[2] == pids[3]
+        with pytest.raises(ZeroDivisionError):
+            pool.submit(divmod, 1, 0).result()
+        assert list(pool.map(divmod, [7, 8], [2, 3])) == [(3, 1), (2, 2)]
+    finally:
+        pool.shutdown()
+    assert pool.pids == set()
+    with pytest.raises(RuntimeError):
+        pool.submit(os.getpid)
+
+
+def test_worker_pool_restarts_crashed_worker():
+    pool = WorkerPool(1, max_jobs=0)
+    try:
+        pid = pool.submit(os.getpid).result()
+        with pytest.raises(WorkerCrashed):
+            pool.submit(os._exit, 1).result()
+        new_pid = pool.submit(os.getpid).result()
+        assert new_pid != pid
+        # the same worker keeps running jobs
+        assert pool.submit(os.getpid).result() == new_pid
+    finally:
+        pool.shutdown()
+
+
+def test_worker_pool_start_failure():
+    pool = WorkerPool(1, max_jobs=0)
+    start_worker = pool._start_worker
+    try:
+        with mock.patch.object(
+            pool, "_start_worker", side_effect=[OSError("no memory"), start_worker()]
+        ):
+            crashed = pool.submit(os._exit, 1)
+            queued = pool.submit(os.getpid)
+            with pytest.raises(WorkerCrashed):
+                crashed.result()
+            # queued jobs fail instead of waiting for a worker
+            with pytest.raises(WorkerCrashed):
+                queued.result(timeout=10)
+            # and the pool keeps trying to start one
+            assert pool.submit(os.getpid).result(timeout=10) != os.getpid()
+    finally:
+        pool.shutdown()
+
+
+async def test_authenticate_prefork():
+    auth = FirstUseAuthenticator(
+        hash_executor_type="prefork", hash_executor_workers=1, bcrypt_rounds=4
+    )
+    assert isinstance(auth.hash_executor, WorkerPool)
+    try:
+        data = {"username": "name", "password": "password"}
+        assert await auth.authenticate(mock.Mock(), data) == "name"
+        assert await auth.authenticate(mock.Mock(), data) == "name"
+        data["password"] = "wrongpassword"
+        assert await auth.authenticate(mock.Mock(), data) is None
+        assert "success" in await auth.reset_password("name", "newpassword")
+    finally:
+        auth.hash_executor.shutdown()
+        auth.password_store.close()